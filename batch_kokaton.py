@@ -0,0 +1,192 @@
+"""
+勇者こうかとんの難易度調整用のバッチ実行
+PolicyInput（--inputs autopilotのときはAutopilotInput）で操作するプレイを画面なしで多数実行し，調整値（Game.tuning）ごとに
+生存時間，スコア，スプライト数の最大値を表にする（プレイはCPUのコア数だけ並列に実行する）
+ex05と同じ階層から実行する（画像はex05/figから読み込む）
+例：python ex05/batch_kokaton.py --sessions 200 --grid spawn_every=100,200 enemy_interval=50:300,30:150
+"""
+import argparse
+import csv
+import itertools
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")  # 画面なしで実行する
+import pygame as pg
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import yusha_kokaton as yk
+
+
+def init_worker():
+    """
+    ワーカープロセスごとに一度だけダミー画面を作成し，画像を読み込む
+    """
+    pg.init()
+    pg.display.set_mode((yk.WIDTH, yk.HEIGHT))
+    yk.assets.load_all()
+
+
+def run_session(task: tuple) -> dict:
+    """
+    1回のプレイを，こうかとんが倒れるかmax_framesに達するまで実行する
+    引数 task：(調整値の番号, 調整値の辞書, 乱数の種, 最大フレーム数, 爆弾の持ち方, 入力の名前)
+    戻り値：生存フレーム数，スコア，グループごとの最大数などの辞書（入力にかかった時間はinput_seconds）
+    """
+    index, tuning, seed, max_frames, engine, source = task
+    game = yk.Game(seed=seed, bomb_engine=engine, tuning=tuning)
+    inputs = yk.input_sources[source]()
+    inputs.attach(game)
+    peaks = dict.fromkeys(game.groups(), 0)
+    peak_total = 0
+    start = time.perf_counter()
+    while game.tmr < max_frames and not game.over:
+        key_lst, downs, _ = inputs.poll()
+        game.step(key_lst, downs)
+        total = 0
+        for name, group in game.groups().items():
+            n = len(group)
+            total += n
+            if n > peaks[name]:
+                peaks[name] = n
+        peak_total = max(peak_total, total)
+    elapsed = time.perf_counter() - start
+    return {"index": index, "seed": seed, "frames": game.tmr, "over": game.over,
+            "score": game.score.score, "kills": game.achievement.score, "level": game.difficult.difficulty,
+            "peak_total": peak_total, **{f"peak_{name}": n for name, n in peaks.items()},
+            "seconds": elapsed, "input_seconds": inputs.stats()["seconds"] if hasattr(inputs, "stats") else 0.0}
+
+
+def parse_value(text: str):
+    """
+    "200"は整数，"50:300"は範囲のタプルにする
+    """
+    if ":" in text:
+        low, high = text.split(":")
+        return int(low), int(high)
+    return int(text)
+
+
+def parse_grid(items: list) -> list:
+    """
+    ["spawn_every=100,200", ...]から，調整値の全ての組み合わせのリストを作る
+    """
+    axes = []
+    for item in items:
+        name, _, values = item.partition("=")
+        if name not in yk.Game.tuning:
+            raise SystemExit(f"unknown tuning parameter: {name} (choose from {', '.join(yk.Game.tuning)})")
+        axes.append([(name, parse_value(v)) for v in values.split(",")])
+    return [dict(combo) for combo in itertools.product(*axes)]
+
+
+def describe(tuning: dict) -> str:
+    if not tuning:
+        return "default"
+    return " ".join(f"{name}={':'.join(map(str, v)) if isinstance(v, tuple) else v}"
+                    for name, v in tuning.items())
+
+
+def run_batch(tasks: list, workers: int) -> tuple[list, float]:
+    """
+    tasksをworkers個のプロセスで実行する
+    戻り値：(tasksと同じ順番の結果のリスト, かかった時間)
+    """
+    chunksize = max(1, len(tasks) // (workers*8))  # 小さすぎると受け渡しの手間が増える
+    start = time.perf_counter()
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+        for i, result in enumerate(executor.map(run_session, tasks, chunksize=chunksize)):
+            results.append(result)
+            print(f"\r{i+1}/{len(tasks)} sessions", end="", file=sys.stderr)
+    print(file=sys.stderr)
+    return results, time.perf_counter() - start
+
+
+def summarize(results: list) -> dict:
+    """
+    同じ調整値のプレイの結果をまとめる（時間は秒）
+    """
+    frames = sorted(r["frames"] for r in results)
+    n = len(frames)
+    rate = yk.Game.rate
+    return {"sessions": n, "survived": sum(not r["over"] for r in results),
+            "mean": sum(frames)/n/rate, "p50": frames[n//2]/rate, "min": frames[0]/rate,
+            "score": sum(r["score"] for r in results)/n, "best": max(r["score"] for r in results),
+            "peak_bombs": max(r["peak_bombs"] for r in results),
+            "peak_total": max(r["peak_total"] for r in results),
+            "steps_per_sec": sum(r["frames"] for r in results)/sum(r["seconds"] for r in results)}
+
+
+def print_table(grid: list, results: list):
+    header = (f"{'tuning':40s} {'n':>5s} {'alive':>5s} {'mean s':>7s} {'p50 s':>7s} {'min s':>6s}"
+              f" {'score':>7s} {'best':>5s} {'bombs':>6s} {'all':>6s} {'steps/s':>8s}")
+    print(header)
+    print("-"*len(header))
+    for index, tuning in enumerate(grid):
+        s = summarize([r for r in results if r["index"] == index])
+        print(f"{describe(tuning):40s} {s['sessions']:5d} {s['survived']:5d} {s['mean']:7.1f} {s['p50']:7.1f}"
+              f" {s['min']:6.1f} {s['score']:7.1f} {s['best']:5d} {s['peak_bombs']:6d} {s['peak_total']:6d}"
+              f" {s['steps_per_sec']:8.0f}")
+
+
+def write_csv(path: str, grid: list, results: list):
+    """
+    1プレイ1行で結果を保存する
+    """
+    names = list(yk.Game.tuning)
+    fields = names + [key for key in results[0] if key != "index"]
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        for r in results:
+            tuning = {**yk.Game.tuning, **grid[r["index"]]}
+            row = {name: ":".join(map(str, v)) if isinstance(v, tuple) else v for name, v in tuning.items()}
+            row.update((key, value) for key, value in r.items() if key != "index")
+            writer.writerow(row)
+
+
+def scaling(tasks: list, workers: int):
+    """
+    同じtasksを1, 2, 4, ...個のプロセスで実行し，速さの伸びを表示する
+    """
+    counts = sorted({min(2**i, workers) for i in range(workers.bit_length()+1)})
+    base = None
+    for count in counts:
+        _, wall = run_batch(tasks, count)
+        base = wall if base is None else base
+        speedup = base / wall
+        print(f"workers {count:3d}  {wall:8.2f} s  speedup x{speedup:5.2f}  efficiency {speedup/count*100:5.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="勇者こうかとんの難易度調整用のバッチ実行")
+    parser.add_argument("--sessions", type=int, default=100, help="調整値ごとのプレイ数")
+    parser.add_argument("--grid", nargs="*", default=[], metavar="NAME=V1,V2",
+                        help=f"試す調整値（範囲はLOW:HIGH）：{', '.join(yk.Game.tuning)}")
+    parser.add_argument("--max-frames", type=int, default=15000, help="1プレイの最大フレーム数")
+    parser.add_argument("--seed", type=int, default=0, help="最初のプレイの乱数の種（調整値が違っても同じ種を使う）")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="並列に実行するプロセス数")
+    parser.add_argument("--bombs", choices=yk.Game.bomb_engines, default="sprite", help="爆弾の持ち方")
+    parser.add_argument("--inputs", choices=("policy", "autopilot"), default="policy",
+                        help="こうかとんの操作（autopilotは爆弾をよけるので長く生き残る）")
+    parser.add_argument("--csv", metavar="PATH", help="1プレイ1行の結果をCSVで保存する")
+    parser.add_argument("--scaling", action="store_true", help="プロセス数を変えて同じバッチを実行し，速さの伸びを表示する")
+    args = parser.parse_args()
+    grid = parse_grid(args.grid) or [{}]
+    tasks = [(index, tuning, args.seed+i, args.max_frames, args.bombs, args.inputs)
+             for index, tuning in enumerate(grid) for i in range(args.sessions)]
+    if args.scaling:
+        scaling(tasks, args.workers)
+        return
+    results, wall = run_batch(tasks, args.workers)
+    print_table(grid, results)
+    print(f"{len(tasks)} sessions in {wall:.1f} s with {args.workers} workers")
+    if args.csv:
+        write_csv(args.csv, grid, results)
+
+
+if __name__ == "__main__":
+    main()
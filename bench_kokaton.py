@@ -0,0 +1,855 @@
+"""
+勇者こうかとんのベンチマーク
+ex05と同じ階層から実行する（画像はex05/figから読み込む）
+例：python ex05/bench_kokaton.py spawn
+"""
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")  # 画面なしで実行する
+import pygame as pg
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import yusha_kokaton as yk
+
+
+def setup() -> pg.Surface:
+    """
+    ダミー画面を作成し，画像を読み込む
+    戻り値：画面Surface
+    """
+    pg.init()
+    screen = pg.display.set_mode((yk.WIDTH, yk.HEIGHT))
+    yk.assets.load_all()
+    return screen
+
+
+def per_call(func, n: int) -> float:
+    """
+    funcをn回呼び出し，1回あたりの時間（マイクロ秒）を返す
+    """
+    start = time.perf_counter()
+    for _ in range(n):
+        func()
+    return (time.perf_counter()-start) / n * 1e6
+
+
+def legacy_beam(bird: yk.Bird):
+    """
+    方向テーブル導入前のビーム生成処理（比較用）
+    """
+    vx, vy = bird.get_direction()
+    angle = math.degrees(math.atan2(-vy, vx))
+    image = pg.transform.rotozoom(pg.image.load(f"{yk.FIG_DIR}/beam.png"), angle, 1.5)
+    vx = math.cos(math.radians(angle))
+    vy = -math.sin(math.radians(angle))
+    rect = image.get_rect()
+    rect.centery = bird.rect.centery+bird.rect.height*vy
+    rect.centerx = bird.rect.centerx+bird.rect.width*vx
+
+
+def legacy_sword(bird: yk.Bird):
+    """
+    方向テーブル導入前の剣生成処理（比較用）
+    """
+    vx, vy = bird.get_direction()
+    angle = math.degrees(math.atan2(-vy, vx))
+    image = pg.transform.rotozoom(pg.image.load(f"{yk.FIG_DIR}/sword-3.png"), angle, 0.4)
+    vx = math.cos(math.radians(angle))
+    vy = -math.sin(math.radians(angle))
+    rect = image.get_rect()
+    rect.centery = bird.rect.centery+bird.rect.height*vy
+    rect.centerx = bird.rect.centerx+bird.rect.width*vx
+
+
+def bench_spawn(args):
+    """
+    ビームと剣の生成コストを方向テーブル導入前後で比較する
+    """
+    setup()
+    bird = yk.Bird(3, (900, 400))
+    bird.dire = (+1, -1)  # 回転が必要な斜め方向で計測する
+    results = {
+        "beam_before": per_call(lambda: legacy_beam(bird), args.n),
+        "beam_after": per_call(lambda: yk.Beam(bird), args.n),
+        "sword_before": per_call(lambda: legacy_sword(bird), args.n),
+        "sword_after": per_call(lambda: yk.Sword(bird, 10), args.n),
+    }
+    for kind in ("beam", "sword"):
+        before, after = results[f"{kind}_before"], results[f"{kind}_after"]
+        print(f"{kind:6s} before {before:9.2f} us  after {after:7.2f} us  x{before/after:.1f}")
+    # 容量を使い切った後も生成し続けたときの，プールの方針ごとの1回あたりの時間と結果
+    for policy in yk.SpritePool.policies:
+        pool = yk.SpritePool(yk.Beam, args.capacity, policy)
+        beams = pg.sprite.Group()
+        spawn = per_call(lambda: pool.spawn(beams, bird), args.n)
+        print(f"pool {policy:7s} {spawn:7.2f} us/spawn  {len(beams)} alive  {pool.stats()}")
+        beams.empty()
+
+
+def legacy_hud(game: yk.Game, screen: pg.Surface, font: pg.font.Font):
+    """
+    HudLayer導入前のHUD描画処理（毎フレームfont.renderする，比較用）
+    """
+    game.hp_bar.refresh()
+    game.hp_bar.blit(screen)
+    screen.blit(font.render(f"Score: {game.score.score}", 0, game.score.color), game.score.rect)
+    count = game.shield_count
+    screen.blit(count.shiled, count.rect2)
+    screen.blit(font.render(f"{game.achievement.score // game.achievement.shield // 5}", 0, count.color), count.rect)
+    screen.blit(font.render(f"Level: {game.difficult.difficulty}", 0, game.difficult.color), game.difficult.rect)
+
+
+def bench_hud(args):
+    """
+    HUDの描画コストをHudLayer導入前後で比較する（値が変わらないフレームと毎フレーム変わる場合）
+    """
+    screen = setup()
+    game = yk.Game(seed=0)
+    font = pg.font.Font(None, 50)
+    layer = game.hud_layer
+
+    def changing(draw):
+        def frame():
+            game.score.score_up(1)
+            draw()
+        return frame
+    before = per_call(lambda: legacy_hud(game, screen, font), args.n)
+    after = per_call(lambda: layer.draw(screen), args.n)
+    before_changing = per_call(changing(lambda: legacy_hud(game, screen, font)), args.n)
+    after_changing = per_call(changing(lambda: layer.draw(screen)), args.n)
+    print(f"steady   before {before:8.2f} us  after {after:8.2f} us  x{before/after:.1f}")
+    print(f"changing before {before_changing:8.2f} us  after {after_changing:8.2f} us  x{before_changing/after_changing:.1f}")
+    print(f"score glyphs rendered {game.score.text.renders}")
+
+
+class LegacyExplosion(pg.sprite.Sprite):
+    """
+    ExplosionField導入前の爆発スプライト（比較用）
+    """
+    def __init__(self, obj, life: int):
+        super().__init__()
+        self.imgs = [yk.assets.get("explosion.gif"), yk.assets.get("explosion.gif", flip=(True, True))]
+        self.image = self.imgs[0]
+        self.rect = self.image.get_rect(center=obj.rect.center)
+        self.life = life
+
+    def update(self):
+        self.life -= 1
+        self.image = self.imgs[self.life//10%2]
+        if self.life < 0:
+            self.kill()
+
+
+def bench_particles(args):
+    """
+    同時にn個ある爆発の1フレームの更新・描画コストと生成コストを，1,000個あたりで比較する
+    """
+    screen = setup()
+    rng = random.Random(args.seed)
+    for n in args.counts:
+        spots = [yk.Spot(pg.Rect(rng.randint(0, yk.WIDTH), rng.randint(0, yk.HEIGHT), 0, 0)) for _ in range(n)]
+        life = 10**9  # 計測中に消えないようにする
+
+        def make_group():
+            group = pg.sprite.Group()
+            for spot in spots:
+                group.add(LegacyExplosion(spot, life))
+            return group
+
+        def make_field():
+            field = yk.ExplosionField()
+            for spot in spots:
+                field.spawn(spot, life)
+            return field
+        per = 1000 / n
+        spawn_before = per_call(make_group, args.repeat) * per
+        spawn_after = per_call(make_field, args.repeat) * per
+        group, field = make_group(), make_field()
+
+        update_before = per_call(group.update, args.frames) * per
+        update_after = per_call(field.update, args.frames) * per
+        draw_before = per_call(lambda: group.draw(screen), args.frames) * per
+        draw_after = per_call(lambda: field.draw(screen), args.frames) * per
+        print(f"explosions={n:6d}  per 1,000 [us]:"
+              f" update {update_before:7.1f} -> {update_after:7.1f} (x{update_before/update_after:.1f})"
+              f"  draw {draw_before:8.1f} -> {draw_after:8.1f} (x{draw_before/draw_after:.1f})"
+              f"  spawn {spawn_before:7.1f} -> {spawn_after:7.1f} (x{spawn_before/spawn_after:.1f})")
+
+
+def legacy_spawn(game: yk.Game):
+    """
+    Scheduler導入前の爆弾投下の判定（毎フレーム全敵機のtmr % intervalを調べる，比較用）
+    """
+    tmr = game.tmr
+    for boss in game.bosses:
+        if boss.state == "stop" and tmr%boss.interval == 0:
+            game.drop_bomb(boss)
+    for emy in game.emys:
+        if emy.state == "stop" and tmr % emy.interval == 0:
+            game.drop_bomb(emy)
+
+
+def bench_schedule(args):
+    """
+    敵機の数ごとに，1フレームの爆弾投下の判定コストをScheduler導入前後で比較する
+    """
+    setup()
+    for n in args.enemies:
+        game = yk.Game(seed=args.seed)
+        game.scheduler = yk.Scheduler()  # 出現と難易度上昇は除き，爆弾投下だけを比べる
+        drops = [0]
+
+        def drop(emy):
+            drops[0] += 1
+        game.drop_bomb = drop
+        for _ in range(n):
+            emy = game.new_enemy()
+            game.add_enemy(game.emys, emy)
+            emy.state = "stop"
+            game.arm(emy)
+        game.tmr = 1  # arm()はtmr+1以降に予約する
+
+        def frame(step):
+            def run():
+                step(game)
+                game.tmr += 1
+            return run
+        before = per_call(frame(legacy_spawn), args.frames)
+        drops_before, drops[0] = drops[0], 0
+        game.tmr = 1
+        after = per_call(frame(lambda game: game.scheduler.run(game.tmr)), args.frames)
+        print(f"enemies={n:6d}  scan {before:9.2f} us  scheduler {after:7.2f} us  x{before/after:6.1f}"
+              f"  drops {drops_before}/{drops[0]}")
+
+
+class Box(pg.sprite.Sprite):
+    """
+    衝突判定の検証用の矩形スプライト
+    """
+    def __init__(self, idx: int, rect: pg.Rect):
+        super().__init__()
+        self.idx = idx
+        self.rect = rect
+
+
+def random_groups(rng: random.Random, sizes: tuple[int, int]) -> tuple[list, list]:
+    """
+    同じ配置の矩形を2組ずつ作る（pygame用と格子用）
+    """
+    worlds = []
+    rects = [[pg.Rect(rng.randint(-50, yk.WIDTH), rng.randint(-50, yk.HEIGHT),
+                      rng.randint(0, 160), rng.randint(0, 160)) for _ in range(n)] for n in sizes]
+    for _ in range(2):
+        worlds.append([pg.sprite.Group([Box(i, r.copy()) for i, r in enumerate(rs)]) for rs in rects])
+    return worlds
+
+
+def bench_collide(args):
+    """
+    groupcollideとSpatialHashの爆弾数ごとの処理時間を比べる（結果の照合はtest_collide.py）
+    """
+    pg.init()
+    rng = random.Random(args.seed)
+    for n in args.bombs:
+        # 1フレーム分の爆弾に関する判定（ビーム，剣，盾，こうかとん）
+        (bombs, beams), _ = random_groups(rng, (n, 20))
+        for s in bombs:
+            s.rect.size = 20, 20
+        swords = pg.sprite.Group(beams.sprites()[:2])
+        shields = pg.sprite.Group(beams.sprites()[2:5])
+        bird = Box(-1, pg.Rect(800, 400, 80, 80))
+        grid = yk.SpatialHash()
+
+        def legacy():
+            pg.sprite.groupcollide(bombs, beams, False, False)
+            pg.sprite.groupcollide(bombs, swords, False, False)
+            pg.sprite.groupcollide(shields, bombs, False, False)
+            pg.sprite.spritecollide(bird, bombs, False)
+
+        def hashed():
+            grid.begin_frame()
+            grid.groupcollide(bombs, beams, False, False)
+            grid.groupcollide(bombs, swords, False, False)
+            grid.groupcollide(shields, bombs, False, False)
+            grid.spritecollide(bird, bombs, False)
+        before = per_call(legacy, args.n)
+        after = per_call(hashed, args.n)
+        print(f"bombs={n:6d}  groupcollide {before:9.1f} us  spatial hash {after:9.1f} us")
+
+
+def bench_render(args):
+    """
+    全体再描画（full），差分描画（dirty），内部解像度を固定したscaledの1フレームあたりの描画時間を比べる
+    """
+    screen = setup()
+    cases = [("full", "full", None), ("dirty", "dirty", None)]
+    cases += [(f"x{scale:g}", "scaled", (scale,)) for scale in args.scales]
+    for label, mode, scales in cases:
+        rng = random.Random(args.seed)
+        yk.random.seed(args.seed)
+        renderer = yk.Renderer(screen, mode, scales=scales)
+        bird = yk.Bird(3, (900, 400))
+        emys = pg.sprite.Group(yk.Enemy() for _ in range(args.enemies))
+        bombs = pg.sprite.Group()
+        for emy in emys:
+            emy.rect.centery = rng.randint(50, yk.HEIGHT//2)
+        emy_list = emys.sprites()
+        for _ in range(args.bombs):
+            bombs.add(yk.Bomb(rng.choice(emy_list), bird))
+        times, pixels = [], 0
+        for tmr in range(args.frames):
+            emys.update()
+            bombs.update()
+            start = time.perf_counter()
+            renderer.draw(tmr % 3200, bird, [emys, bombs], lambda screen: None)
+            renderer.present()
+            times.append(time.perf_counter()-start)
+            pixels += renderer.updated
+        times.sort()
+        print(f"{label:5s} mean {sum(times)/len(times)*1e3:6.2f} ms  p99 {times[len(times)*99//100]*1e3:6.2f} ms"
+              f"  updated {pixels/args.frames/(yk.WIDTH*yk.HEIGHT)*100:5.1f}% of the screen per frame")
+
+
+class StepLimit:
+    """
+    steps回のpoll()の後に終了要求を返す入力（Pipelineの計測用）
+    """
+    def __init__(self, source, steps: int):
+        self.source = source
+        self.left = steps
+
+    def attach(self, game: yk.Game):
+        self.source.attach(game)
+
+    def close(self):
+        pass
+
+    def poll(self) -> tuple:
+        self.left -= 1
+        if self.left < 0:
+            return yk.KeyState(), [], True
+        return self.source.poll()
+
+
+def bench_pipeline(args):
+    """
+    同じプレイを1スレッドで順に（step，描画，転送）実行した場合と，Pipelineでstepを別スレッドにした場合の
+    かかった時間と描いたフレーム数を比べる（どちらも待たずに進める）
+    """
+    screen = setup()
+    for threaded in (False, True):
+        game = yk.Game(invincible=True, seed=args.seed, bomb_engine=args.engine)
+        inputs = StepLimit(yk.PolicyInput(), args.steps)
+        inputs.attach(game)
+        renderer = yk.Renderer(screen)
+        start = time.perf_counter()
+        if threaded:
+            hud = yk.HudMirror()
+            pipeline = yk.Pipeline(game, inputs, depth=args.depth)
+            pipeline.start()
+            while True:
+                snap = pipeline.latest(timeout=1.0)
+                if snap is None:
+                    if pipeline.done:
+                        break
+                    continue
+                hud.apply(snap.tmr, snap.hud)
+                renderer.draw_items(snap.x, pipeline.seq(snap), hud.draw)
+                renderer.present()
+            pipeline.stop()
+            stats = pipeline.stats()
+            frames, extra = stats["rendered"], f"  skipped {stats['skipped']}  blocked {stats['blocked']:.2f} s"
+        else:
+            while True:
+                key_lst, downs, quit = inputs.poll()
+                if quit:
+                    break
+                game.step(key_lst, downs)
+                game.draw(renderer)
+                renderer.present()
+            frames, extra = game.tmr, ""
+        wall = time.perf_counter() - start
+        print(f"{'threaded' if threaded else 'serial':8s} {game.tmr} steps in {wall:6.2f} s"
+              f" ({game.tmr/wall:7.1f} steps/s)  drawn {frames} frames ({frames/wall:7.1f} FPS){extra}"
+              f"  checksum {game.checksum():08x}")
+
+
+def bench_masks(args):
+    """
+    矩形だけの衝突判定とMaskで調べ直す衝突判定の，1stepあたりのcollide()の時間とMaskの判定数を比べる
+    また，1組あたりの時間をMaskを毎回作るpg.sprite.collide_maskと比べる
+    """
+    setup()
+    budget = yk.FrameProfiler.budget
+    for collision in yk.Game.collisions:
+        before = yk.masks.stats()
+        game = yk.Game(invincible=True, seed=args.seed, bomb_engine=args.engine, collision=collision)
+        inputs = yk.PolicyInput()
+        inputs.attach(game)
+        collide, times = game.collide, []
+
+        def timed():
+            start = time.perf_counter()
+            collide()
+            times.append(time.perf_counter()-start)
+        game.collide = timed
+        for _ in range(args.steps):
+            key_lst, downs, _ = inputs.poll()
+            game.step(key_lst, downs)
+        times.sort()
+        after = yk.masks.stats()
+        tests = after["tests"] - before["tests"]
+        print(f"{collision:4s} collide mean {sum(times)/len(times)*1e3:6.3f} ms  p99 {times[len(times)*99//100]*1e3:6.3f} ms"
+              f"  max {times[-1]*1e3:6.3f} ms ({times[-1]/budget*100:4.1f}% of the frame budget)"
+              f"  mask tests {tests} ({tests/args.steps:.2f}/step)  rejected {after['rejects']-before['rejects']}"
+              f"  over budget {after['over_budget']-before['over_budget']}")
+    stats = yk.masks.stats()
+    print(f"masks built {stats['builds']} in {stats['build_ms']:.2f} ms (once per cached image)")
+    # 1組あたりの時間：ビーム8方向と敵機・BOSSの画像の組
+    beams = [img for img, *_ in yk.dir_table("beam.png", 1.5, yk.Bird(3, (0, 0)).rect.size).values()]
+    targets = [yk.assets.get(name) for name in yk.Enemy.imgs]
+    pairs = []
+    for img_a in beams:
+        for img_b in targets:
+            a, b = pg.sprite.Sprite(), pg.sprite.Sprite()
+            a.image, b.image = img_a, img_b
+            a.rect, b.rect = img_a.get_rect(topleft=(0, 0)), img_b.get_rect(topleft=(10, 10))
+            pairs.append((a, b))
+    naive = per_call(lambda: [pg.sprite.collide_mask(a, b) for a, b in pairs], args.repeat) / len(pairs)
+    yk.masks.left = len(pairs) * args.repeat  # 計測中はbudgetで打ち切らない
+    cached = per_call(lambda: [yk.masks.collide(a, b) for a, b in pairs], args.repeat) / len(pairs)
+    yk.masks.begin_frame()
+    print(f"per pair: collide_mask building masks {naive:6.2f} us -> cached masks {cached:5.2f} us"
+          f" (x{naive/cached:.0f})")
+
+
+def bench_telemetry(args):
+    """
+    Telemetry.record()の1回あたりの時間（ゲームのループ側）と，書き出しスレッドの1記録あたりの時間を測る
+    前の実行のファイルをずらして数えないように，毎回新しい一時ディレクトリに書き出す
+    """
+    counts = {name: 10 for name in yk.Telemetry.groups}
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        for path in (os.path.join(tmp, "bench_telemetry.jsonl"), os.path.join(tmp, "bench_telemetry.csv")):
+            sink = yk.Telemetry(path, capacity=args.records)  # 計測中に一杯にならない大きさ
+            start = time.perf_counter()
+            for i in range(args.records):
+                sink.record(i, 0.004, counts, i, 3)
+            recorded = time.perf_counter()
+            sink.close()
+            done = time.perf_counter()
+            size = sum(os.path.getsize(f) for f in [path] + [f"{path}.{k}" for k in range(1, sink.backups+1)]
+                       if os.path.exists(f))
+            print(f"{os.path.basename(path):22s} record {(recorded-start)/args.records*1e6:5.2f} us"
+                  f"  write {(done-recorded)/args.records*1e6:5.2f} us/record (writer thread)"
+                  f"  {size/args.records:5.1f} bytes/record  {sink.stats()}")
+
+
+def bench_snapshots(args):
+    """
+    RewindBufferに記録しながら進めた場合の1stepあたりの時間，WorldStateの大きさと記録・復元の時間を測り，
+    復元したゲーム（爆弾の持ち方を変えたものも）を進めた結果が元のゲームと一致するか確かめる
+    """
+    setup()
+
+    def run(game: yk.Game, steps: int, rewind: yk.RewindBuffer = None):
+        inputs = yk.PolicyInput()
+        inputs.attach(game)
+        for _ in range(steps):
+            key_lst, downs, _ = inputs.poll()
+            game.step(key_lst, downs)
+            if rewind is not None:
+                rewind.offer(game)
+
+    for rewind in (None, yk.RewindBuffer(args.every, int(args.mb * 2**20))):
+        game = yk.Game(invincible=True, seed=args.seed, bomb_engine=args.engine)
+        start = time.perf_counter()
+        run(game, args.steps, rewind)
+        wall = time.perf_counter() - start
+        print(f"{'plain' if rewind is None else 'rewind':6s} {args.steps} steps in {wall:6.2f} s"
+              f" ({wall/args.steps*1e3:6.3f} ms/step)" + ("" if rewind is None else f"  {rewind.stats()}"))
+    state = yk.WorldState.capture(game)
+    capture = per_call(lambda: yk.WorldState.capture(game), args.repeat)
+    restore = per_call(lambda: state.restore(game), args.repeat)
+    sprites = sum(len(group) for group in game.groups().values())
+    print(f"state at step {state.tmr}: {len(state)} bytes for {sprites} sprites"
+          f"  capture {capture:7.1f} us  restore {restore:7.1f} us")
+    run(game, args.check)
+    expected = game.checksum()
+    for engine in yk.Game.bomb_engines:
+        resumed = state.new_game(engine)
+        run(resumed, args.check)
+        match = "match" if resumed.checksum() == expected else "MISMATCH"
+        print(f"resumed with {engine:6s} bombs: {args.check} more steps  checksum {resumed.checksum():08x} {match}")
+    # こうかとんの中心に左上がある爆弾（作り直すときに向きを計算すると0で割る）も戻せるか
+    game = yk.Game(invincible=True, seed=args.seed)
+    bomb = yk.pools["bomb"].spawn(game.bombs, yk.Spot(pg.Rect(0, 0, 0, 0)), game.bird, game.rng)
+    bomb.rect.topleft = game.bird.rect.center
+    state = yk.WorldState.capture(game)
+    for engine in yk.Game.bomb_engines:
+        resumed = state.new_game(engine)
+        same = "match" if yk.WorldState.capture(resumed).data == state.data else "MISMATCH"
+        print(f"bomb at the bird's center restored with {engine:6s} bombs: {same}")
+    # 使い切ったら生成しない方針で，プールの容量より多い爆弾も欠けさせずに戻せるか
+    pool = yk.pools["bomb"]
+    capacity = pool.capacity
+    game = yk.Game(invincible=True, seed=args.seed)
+    fill_bombs(game, capacity + 200)
+    state = yk.WorldState.capture(game)
+    yk.set_pool_policy("drop")
+    pool.capacity = capacity
+    try:
+        resumed = state.new_game("sprite")
+    finally:
+        yk.set_pool_policy("grow")
+    same = "match" if yk.WorldState.capture(resumed).data == state.data else "MISMATCH"
+    print(f"{len(game.bombs)} bombs restored with pool policy drop (capacity {capacity}): {same}")
+
+
+def bench_atlas(args):
+    """
+    グループごとに描く場合とSpriteAtlasから1回のblitsで描く場合の1フレームあたりの描画時間，
+    blitの回数，描いた画像とページの種類の数を比べ，2つの画面が1画素も違わないことを確かめる
+    """
+    screen = setup()
+    cases = [("full", "full", None)] + [(f"x{scale:g}", "scaled", (scale,)) for scale in args.scales]
+    for label, mode, scales in cases:
+        game = yk.Game(invincible=True, seed=args.seed, bomb_engine=args.engine)
+        inputs = yk.PolicyInput()
+        inputs.attach(game)
+        for _ in range(args.warmup):  # 敵機が増えるまで進める
+            key_lst, downs, _ = inputs.poll()
+            game.step(key_lst, downs)
+        plain = yk.Renderer(screen, mode, scales=scales)
+        batched = yk.Renderer(screen, mode, scales=scales, atlas=True)
+        batched.warm(game.sprite_images())
+        times = {plain: [], batched: []}
+        sprites = images = pages = checked = mismatched = 0
+        for frame in range(args.frames):
+            if frame % args.refill == 0:
+                fill_bombs(game, args.bombs - len(game.bombs))
+            key_lst, downs, _ = inputs.poll()
+            game.step(key_lst, downs)
+            groups = [getattr(game, name) for name in yk.Game.draw_order]
+            shots = {}
+            for renderer in ((plain, batched) if frame % 2 else (batched, plain)):  # 先に描く方を入れ替える
+                start = time.perf_counter()
+                renderer.draw(game.x, game.bird, groups, lambda screen: None)
+                times[renderer].append(time.perf_counter() - start)
+                if frame % args.check == 0:
+                    shots[renderer] = pg.image.tobytes(screen, "RGB")
+            if shots:
+                checked += 1
+                mismatched += shots[plain] != shots[batched]
+            seq = yk.Renderer.blit_pairs(game.bird, groups)
+            sprites += len(seq)
+            images += len({img for img, _ in seq})
+            pages += len({page for page, _, _ in batched.atlas.batch(seq)})
+        mean = {renderer: sum(t)/len(t)*1e3 for renderer, t in times.items()}
+        n = args.frames
+        print(f"{label:5s} {sprites/n:6.1f} sprites  groups {mean[plain]:6.3f} ms ({plain.calls} blit calls)"
+              f" -> atlas {mean[batched]:6.3f} ms ({batched.calls} call, saved {batched.saved}/frame)"
+              f"  sources {images/n:4.1f} images -> {pages/n:3.1f} pages"
+              f"  identical {checked-mismatched}/{checked}")
+    print(f"atlas {batched.atlas.stats()}")
+
+
+def bench_autopilot(args):
+    """
+    PolicyInputとAutopilotInputで同じ種のプレイを倒れるかstepsに達するまで進め，生存step数，スコア，
+    到達した難易度，スプライト数の最大値と，入力（poll）とゲーム（step）の1stepあたりの時間を分けて比べる
+    """
+    setup()
+    sources = {"policy": yk.PolicyInput, "autopilot": lambda: yk.AutopilotInput(limit=args.limit)}
+    for name, source in sources.items():
+        frames, scores, levels, polls, steps = [], [], [], [], []
+        peak_bombs = peak_total = 0
+        for seed in range(args.seed, args.seed+args.sessions):
+            game = yk.Game(seed=seed, bomb_engine=args.engine)
+            inputs = source()
+            inputs.attach(game)
+            while game.tmr < args.steps and not game.over:
+                start = time.perf_counter()
+                key_lst, downs, _ = inputs.poll()
+                polled = time.perf_counter()
+                game.step(key_lst, downs)
+                polls.append(polled - start)
+                steps.append(time.perf_counter() - polled)
+                peak_bombs = max(peak_bombs, len(game.bombs))
+                peak_total = max(peak_total, sum(len(group) for group in game.groups().values()))
+            frames.append(game.tmr)
+            scores.append(game.achievement.score)
+            levels.append(game.difficult.difficulty)
+        polls.sort()
+        n = args.sessions
+        print(f"{name:9s} survived {sum(frames)/n:7.0f} steps (min {min(frames)}, max {max(frames)})"
+              f"  kills {sum(scores)/n:5.1f}  level {max(levels)}  peak bombs {peak_bombs} all {peak_total}"
+              f"  input {sum(polls)/len(polls)*1e6:6.1f} us (p99 {polls[len(polls)*99//100]*1e6:7.1f},"
+              f" max {polls[-1]*1e6:7.1f})  step {sum(steps)/len(steps)*1e6:6.1f} us")
+
+
+PHASES = ["input", "spawn", "collision", "update", "draw", "present"]  # メインループの段階
+
+
+def fill_bombs(game: yk.Game, n: int):
+    """
+    画面内のランダムな位置からこうかとんに向けてn個の爆弾を投下する
+    """
+    rng = game.rng
+    for _ in range(n):
+        spot = yk.Spot(pg.Rect(rng.randint(20, yk.WIDTH-20), rng.randint(20, yk.HEIGHT-60), 0, 0))
+        if spot.rect.center != game.bird.rect.center:
+            game.drop_bomb(spot)
+
+
+class Scenario:
+    """
+    ベンチマークの場面
+    """
+    def __init__(self, name: str, setup=None, every_frame=None, scripted: bool = True, unbounded: bool = False,
+                 tuning: dict = None):
+        """
+        引数1 name：場面の名前
+        引数2 setup：開始時にゲームを準備する関数
+        引数3 every_frame：毎フレームの最初に呼ぶ関数（ゲームとフレーム番号を受け取る）
+        引数4 scripted：TrueのときScriptedInputで操作する（Falseのときは何も押さない）
+        引数5 unbounded：Trueのとき爆弾の寿命と上限を外す
+        引数6 tuning：Game.tuningのうち変更する値の辞書
+        """
+        self.name = name
+        self.setup = setup
+        self.every_frame = every_frame
+        self.scripted = scripted
+        self.unbounded = unbounded
+        self.tuning = tuning
+
+
+def max_difficulty(game: yk.Game):
+    """
+    難易度が上限になるまでScriptedInputで進める（難易度の数字だけ変えても，敵機と爆弾は増えない）
+    """
+    inputs = yk.ScriptedInput()
+    while game.difficult.difficulty < game.tuning["max_level"]:
+        key_lst, downs, _ = inputs.poll()
+        game.step(key_lst, downs)
+
+
+def boss_swarm(game: yk.Game, tmr: int):
+    if tmr % 25 == 0:
+        game.ten += 1 if game.ten % 2 else 2  # 敵機を倒したときと同じようにtenを偶数にしてBOSSを呼ぶ
+
+
+SCENARIOS = {s.name: s for s in [
+    Scenario("idle", scripted=False),
+    Scenario("max_difficulty", setup=max_difficulty,  # 上限の難易度では敵機を2倍出す
+             tuning={"extra_spawn_level": yk.Game.tuning["max_level"]}),
+    Scenario("bombs_1k", setup=lambda game: fill_bombs(game, 1000), unbounded=True),
+    Scenario("bombs_10k", setup=lambda game: fill_bombs(game, 10000), unbounded=True),
+    Scenario("boss_swarm", every_frame=boss_swarm),
+]}
+
+
+def summarize(samples: list) -> dict:
+    """
+    計測値（秒）の平均，中央値，99パーセンタイル，最大値をミリ秒で返す
+    """
+    ordered = sorted(samples)
+    n = len(ordered)
+    return {"mean": sum(ordered)/n*1e3, "p50": ordered[n//2]*1e3,
+            "p99": ordered[min(n-1, n*99//100)]*1e3, "max": ordered[-1]*1e3}
+
+
+def run_scenario(scenario: Scenario, screen: pg.Surface, frames: int, seed: int,
+                 engine: str = "sprite") -> dict:
+    """
+    場面をframesフレーム実行し，段階ごとの時間を集計する
+    引数5 engine：爆弾の処理方法（"sprite"／"numpy"）
+    """
+    lifecycle = yk.lifecycle
+    saved = lifecycle.ttl, lifecycle.caps, lifecycle.max_bounces
+    if scenario.unbounded:
+        lifecycle.ttl, lifecycle.caps, lifecycle.max_bounces = {}, {}, None
+    try:
+        game = yk.Game(invincible=True, seed=seed, bomb_engine=engine, tuning=scenario.tuning)
+        if scenario.setup is not None:
+            scenario.setup(game)
+        renderer = yk.Renderer(screen)
+        inputs = yk.ScriptedInput() if scenario.scripted else None
+        nothing = yk.KeyState()
+        samples = {phase: [] for phase in PHASES + ["frame"]}
+        clock = time.perf_counter
+        for tmr in range(frames):
+            if scenario.every_frame is not None:
+                scenario.every_frame(game, tmr)
+            t0 = clock()
+            key_lst, downs, _ = inputs.poll() if inputs is not None else (nothing, [], False)
+            pg.event.pump()
+            game.handle_input(downs)
+            t1 = clock()
+            game.spawn()
+            t2 = clock()
+            game.collide()
+            t3 = clock()
+            game.update(key_lst)
+            t4 = clock()
+            game.draw(renderer)
+            t5 = clock()
+            renderer.present()
+            t6 = clock()
+            for phase, dt in zip(PHASES, (t1-t0, t2-t1, t3-t2, t4-t3, t5-t4, t6-t5)):
+                samples[phase].append(dt)
+            samples["frame"].append(t6-t0)
+        result = {phase: summarize(values) for phase, values in samples.items()}
+        result["entities"] = {name: len(group) for name, group in game.groups().items()}
+        return result
+    finally:
+        lifecycle.ttl, lifecycle.caps, lifecycle.max_bounces = saved
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """
+    基準の結果と比べ，平均またはp99がthreshold（割合）より遅くなった項目を返す
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        for phase in PHASES + ["frame"]:
+            for stat in ("mean", "p99"):
+                old, new = base[phase][stat], result[phase][stat]
+                change = (new-old)/old if old > 0 else 0.0
+                print(f"  {name:15s} {phase:9s} {stat:4s} {old:8.3f} -> {new:8.3f} ms  {change*100:+6.1f}%")
+                if change > threshold and new-old > 0.05:  # 0.05ms未満の差は誤差とみなす
+                    regressions.append((name, phase, stat, old, new))
+    return regressions
+
+
+def bench_scenarios(args):
+    """
+    名前付きの場面ごとに，メインループの段階別の時間を計測する
+    """
+    screen = setup()
+    names = args.only or list(SCENARIOS)
+    results = {}
+    for name in names:
+        result = run_scenario(SCENARIOS[name], screen, args.frames, args.seed, args.engine)
+        results[name] = result
+        frame = result["frame"]
+        print(f"{name:15s} frame mean {frame['mean']:7.3f} p50 {frame['p50']:7.3f}"
+              f" p99 {frame['p99']:7.3f} max {frame['max']:7.3f} ms")
+        for phase in PHASES:
+            r = result[phase]
+            print(f"  {phase:9s} mean {r['mean']:7.3f} p50 {r['p50']:7.3f} p99 {r['p99']:7.3f} max {r['max']:7.3f}")
+        print(f"  entities {result['entities']}")
+    report = {"frames": args.frames, "seed": args.seed, "engine": args.engine, "scenarios": results}
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=1)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["scenarios"]
+        regressions = compare(results, baseline, args.threshold)
+        for name, phase, stat, old, new in regressions:
+            print(f"REGRESSION {name} {phase} {stat}: {old:.3f} -> {new:.3f} ms")
+        if regressions:
+            sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="勇者こうかとんのベンチマーク")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("spawn", help="ビーム・剣の生成コスト")
+    p.add_argument("-n", type=int, default=2000, help="生成回数")
+    p.add_argument("--capacity", type=int, default=500, help="プールの方針を比べるときのプールの容量")
+    p.set_defaults(func=bench_spawn)
+    p = sub.add_parser("hud", help="HUDの描画コスト")
+    p.add_argument("-n", type=int, default=5000, help="描画回数")
+    p.set_defaults(func=bench_hud)
+    p = sub.add_parser("particles", help="爆発エフェクトの更新・描画・生成コスト（1,000個あたり）")
+    p.add_argument("--counts", type=int, nargs="+", default=[100, 1000, 5000])
+    p.add_argument("--frames", type=int, default=100)
+    p.add_argument("--repeat", type=int, default=10, help="生成を計測する回数")
+    p.add_argument("--seed", type=int, default=0)
+    p.set_defaults(func=bench_particles)
+    p = sub.add_parser("schedule", help="敵機の爆弾投下の判定コスト")
+    p.add_argument("--frames", type=int, default=2000)
+    p.add_argument("--enemies", type=int, nargs="+", default=[10, 100, 1000])
+    p.add_argument("--seed", type=int, default=0)
+    p.set_defaults(func=bench_schedule)
+    p = sub.add_parser("collide", help="groupcollideとSpatialHashの衝突判定のコスト")
+    p.add_argument("-n", type=int, default=20, help="計測の繰り返し回数")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--bombs", type=int, nargs="+", default=[100, 1000, 10000])
+    p.set_defaults(func=bench_collide)
+    p = sub.add_parser("render", help="full，dirty，内部解像度ごとのscaledの描画時間")
+    p.add_argument("--frames", type=int, default=500)
+    p.add_argument("--enemies", type=int, default=10)
+    p.add_argument("--bombs", type=int, default=100)
+    p.add_argument("--scales", type=float, nargs="*", default=[0.75, 0.5], help="scaledで比べる倍率")
+    p.add_argument("--seed", type=int, default=0)
+    p.set_defaults(func=bench_render)
+    p = sub.add_parser("pipeline", help="1スレッドとPipeline（stepを別スレッド）の速さ")
+    p.add_argument("--steps", type=int, default=3000)
+    p.add_argument("--depth", type=int, default=2, help="キューの長さ")
+    p.add_argument("--engine", choices=yk.Game.bomb_engines, default="sprite")
+    p.add_argument("--seed", type=int, default=0)
+    p.set_defaults(func=bench_pipeline)
+    p = sub.add_parser("masks", help="矩形とMaskの衝突判定の時間とMaskの判定数")
+    p.add_argument("--steps", type=int, default=6000)
+    p.add_argument("--repeat", type=int, default=200, help="1組あたりの時間を計測する回数")
+    p.add_argument("--engine", choices=yk.Game.bomb_engines, default="sprite")
+    p.add_argument("--seed", type=int, default=0)
+    p.set_defaults(func=bench_masks)
+    p = sub.add_parser("telemetry", help="Telemetryの記録と書き出しの時間")
+    p.add_argument("--records", type=int, default=100000)
+    p.add_argument("--dir", default=None, help="一時ディレクトリを作る場所（既定はシステムの一時ディレクトリ）")
+    p.set_defaults(func=bench_telemetry)
+    p = sub.add_parser("snapshots", help="WorldStateの大きさ，記録・復元の時間と，復元したゲームの一致")
+    p.add_argument("--steps", type=int, default=6000)
+    p.add_argument("--every", type=int, default=50, help="RewindBufferに記録する間隔（step数）")
+    p.add_argument("--mb", type=float, default=8, help="RewindBufferの大きさ（MB）")
+    p.add_argument("--repeat", type=int, default=200, help="記録・復元の時間を計測する回数")
+    p.add_argument("--check", type=int, default=2000, help="復元してから進めて比べるstep数")
+    p.add_argument("--engine", choices=yk.Game.bomb_engines, default="sprite")
+    p.add_argument("--seed", type=int, default=0)
+    p.set_defaults(func=bench_snapshots)
+    p = sub.add_parser("atlas", help="グループごとの描画とSpriteAtlasから1回のblitsで描く場合の時間，blitの回数，画面の一致")
+    p.add_argument("--frames", type=int, default=1000)
+    p.add_argument("--warmup", type=int, default=3000, help="計測の前に進めるstep数")
+    p.add_argument("--bombs", type=int, default=300, help="画面に保つ爆弾の数")
+    p.add_argument("--refill", type=int, default=25, help="爆弾を足す間隔（フレーム数）")
+    p.add_argument("--check", type=int, default=20, help="画面を比べる間隔（フレーム数）")
+    p.add_argument("--scales", type=float, nargs="*", default=[0.5], help="scaledで比べる倍率")
+    p.add_argument("--engine", choices=yk.Game.bomb_engines, default="sprite")
+    p.add_argument("--seed", type=int, default=0)
+    p.set_defaults(func=bench_atlas)
+    p = sub.add_parser("autopilot", help="PolicyInputとAutopilotInputの生存時間と，入力とゲームの1stepあたりの時間")
+    p.add_argument("--sessions", type=int, default=3, help="種ごとのプレイ数")
+    p.add_argument("--steps", type=int, default=15000, help="1プレイの最大step数")
+    p.add_argument("--limit", type=int, default=24, help="AutopilotInputが1フレームに調べる爆弾の数の上限")
+    p.add_argument("--engine", choices=yk.Game.bomb_engines, default="sprite")
+    p.add_argument("--seed", type=int, default=3)
+    p.set_defaults(func=bench_autopilot)
+    p = sub.add_parser("scenarios", help="場面ごとの段階別フレーム時間")
+    p.add_argument("--frames", type=int, default=1000)
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--only", nargs="+", choices=list(SCENARIOS), help="実行する場面")
+    p.add_argument("--engine", choices=["sprite", "numpy"], default="sprite", help="爆弾の処理方法")
+    p.add_argument("--json", metavar="PATH", help="結果をJSONで保存する")
+    p.add_argument("--baseline", metavar="PATH", help="比較する基準のJSON（遅くなったら終了コード1）")
+    p.add_argument("--threshold", type=float, default=0.10, help="遅くなったとみなす割合")
+    p.set_defaults(func=bench_scenarios)
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+"""
+勇者こうかとんのメモリ耐久テスト
+画面なしのゲームを何時間分ものstepだけ進め，一定のゲーム内時間ごとにRSS，Pythonのメモリブロック数，
+グループごとのスプライト数，キャッシュの大きさを記録する
+tracemallocを有効にすると10倍以上遅くなるので，最後の--trace-minutesだけ有効にし，その間に残った確保を
+確保場所（yusha_kokaton.pyの関数）ごとにまとめる
+最初の数分（キャッシュがそろうまで）を除いた増え方がゲーム内1分あたりの上限を超えたら，
+増えた確保場所の一覧を表示して終了コード1で終わる
+ex05と同じ階層から実行する（画像はex05/figから読み込む）
+例：python ex05/soak_kokaton.py --minutes 180 --threshold-kb 64
+"""
+import argparse
+import ast
+import json
+import os
+import resource
+import sys
+import time
+import tracemalloc
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")  # 画面なしで実行する
+import pygame as pg
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import yusha_kokaton as yk
+
+
+def rss_bytes() -> int:
+    """
+    今の常駐メモリ（RSS）のバイト数（/procのない環境では最大RSS）
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def function_table(path: str) -> list:
+    """
+    pathの中の関数の(最初の行, 最後の行, "クラス名.関数名")のリスト（内側の関数ほど後ろ）
+    """
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    table = []
+
+    def visit(node, prefix: str):
+        for child in ast.iter_child_nodes(node):
+            if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                name = f"{prefix}{child.name}"
+                if not isinstance(child, ast.ClassDef):
+                    table.append((child.lineno, child.end_lineno, name))
+                visit(child, f"{name}.")
+    visit(tree, "")
+    return table
+
+
+class Sites:
+    """
+    tracemallocのトレースバックを，yusha_kokaton.pyの中で一番内側の関数名（"Bomb.reset"など）にまとめるクラス
+    """
+    def __init__(self):
+        self.path = os.path.abspath(yk.__file__)
+        self.table = function_table(self.path)
+        self.names = {}  # 行番号 -> 関数名
+
+    def name(self, lineno: int) -> str:
+        name = self.names.get(lineno)
+        if name is None:
+            name = "<module>"
+            for first, last, qualname in self.table:
+                if first <= lineno <= last:
+                    name = qualname  # 内側の関数が後に来るので上書きする
+            self.names[lineno] = name
+        return name
+
+    def site(self, traceback: tracemalloc.Traceback) -> str:
+        for frame in reversed(traceback):  # 新しい呼び出しから順に見る
+            if frame.filename == self.path:
+                return f"{self.name(frame.lineno)} (line {frame.lineno})"
+        frame = traceback[-1]
+        return f"{os.path.basename(frame.filename)}:{frame.lineno}"
+
+    def growth(self, snapshot: tracemalloc.Snapshot, base: tracemalloc.Snapshot) -> list:
+        """
+        戻り値：baseからの増加量の大きい順の(確保場所, 増えたバイト数, 増えた個数)のリスト
+        """
+        total = {}
+        for diff in snapshot.compare_to(base, "traceback"):
+            site = self.site(diff.traceback)
+            size, count = total.get(site, (0, 0))
+            total[site] = size + diff.size_diff, count + diff.count_diff
+        return sorted(((site, size, count) for site, (size, count) in total.items()), key=lambda t: -t[1])
+
+
+def sample(game: yk.Game, minute: float) -> dict:
+    """
+    今のメモリ使用量，グループごとのスプライト数，キャッシュの大きさを記録する
+    （tracedはtracemallocが有効なときだけ）
+    """
+    traced = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None
+    images = {id(sprite.image) for name, group in game.groups().items()
+              if isinstance(group, pg.sprite.AbstractGroup) for sprite in group}
+    return {"minute": minute, "frames": game.tmr, "traced": traced, "rss": rss_bytes(),
+            "blocks": sys.getallocatedblocks(),
+            "groups": {name: len(group) for name, group in game.groups().items()},
+            "pools": {name: pool.stats()["in_use"] + pool.stats()["free"] for name, pool in yk.pools.items()},
+            "caches": {"assets": len(yk.assets.surfaces), "dir_tables": len(yk.dir_tables),
+                       "bomb_imgs": len(yk.Bomb.imgs), "masks": len(yk.masks.masks),
+                       "sprite_images": len(images), "scheduler": len(game.scheduler)}}
+
+
+def slope(samples: list, key: str) -> float:
+    """
+    samplesのkeyのゲーム内1分あたりの増え方（最小二乗法の傾き，バイト/分）
+    """
+    n = len(samples)
+    if n < 2:
+        return 0.0
+    xs = [s["minute"] for s in samples]
+    ys = [s[key] for s in samples]
+    mx, my = sum(xs)/n, sum(ys)/n
+    den = sum((x-mx)**2 for x in xs)
+    return sum((x-mx)*(y-my) for x, y in zip(xs, ys)) / den if den else 0.0
+
+
+def soak(args) -> dict:
+    """
+    args.minutes分のゲーム内時間を進め，記録と判定の結果を返す
+    最後のargs.trace_minutes分だけtracemallocを有効にし，有効にしてから1分後（それより前に確保されて
+    まだ残っているものを数えないため）と最後のスナップショットの差を確保場所ごとにまとめる
+    """
+    pg.init()
+    pg.display.set_mode((yk.WIDTH, yk.HEIGHT))
+    yk.assets.load_all()
+    sites = Sites()
+    game = yk.Game(invincible=True, seed=args.seed, bomb_engine=args.bombs, collision=args.collision)
+    inputs = yk.input_sources[args.inputs]()
+    inputs.attach(game)
+    per_minute = 60 * yk.Game.rate
+    every = max(1, int(args.sample_every * yk.Game.rate))
+    total = int(args.minutes * per_minute)
+    trace_minutes = min(args.trace_minutes, args.minutes - args.warmup)
+    # tracemallocを始めるstep（全体を追うときは最初のstepから）
+    trace_from = max(total - int(trace_minutes * per_minute), 1) if trace_minutes > 1 else None
+    base_at = trace_from + per_minute if trace_from is not None else None  # 比べる元のスナップショットを取るstep
+    samples, base, base_traced = [], None, 0
+    start = time.perf_counter()
+    for frame in range(1, total + 1):
+        if frame == trace_from:
+            tracemalloc.start(args.depth)
+        key_lst, downs, _ = inputs.poll()
+        game.step(key_lst, downs)
+        if frame == base_at:
+            base = tracemalloc.take_snapshot()
+            base_traced = tracemalloc.get_traced_memory()[0]
+        if frame % every:
+            continue
+        minute = frame / per_minute
+        s = sample(game, minute)
+        samples.append(s)
+        traced = f"  traced {s['traced']/2**20:7.2f} MB" if s["traced"] is not None else ""
+        print(f"\r{minute:7.1f} min  rss {s['rss']/2**20:7.1f} MB  blocks {s['blocks']:8d}{traced}"
+              f"  sprites {sum(s['groups'].values()):5d}", end="", file=sys.stderr)
+    print(file=sys.stderr)
+    steady = [s for s in samples if s["minute"] >= args.warmup]
+    result = {"minutes": args.minutes, "frames": game.tmr, "seconds": time.perf_counter() - start,
+              "seed": game.seed, "warmup": args.warmup, "trace_minutes": trace_minutes, "samples": samples,
+              "rss_per_min": slope(steady, "rss"), "blocks_per_min": slope(steady, "blocks"),
+              "traced_per_min": 0.0, "sites": [],
+              "groups_per_min": {name: slope([{"minute": s["minute"], "n": s["groups"][name]} for s in steady], "n")
+                                 for name in game.groups()}}
+    result["sprites_per_min"] = sum(result["groups_per_min"].values())
+    if hasattr(inputs, "stats"):  # AutopilotInputの時間はゲームの時間と分けて表示する
+        result["inputs"] = inputs.stats()
+    if base is not None:
+        result["traced_per_min"] = (tracemalloc.get_traced_memory()[0] - base_traced) / (trace_minutes - 1)
+        result["sites"] = sites.growth(tracemalloc.take_snapshot(), base)[:args.top]
+        tracemalloc.stop()
+    limits = (("traced_per_min", args.threshold_kb*1024), ("blocks_per_min", args.threshold_blocks),
+              ("rss_per_min", args.rss_threshold_kb*1024 if args.rss_threshold_kb is not None else None),
+              ("sprites_per_min", args.threshold_sprites))
+    result["failed"] = [key for key, limit in limits if limit is not None and result[key] > limit]
+    return result
+
+
+def print_report(result: dict):
+    print(f"{'minute':>7s} {'rss MB':>8s} {'blocks':>8s} {'traced MB':>10s} {'sprites':>8s}  groups / caches")
+    for s in result["samples"]:
+        groups = " ".join(f"{name}={n}" for name, n in s["groups"].items() if n)
+        caches = " ".join(f"{name}={n}" for name, n in s["caches"].items())
+        traced = f"{s['traced']/2**20:10.2f}" if s["traced"] is not None else f"{'-':>10s}"
+        print(f"{s['minute']:7.1f} {s['rss']/2**20:8.1f} {s['blocks']:8d} {traced} {sum(s['groups'].values()):8d}"
+              f"  {groups} / {caches}")
+    print(f"{result['frames']} frames ({result['minutes']:g} game minutes) in {result['seconds']:.1f} s")
+    if "inputs" in result:
+        bot = result["inputs"]
+        print(f"inputs: {bot['seconds']:.1f} s of the total, {bot['mean_us']:.1f} us/poll"
+              f" (p99 {bot['p99_us']:.1f}, max {bot['max_us']:.1f})")
+    print(f"growth after {result['warmup']:g} min: rss {result['rss_per_min']/1024:+.1f} KB/min,"
+          f" blocks {result['blocks_per_min']:+.1f}/min,"
+          f" traced {result['traced_per_min']/1024:+.1f} KB/min (last {result['trace_minutes']:g} min)")
+    growing = " ".join(f"{name} {n:+.1f}" for name, n in result["groups_per_min"].items() if abs(n) >= 0.5)
+    print(f"sprites {result['sprites_per_min']:+.1f}/min{f' ({growing})' if growing else ''}")
+    if result["sites"]:
+        print("largest growth by allocation site while tracing:")
+        for site, size, count in result["sites"]:
+            print(f"  {size/1024:+10.1f} KB {count:+8d} blocks  {site}")
+    if result["failed"]:
+        print(f"FAILED: {', '.join(result['failed'])} over the threshold")
+    else:
+        print("OK")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="勇者こうかとんのメモリ耐久テスト")
+    parser.add_argument("--minutes", type=float, default=120, help="進めるゲーム内時間（分）")
+    parser.add_argument("--sample-every", type=float, default=60, help="記録する間隔（ゲーム内の秒数）")
+    parser.add_argument("--warmup", type=float, default=5, help="増え方に含めない最初の時間（分，キャッシュがそろうまで）")
+    parser.add_argument("--trace-minutes", type=float, default=3,
+                        help="tracemallocを有効にする最後の時間（分，最初の1分は比べる元を作るのに使う）")
+    parser.add_argument("--threshold-kb", type=float, default=64,
+                        help="tracemallocで見た増え方の上限（ゲーム内1分あたりKB）")
+    parser.add_argument("--threshold-blocks", type=float, default=None,
+                        help="Pythonのメモリブロック数（sys.getallocatedblocks）の増え方の上限（ゲーム内1分あたり，既定は判定しない）")
+    parser.add_argument("--rss-threshold-kb", type=float, default=None,
+                        help="RSSの増え方の上限（ゲーム内1分あたりKB，既定は判定しない）")
+    parser.add_argument("--threshold-sprites", type=float, default=None,
+                        help="全グループのスプライト数の増え方の上限（ゲーム内1分あたり，既定は判定しない）")
+    parser.add_argument("--top", type=int, default=10, help="表示する確保場所の数")
+    parser.add_argument("--depth", type=int, default=4, help="tracemallocが記録する呼び出しの深さ")
+    parser.add_argument("--inputs", choices=tuple(yk.input_sources), default="policy",
+                        help="こうかとんの操作（autopilotは爆弾をよけて難易度の高い場面まで進む）")
+    parser.add_argument("--bombs", choices=yk.Game.bomb_engines, default="sprite", help="爆弾の持ち方")
+    parser.add_argument("--collision", choices=yk.Game.collisions, default="rect", help="衝突判定")
+    parser.add_argument("--seed", type=int, default=0, help="乱数の種")
+    parser.add_argument("--json", metavar="PATH", help="記録と結果をJSONで保存する")
+    args = parser.parse_args()
+    result = soak(args)
+    print_report(result)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=1)
+    sys.exit(1 if result["failed"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+"""
+SpatialHashの衝突判定がpg.sprite.groupcollide／spritecollideと同じ結果になるかを調べるテスト
+例：python -m pytest ex05
+"""
+import random
+
+import pygame as pg
+import pytest
+
+import yusha_kokaton as yk
+from bench_kokaton import Box, random_groups
+
+
+def as_indices(crashed: dict) -> list:
+    return [(a.idx, [b.idx for b in bs]) for a, bs in crashed.items()]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_spatial_hash_matches_pygame(seed: int):
+    """
+    ランダムな配置，格子の大きさ，dokillの組み合わせの100場面で，衝突の組と残ったスプライトが一致する
+    """
+    rng = random.Random(seed)
+    for trial in range(100):
+        sizes = rng.randint(0, 60), rng.randint(0, 60)
+        dokilla, dokillb = rng.random() < 0.5, rng.random() < 0.5
+        (a1, b1), (a2, b2) = random_groups(rng, sizes)
+        grid = yk.SpatialHash(cell=rng.choice((16, 64, 128, 300)))
+        grid.begin_frame()
+        expect = as_indices(pg.sprite.groupcollide(a1, b1, dokilla, dokillb))
+        got = as_indices(grid.groupcollide(a2, b2, dokilla, dokillb))
+        probe = Box(-1, pg.Rect(rng.randint(0, yk.WIDTH), rng.randint(0, yk.HEIGHT), 90, 90))
+        expect.append([s.idx for s in pg.sprite.spritecollide(probe, b1, True)])
+        got.append([s.idx for s in grid.spritecollide(probe, b2, True)])
+        scene = f"trial {trial}: sizes={sizes} dokill={dokilla, dokillb}"
+        assert got == expect, scene
+        assert [sorted(s.idx for s in g) for g in (a2, b2)] == [sorted(s.idx for s in g) for g in (a1, b1)], scene
@@ -1,10 +1,40 @@
+import argparse
+import array
+import collections
+import heapq
+import json
 import math
+import os
+import queue
 import random
 import sys
+import struct
+import threading
 import time
+import zlib
 import pygame as pg
+try:
+    import numpy as np
+except ImportError:  # numpyがなければ爆弾はスプライトのまま
+    np = None
 WIDTH = 1600  # ゲームウィンドウの幅
 HEIGHT = 900  # ゲームウィンドウの高さ
+FIG_DIR = "ex05/fig"  # 画像ファイルのディレクトリ
+IMPORTED = time.perf_counter()  # このモジュールを読み込んだ時刻
+
+
+def since_start() -> float:
+    """
+    プロセスが起動してからの秒数を返す
+    （/procのない環境では，このモジュールを読み込んでからの秒数）
+    """
+    try:
+        with open("/proc/self/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        started = int(fields[19]) / os.sysconf("SC_CLK_TCK")  # 起動時刻（OS起動からの秒数）
+        return time.clock_gettime(time.CLOCK_BOOTTIME) - started
+    except (OSError, ValueError, IndexError, AttributeError):
+        return time.perf_counter() - IMPORTED
 
 
 
@@ -34,7 +64,525 @@ def calc_orientation(org: pg.Rect, dst: pg.Rect) -> tuple[float, float]:
     return x_diff/norm, y_diff/norm
 
 
-class Bird(pg.sprite.Sprite):
+class AssetCache:
+    """
+    画像ファイルを一度だけ読み込み，変形済みSurfaceを共有するクラス
+    キー：(ファイル名, 角度, 倍率, 反転)
+    """
+    exts = (".png", ".jpg", ".gif")  # 画像として読み込む拡張子
+
+    def __init__(self, fig_dir: str = FIG_DIR):
+        self.fig_dir = fig_dir
+        self.files = {}  # ファイル名 -> 変換済みの元画像
+        self.surfaces = {}  # (ファイル名, 角度, 倍率, 反転) -> 変形済み画像
+        self.hits = 0  # キャッシュから返した回数
+        self.misses = 0  # 変形を計算した回数
+        self.loads = 0  # ディスクから読み込んだ回数
+        self.loader = None  # load_async()で読み込み中のスレッド
+        self.decoded = {}  # ファイル名 -> スレッドで読み込んだ，まだ変換していない画像
+        self.error = None  # スレッドで起きた例外
+        self.lock = threading.Lock()
+
+    def names(self) -> list:
+        """
+        fig_dir内の，まだ読み込んでいない画像ファイル名のリスト
+        """
+        return [name for name in sorted(os.listdir(self.fig_dir))
+                if name.endswith(__class__.exts) and name not in self.files]
+
+    def load_all(self):
+        """
+        fig_dir内の画像をすべて読み込み，表示形式に変換する
+        pg.display.set_modeの後に呼ぶこと
+        """
+        self.wait()
+        for name in self.names():
+            self._load(name)
+
+    def load_async(self):
+        """
+        fig_dir内の残りの画像をバックグラウンドのスレッドで読み込み始める
+        表示形式への変換はメインスレッドのadopt()とwait()で行う
+        """
+        names = self.names()
+        if self.loader is not None or not names:
+            return
+        self.loader = threading.Thread(target=self._decode, args=(names,), daemon=True)
+        self.loader.start()
+
+    def _decode(self, names: list):
+        try:
+            for name in names:
+                img = pg.image.load(os.path.join(self.fig_dir, name))
+                with self.lock:
+                    self.decoded[name] = img
+        except Exception as e:  # wait()でメインスレッドに伝える
+            self.error = e
+
+    def ready(self) -> bool:
+        """
+        バックグラウンドの読み込みが終わっているか
+        """
+        return self.loader is None or not self.loader.is_alive()
+
+    def adopt(self, limit: int = None):
+        """
+        スレッドで読み込み終わった画像を，limit個まで表示形式に変換して使えるようにする
+        """
+        with self.lock:
+            names = list(self.decoded)[:limit]
+            imgs = [self.decoded.pop(name) for name in names]
+        for name, img in zip(names, imgs):
+            self._store(name, img)
+
+    def wait(self):
+        """
+        バックグラウンドの読み込みが終わるのを待ち，残りの画像をすべて変換する（準備完了の待ち合わせ）
+        """
+        if self.loader is not None:
+            self.loader.join()
+            self.loader = None
+        self.adopt()
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def _load(self, name: str) -> pg.Surface:
+        if self.loader is not None:  # 読み込み中のファイルを二重に読まない
+            self.wait()
+            if name in self.files:
+                return self.files[name]
+        return self._store(name, pg.image.load(os.path.join(self.fig_dir, name)))
+
+    def _store(self, name: str, img: pg.Surface) -> pg.Surface:
+        if pg.display.get_surface() is not None:
+            # jpgは透過情報を持たないのでconvert，それ以外はconvert_alpha
+            img = img.convert() if name.endswith(".jpg") else img.convert_alpha()
+        self.files[name] = img
+        self.loads += 1
+        return img
+
+    def get(self, name: str, angle: float = 0, scale: "float|tuple[int, int]" = 1.0,
+            flip: tuple[bool, bool] = (False, False)) -> pg.Surface:
+        """
+        変形済みの共有Surfaceを返す（返り値は書き換えないこと）
+        引数1 name：fig_dir内のファイル名
+        引数2 angle：回転角度
+        引数3 scale：拡大率，または(幅, 高さ)のタプル
+        引数4 flip：(横反転, 縦反転)
+        """
+        key = (name, angle, scale, flip)
+        img = self.surfaces.get(key)
+        if img is not None:
+            self.hits += 1
+            return img
+        self.misses += 1
+        img = self.files.get(name)
+        if img is None:
+            img = self._load(name)
+        if flip != (False, False):
+            img = pg.transform.flip(img, *flip)
+        if isinstance(scale, tuple):
+            img = pg.transform.scale(img, scale)
+            if angle != 0:
+                img = pg.transform.rotozoom(img, angle, 1.0)
+        elif angle != 0 or scale != 1.0:
+            img = pg.transform.rotozoom(img, angle, scale)
+        self.surfaces[key] = img
+        return img
+
+    def stats(self) -> dict:
+        return {"files": len(self.files), "surfaces": len(self.surfaces),
+                "hits": self.hits, "misses": self.misses, "loads": self.loads}
+
+
+assets = AssetCache()
+
+
+DIRECTIONS = [(+1, 0), (+1, -1), (0, -1), (-1, -1), (-1, 0), (-1, +1), (0, +1), (+1, +1)]  # こうかとんの8方向
+dir_tables = {}  # (ファイル名, 倍率, 基準サイズ) -> 方向テーブル
+
+
+def dir_table(name: str, scale: float, size: tuple[int, int]) -> dict:
+    """
+    8方向それぞれの回転済み画像，単位速度ベクトル，発射位置のずれを一度だけ計算して返す
+    引数1 name：回転させる画像のファイル名
+    引数2 scale：画像の拡大率
+    引数3 size：発射元（こうかとん）Rectの(幅, 高さ)
+    戻り値：方向タプル -> (画像, Rect, vx, vy, xのずれ, yのずれ) の辞書
+    """
+    key = (name, scale, size)
+    table = dir_tables.get(key)
+    if table is None:
+        table = {}
+        for dx, dy in DIRECTIONS:
+            angle = math.degrees(math.atan2(-dy, dx))
+            img = assets.get(name, angle, scale)
+            vx = math.cos(math.radians(angle))
+            vy = -math.sin(math.radians(angle))
+            table[(dx, dy)] = img, img.get_rect(), vx, vy, size[0]*vx, size[1]*vy
+        dir_tables[key] = table
+    return table
+
+
+class SpritePool:
+    """
+    スプライトを使い回すための固定容量のフリーリスト
+    kill()されたスプライトはプールに戻り，次のacquireでreset()して再利用される
+    """
+    policies = ("grow", "drop", "recycle")  # 容量を使い切ったときの方針
+
+    def __init__(self, cls: type, capacity: int, policy: str = "grow"):
+        """
+        引数1 cls：プールするスプライトのクラス（reset()を持つPooledのサブクラス）
+        引数2 capacity：同時に使用できる数
+        引数3 policy：使い切ったとき，grow：容量を増やす／drop：生成しない／recycle：最も古いものを再利用
+        """
+        if policy not in __class__.policies:
+            raise ValueError(f"unknown pool policy: {policy}")
+        self.cls = cls
+        self.capacity = capacity
+        self.policy = policy
+        self.free = []  # 再利用を待つスプライト
+        self.in_use = {}  # 使用中のスプライト（挿入順＝古い順）
+        self.high_water = 0  # 同時使用数の最大値
+        self.created = 0  # 新しく生成した数
+        self.reused = 0  # 再利用した数
+        self.dropped = 0  # 生成しなかった数（drop）
+        self.recycled = 0  # 使用中から奪った数（recycle）
+
+    def acquire(self, *args, grow: bool = False) -> "Pooled|None":
+        """
+        スプライトを1つ取り出し，argsで初期化して返す
+        dropの方針で使い切っている場合はNoneを返す
+        引数 grow：Trueのときは方針に関わらず容量を増やす（保存した状態を復元するときに，スプライトを欠けさせない）
+        """
+        if not self.free and len(self.in_use) >= self.capacity:
+            if self.policy == "grow" or grow:
+                self.capacity += 1
+            elif self.policy == "drop":
+                self.dropped += 1
+                return None
+            else:
+                next(iter(self.in_use)).kill()  # 最も古いものをプールに戻す
+                self.recycled += 1
+        if self.free:
+            sprite = self.free.pop()
+            sprite.reset(*args)
+            self.reused += 1
+        else:
+            sprite = self.cls(*args)
+            sprite.pool = self
+            self.created += 1
+        self.in_use[sprite] = None
+        if len(self.in_use) > self.high_water:
+            self.high_water = len(self.in_use)
+        return sprite
+
+    def spawn(self, group: pg.sprite.AbstractGroup, *args, grow: bool = False) -> "Pooled|None":
+        """
+        スプライトを取り出してgroupに追加する（growはacquire()と同じ）
+        """
+        sprite = self.acquire(*args, grow=grow)
+        if sprite is not None:
+            group.add(sprite)
+        return sprite
+
+    def clear(self):
+        """
+        使用中のスプライトを忘れる（新しいプレイを始めるとき）
+        """
+        self.in_use.clear()
+        self.free.clear()
+
+    def release(self, sprite: "Pooled"):
+        if sprite in self.in_use:
+            del self.in_use[sprite]
+            self.free.append(sprite)
+
+    def stats(self) -> dict:
+        return {"capacity": self.capacity, "in_use": len(self.in_use), "free": len(self.free),
+                "high_water": self.high_water, "created": self.created, "reused": self.reused,
+                "dropped": self.dropped, "recycled": self.recycled, "policy": self.policy}
+
+
+class Pooled(pg.sprite.DirtySprite):
+    """
+    SpritePoolで使い回すスプライトの基底クラス
+    サブクラスは__init__の代わりにreset()で状態を初期化する
+    """
+    pool = None  # 所属するプール（プール外で生成した場合はNone）
+
+    def __init__(self, *args):
+        super().__init__()
+        self.reset(*args)
+
+    def reset(self, *args):
+        raise NotImplementedError
+
+    def kill(self):
+        super().kill()
+        if self.pool is not None:
+            self.pool.release(self)
+
+
+class SpatialHash:
+    """
+    画面を一様な格子に分割し，衝突判定の候補を絞り込むクラス
+    pg.sprite.groupcollide／spritecollideと同じ結果と削除の順序を返す
+    格子はbegin_frame()の後，最初に使われたときにグループごとに作られるので，
+    begin_frame()から最後の判定までの間はスプライトを移動・追加しないこと
+    narrowを渡すと，矩形が重なった組だけをnarrow(a, b)で更に調べる（MaskCache.collideなど）
+    """
+    def __init__(self, cell: int = 128, narrow=None):
+        """
+        引数1 cell：格子1マスの大きさ
+        引数2 narrow：矩形が重なった2つのスプライトを受け取り，衝突したかを返す関数（Noneのときは矩形だけ）
+        """
+        self.cell = cell
+        self.narrow = narrow
+        self.grids = {}  # id(グループ) -> (格子, スプライトの順番)
+        self.builds = 0  # 格子を作った回数
+        self.tests = 0  # 矩形の重なりを調べた回数
+
+    def begin_frame(self):
+        """
+        前フレームの格子を捨てる（スプライトが移動した後に呼ぶ）
+        """
+        self.grids.clear()
+
+    def _grid(self, group: pg.sprite.AbstractGroup) -> tuple[dict, dict]:
+        entry = self.grids.get(id(group))
+        if entry is None:
+            cell = self.cell
+            grid = {}
+            order = {}
+            for i, sprite in enumerate(group.sprites()):
+                order[sprite] = i
+                left, top, w, h = sprite.rect
+                x0, x1 = left//cell, (left+w-1)//cell if w > 0 else left//cell
+                y0, y1 = top//cell, (top+h-1)//cell if h > 0 else top//cell
+                if x0 == x1 and y0 == y1:  # ほとんどのスプライトは1マスに収まる
+                    keys = (x0, y0),
+                else:
+                    keys = [(cx, cy) for cx in range(x0, x1+1) for cy in range(y0, y1+1)]
+                for key in keys:
+                    bucket = grid.get(key)
+                    if bucket is None:
+                        grid[key] = [sprite]
+                    else:
+                        bucket.append(sprite)
+            entry = grid, order
+            self.grids[id(group)] = entry
+            self.builds += 1
+        return entry
+
+    def candidates(self, rect: pg.Rect, group: pg.sprite.AbstractGroup) -> list:
+        """
+        rectと同じマスにある，group内のスプライトをグループの順番で返す
+        """
+        grid, order = self._grid(group)
+        cell = self.cell
+        x0, x1 = rect.left//cell, max(rect.left, rect.right-1)//cell
+        y0, y1 = rect.top//cell, max(rect.top, rect.bottom-1)//cell
+        if x0 == x1 and y0 == y1:
+            return grid.get((x0, y0), [])
+        found = {}
+        for cx in range(x0, x1+1):
+            for cy in range(y0, y1+1):
+                for sprite in grid.get((cx, cy), ()):
+                    found[sprite] = None
+        return sorted(found, key=order.__getitem__)
+
+    def spritecollide(self, sprite: pg.sprite.Sprite, group: pg.sprite.AbstractGroup,
+                      dokill: bool) -> list:
+        """
+        pg.sprite.spritecollideと同じ
+        """
+        rect = sprite.rect
+        cands = self.candidates(rect, group)
+        self.tests += len(cands)
+        hits = [s for s in cands if rect.colliderect(s.rect) and s in group]
+        if hits and self.narrow is not None:
+            hits = [s for s in hits if self.narrow(sprite, s)]
+        if dokill:
+            for s in hits:
+                s.kill()
+        return hits
+
+    def groupcollide(self, groupa: pg.sprite.AbstractGroup, groupb: pg.sprite.AbstractGroup,
+                     dokilla: bool, dokillb: bool) -> dict:
+        """
+        pg.sprite.groupcollideと同じ
+        groupaの方がずっと多いときは，groupaの格子をgroupbの各スプライトで引く
+        """
+        if len(groupa) > 4*len(groupb):
+            return self._groupcollide_rev(groupa, groupb, dokilla, dokillb)
+        crashed = {}
+        for sprite in groupa.sprites():
+            hits = self.spritecollide(sprite, groupb, dokillb)
+            if hits:
+                crashed[sprite] = hits
+                if dokilla:
+                    sprite.kill()
+        return crashed
+
+    def _groupcollide_rev(self, groupa: pg.sprite.AbstractGroup, groupb: pg.sprite.AbstractGroup,
+                          dokilla: bool, dokillb: bool) -> dict:
+        pairs = {}  # groupaのスプライト -> 重なるgroupbのスプライト（groupbの順番）
+        for b in groupb.sprites():
+            rect = b.rect
+            cands = self.candidates(rect, groupa)
+            self.tests += len(cands)
+            for a in cands:
+                # 格子を作った後に消されたものは除く
+                if rect.colliderect(a.rect) and a in groupa and (self.narrow is None or self.narrow(a, b)):
+                    hits = pairs.get(a)
+                    if hits is None:
+                        pairs[a] = [b]
+                    else:
+                        hits.append(b)
+        order = self._grid(groupa)[1]
+        crashed = {}
+        killed = set()
+        # groupaの順番に処理し，先に消されたgroupbのスプライトは後のものと衝突させない
+        for a in sorted(pairs, key=order.__getitem__):
+            hits = pairs[a]
+            if dokillb:
+                hits = [b for b in hits if b not in killed]
+                if not hits:
+                    continue
+                for b in hits:
+                    b.kill()
+                    killed.add(b)
+            crashed[a] = hits
+            if dokilla:
+                a.kill()
+        return crashed
+
+
+class MaskCache:
+    """
+    画像ごとのpg.mask.Maskを一度だけ作って覚えておくクラス（衝突判定の精密判定に使う）
+    画像はAssetCacheやdir_tableで回転・拡大ごとに使い回されるので，Maskも回転済みの画像ごとに1つだけになる
+    1stepで調べる組の数にbudgetの上限があり，超えた分は矩形の重なりだけで衝突とみなす（時間ではなく数で
+    決めるので，同じ入力なら同じ結果になる）
+    """
+    budget = 2000  # 1stepでMaskを重ねて調べる組の数の上限（1組0.5 µs程度）
+
+    def __init__(self):
+        self.masks = {}  # 画像 -> Mask
+        self.builds = 0  # Maskを作った回数
+        self.build_time = 0.0  # Maskを作るのにかかった時間（秒）
+        self.tests = 0  # Maskを重ねて調べた回数
+        self.rejects = 0  # 矩形は重なったがMaskは重ならなかった回数
+        self.over = 0  # budgetを超えて矩形だけで判定した回数
+        self.left = __class__.budget  # このstepで調べられる残りの組の数
+
+    def begin_frame(self):
+        self.left = __class__.budget
+
+    def get(self, img: pg.Surface) -> pg.mask.Mask:
+        mask = self.masks.get(img)
+        if mask is None:
+            start = time.perf_counter()
+            mask = self.masks[img] = pg.mask.from_surface(img)
+            self.build_time += time.perf_counter() - start
+            self.builds += 1
+        return mask
+
+    def warm(self, imgs):
+        """
+        imgsのMaskを前もって作る
+        """
+        for img in imgs:
+            self.get(img)
+
+    def overlap(self, img_a: pg.Surface, pos_a: tuple, img_b: pg.Surface, pos_b: tuple) -> bool:
+        """
+        左上がpos_aのimg_aとpos_bのimg_bの不透明な画素が重なるか（矩形は重なっているものとする）
+        """
+        if self.left <= 0:
+            self.over += 1
+            return True
+        self.left -= 1
+        self.tests += 1
+        if self.get(img_a).overlap(self.get(img_b), (pos_b[0]-pos_a[0], pos_b[1]-pos_a[1])) is None:
+            self.rejects += 1
+            return False
+        return True
+
+    def collide(self, a: pg.sprite.Sprite, b: pg.sprite.Sprite) -> bool:
+        """
+        SpatialHashのnarrowに渡す（スプライトのimageとrectで調べる）
+        """
+        return self.overlap(a.image, a.rect.topleft, b.image, b.rect.topleft)
+
+    def stats(self) -> dict:
+        return {"masks": len(self.masks), "builds": self.builds, "build_ms": self.build_time*1e3,
+                "tests": self.tests, "rejects": self.rejects, "over_budget": self.over}
+
+
+masks = MaskCache()
+
+
+class Timer:
+    """
+    Schedulerに予約したイベント（cancel()で取り消す）
+    """
+    __slots__ = ("func", "args", "cancelled")
+
+    def __init__(self, func, args: tuple):
+        self.func = func
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class Scheduler:
+    """
+    step番号を時刻とするイベントの予定表（ヒープ）
+    run()の手間はその時刻に実行するイベントの数で決まり，敵機の数には依存しない
+    同じ時刻のイベントはorderの小さい順に実行する
+    """
+    def __init__(self):
+        self.heap = []  # (時刻, order, 予約順, Timer)
+        self.seq = 0
+        self.fired = 0  # 実行したイベントの数
+        self.skipped = 0  # 取り消されていて実行しなかったイベントの数
+
+    def __len__(self) -> int:
+        return len(self.heap)
+
+    def at(self, due: int, order: tuple, func, *args) -> Timer:
+        """
+        時刻dueにfunc(*args)を実行するよう予約する
+        引数1 due：実行するstep番号
+        引数2 order：同じ時刻のイベントの中での順番
+        戻り値：取り消しに使うTimer
+        """
+        timer = Timer(func, args)
+        heapq.heappush(self.heap, (due, order, self.seq, timer))
+        self.seq += 1
+        return timer
+
+    def run(self, now: int):
+        """
+        時刻now以前のイベントをすべて実行する
+        """
+        heap = self.heap
+        while heap and heap[0][0] <= now:
+            timer = heapq.heappop(heap)[3]
+            if timer.cancelled:
+                self.skipped += 1
+                continue
+            self.fired += 1
+            timer.func(*timer.args)
+
+
+class Bird(pg.sprite.DirtySprite):
     """
     ゲームキャラクター（こうかとん）に関するクラス
     """
@@ -52,8 +600,8 @@ class Bird(pg.sprite.Sprite):
         引数2 xy：こうかとん画像の位置座標タプル
         """
         super().__init__()
-        img0 = pg.transform.rotozoom(pg.image.load(f"ex05/fig/{num}.png"), 0, 1.5)
-        img = pg.transform.flip(img0, True, False)  # デフォルトのこうかとん
+        img0 = assets.get(f"{num}.png", 0, 1.5)
+        img = assets.get(f"{num}.png", 0, 1.5, (True, False))  # デフォルトのこうかとん
         self.imgs = {
             (+1, 0): img,  # 右
             (+1, -1): pg.transform.rotozoom(img, 45, 1.0),  # 右上
@@ -73,20 +621,21 @@ class Bird(pg.sprite.Sprite):
         self.max_hp = 3  # 最大HP
         self.hp = self.max_hp  # 現在のHP
 
-    def change_img(self, num: int, screen: pg.Surface):
+    def change_img(self, num: int, screen: pg.Surface = None):
         """
         こうかとん画像を切り替え，画面に転送する
         引数1 num：こうかとん画像ファイル名の番号
-        引数2 screen：画面Surface
+        引数2 screen：画面Surface（Noneのときは切り替えのみ）
         """
-        self.image = pg.transform.rotozoom(pg.image.load(f"ex05/fig/{num}.png"), 0, 2.0)
-        screen.blit(self.image, self.rect)
+        self.image = assets.get(f"{num}.png", 0, 2.0)
+        if screen is not None:
+            screen.blit(self.image, self.rect)
 
-    def update(self, key_lst: list[bool], screen: pg.Surface):
+    def update(self, key_lst: list[bool], screen: pg.Surface = None):
         """
         押下キーに応じてこうかとんを移動させる
         引数1 key_lst：押下キーの真理値リスト
-        引数2 screen：画面Surface
+        引数2 screen：画面Surface（Noneのときは移動だけ行い，描画はRendererに任せる）
         """
         sum_mv = [0, 0]
         for k, mv in __class__.delta.items():
@@ -101,8 +650,8 @@ class Bird(pg.sprite.Sprite):
         if not (sum_mv[0] == 0 and sum_mv[1] == 0):
             self.dire = tuple(sum_mv)
             self.image = self.imgs[self.dire]
-        screen.blit(self.image, self.rect)
-    
+        if screen is not None:
+            screen.blit(self.image, self.rect)
 
     def get_direction(self) -> tuple[int, int]:
         return self.dire
@@ -114,61 +663,80 @@ class Bird(pg.sprite.Sprite):
         return self.hp <= 0
 
 
-class Bomb(pg.sprite.Sprite):
+class Bomb(Pooled):
     """
     爆弾に関するクラス
     """
     colors = [(255, 0, 0), (0, 255, 0), (0, 0, 255), (255, 255, 0), (255, 0, 255), (0, 255, 255)]
+    imgs = {}  # 色 -> 爆弾円Surface
+
+    @classmethod
+    def get_img(cls, color: tuple[int, int, int], rad: int) -> pg.Surface:
+        """
+        色ごとの爆弾円Surfaceを一度だけ生成して返す
+        """
+        img = cls.imgs.get((color, rad))
+        if img is None:
+            img = pg.Surface((2*rad, 2*rad))
+            pg.draw.circle(img, color, (rad, rad), rad)
+            img.set_colorkey((0, 0, 0))
+            cls.imgs[(color, rad)] = img
+        return img
 
-    def __init__(self, emy: "Enemy", bird: Bird):
+    def reset(self, emy: "Enemy", bird: Bird, rng: random.Random = random):
         """
-        爆弾円Surfaceを生成する
+        爆弾円Surfaceを設定する
         引数1 emy：爆弾を投下する敵機
         引数2 bird：攻撃対象のこうかとん
+        引数3 rng：乱数生成器（既定はrandomモジュール）
         """
-        super().__init__()
         rad = 10  # 爆弾円の半径：10以上50以下の乱数
-        color = random.choice(__class__.colors)  # 爆弾円の色：クラス変数からランダム選択
-        self.image = pg.Surface((2*rad, 2*rad))
-        pg.draw.circle(self.image, color, (rad, rad), rad)
-        self.image.set_colorkey((0, 0, 0))
+        color = rng.choice(__class__.colors)  # 爆弾円の色：クラス変数からランダム選択
+        self.image = __class__.get_img(color, rad)
         self.rect = self.image.get_rect()
         # 爆弾を投下するemyから見た攻撃対象のbirdの方向を計算
         self.vx, self.vy = calc_orientation(emy.rect, bird.rect)
         self.rect.centerx = emy.rect.centerx
         self.rect.centery = emy.rect.centery+emy.rect.height/2
         self.speed = 6
+        self.age = 0  # 投下されてからのフレーム数
+        self.bounces = 0  # 画面端で跳ね返った回数
 
     def update(self):
         """
         爆弾を速度ベクトルself.vx, self.vyに基づき移動させる
+        跳ね返りの回数がlifecycle.max_bouncesを超えたら消える
         引数 screen：画面Surface
         """
+        self.age += 1
         self.rect.move_ip(+self.speed*self.vx, +self.speed*self.vy)
-        if check_bound(self.rect) == (False, True):
+        bound = check_bound(self.rect)
+        if bound == (False, True):
             self.vx *= -1
-        if check_bound(self.rect) == (True, False):
+            self.bounces += 1
+        elif bound == (True, False):
             self.vy *= -1
+            self.bounces += 1
+        else:
+            return
+        if lifecycle.max_bounces is not None and self.bounces > lifecycle.max_bounces:
+            lifecycle.retire(self, "bomb", "bounce")
 
 
-class Beam(pg.sprite.Sprite):
+class Beam(Pooled):
     """
     ビームに関するクラス
     """
-    def __init__(self, bird: Bird):
+    def reset(self, bird: Bird):
         """
-        ビーム画像Surfaceを生成する
+        ビーム画像Surfaceを設定する
         引数 bird：ビームを放つこうかとん
         """
-        super().__init__()
-        self.vx, self.vy = bird.get_direction()
-        angle = math.degrees(math.atan2(-self.vy, self.vx))
-        self.image = pg.transform.rotozoom(pg.image.load(f"ex05/fig/beam.png"), angle, 1.5)
-        self.vx = math.cos(math.radians(angle))
-        self.vy = -math.sin(math.radians(angle))
-        self.rect = self.image.get_rect()
-        self.rect.centery = bird.rect.centery+bird.rect.height*self.vy
-        self.rect.centerx = bird.rect.centerx+bird.rect.width*self.vx
+        table = dir_table("beam.png", 1.5, bird.rect.size)
+        self.image, rect, self.vx, self.vy, ox, oy = table[bird.get_direction()]
+        self.rect = rect.copy()
+        self.rect.centery = bird.rect.centery+oy
+        self.rect.centerx = bird.rect.centerx+ox
         self.speed = 10
 
     def update(self):
@@ -181,7 +749,7 @@ class Beam(pg.sprite.Sprite):
             
             self.kill()
 
-class Sword(pg.sprite.Sprite):
+class Sword(pg.sprite.DirtySprite):
     """
     剣に関するクラス
     """
@@ -192,14 +760,11 @@ class Sword(pg.sprite.Sprite):
         引数2 life: 剣をしまう時間
         """
         super().__init__()
-        self.vx, self.vy = bird.get_direction()
-        angle = math.degrees(math.atan2(-self.vy, self.vx))
-        self.image = pg.transform.rotozoom(pg.image.load("ex05/fig/sword-3.png"), angle, 0.4)
-        self.vx = math.cos(math.radians(angle))
-        self.vy = -math.sin(math.radians(angle))
-        self.rect = self.image.get_rect()
-        self.rect.centery = bird.rect.centery+bird.rect.height*self.vy
-        self.rect.centerx = bird.rect.centerx+bird.rect.width*self.vx
+        table = dir_table("sword-3.png", 0.4, bird.rect.size)
+        self.image, rect, self.vx, self.vy, self.ox, self.oy = table[bird.get_direction()]
+        self.rect = rect.copy()
+        self.rect.centery = bird.rect.centery+self.oy
+        self.rect.centerx = bird.rect.centerx+self.ox
         self.life=life
     def update(self,bird: Bird):
         """
@@ -207,57 +772,122 @@ class Sword(pg.sprite.Sprite):
         時間がたったら剣をしまうようにする
         引数1 bird: 剣の向き
         """
-        self.rect.centery = bird.rect.centery+bird.rect.height*self.vy
-        self.rect.centerx = bird.rect.centerx+bird.rect.width*self.vx
+        self.rect.centery = bird.rect.centery+self.oy
+        self.rect.centerx = bird.rect.centerx+self.ox
         self.life -= 1
         if self.life < 0:
             self.kill()
 
 
 
-class Explosion(pg.sprite.Sprite):
+class Blast:
+    """
+    爆発1つ分の記録（左上の位置と残りの爆発時間だけを持つ）
+    """
+    __slots__ = ("x", "y", "life")
+
+    def __init__(self, x: int, y: int, life: int):
+        self.x = x
+        self.y = y
+        self.life = life
+
+
+class ExplosionField:
     """
-    爆発に関するクラス
+    爆発エフェクトをBlastのリストで持ち，まとめて進めて1回のblitsで描画するクラス
+    爆発画像（そのままと上下左右反転の2枚）はすべての爆発で共有する
+    リストは発生した順（＝古い順）に並ぶ
     """
-    def __init__(self, obj: "Bomb|Enemy", life: int):
+    def __init__(self):
+        self.imgs = [assets.get("explosion.gif"), assets.get("explosion.gif", flip=(True, True))]
+        self.size = self.imgs[0].get_size()
+        self.blasts = []
+
+    def __len__(self) -> int:
+        return len(self.blasts)
+
+    def spawn(self, obj: "Bomb|Enemy|BOSS", life: int):
         """
-        爆弾が爆発するエフェクトを生成する
+        objの中心で爆発させる
         引数1 obj：爆発するBombまたは敵機インスタンス
         引数2 life：爆発時間
         """
-        super().__init__()
-        img = pg.image.load("ex05/fig/explosion.gif")
-        self.imgs = [img, pg.transform.flip(img, 1, 1)]
-        self.image = self.imgs[0]
-        self.rect = self.image.get_rect(center=obj.rect.center)
-        self.life = life
+        rect = self.imgs[0].get_rect(center=obj.rect.center)
+        self.blasts.append(Blast(rect.x, rect.y, life))
 
     def update(self):
         """
-        爆発時間を1減算した爆発経過時間_lifeに応じて爆発画像を切り替えることで
-        爆発エフェクトを表現する
+        全ての爆発の爆発時間を1減らし，尽きたものを消す（画像は描画時にlifeから決まる）
         """
-        self.life -= 1
-        self.image = self.imgs[self.life//10%2]
-        if self.life < 0:
-            self.kill()
+        alive = []
+        for blast in self.blasts:
+            blast.life -= 1
+            if blast.life >= 0:
+                alive.append(blast)
+        self.blasts = alive
+
+    def evict(self, k: int) -> int:
+        """
+        古い順にk個の爆発を消す
+        """
+        del self.blasts[:k]
+        return k
+
+    def rect_values(self) -> list:
+        """
+        全爆発のRectを(x, y, 幅, 高さ)の順に並べたリスト（Game.checksum用）
+        """
+        w, h = self.size
+        values = []
+        for blast in self.blasts:
+            values += blast.x, blast.y, w, h
+        return values
+
+    def blit_seq(self) -> list:
+        """
+        戻り値：爆発時間に応じて2枚の画像を切り替えた(画像, 左上の位置)のリスト
+        """
+        imgs = self.imgs
+        return [(imgs[blast.life//10%2], (blast.x, blast.y)) for blast in self.blasts]
+
+    def draw(self, screen: pg.Surface, rects: bool = False) -> "list|None":
+        """
+        全ての爆発をまとめて1回のblitsで描画する
+        引数2 rects：Trueのとき描画した矩形のリストを返す
+        """
+        seq = self.blit_seq()
+        if hasattr(screen, "fblits"):  # pygame 2.6以降
+            screen.fblits(seq)
+        else:
+            screen.blits(seq, doreturn=False)
+        if rects:
+            w, h = self.size
+            return [pg.Rect(blast.x, blast.y, w, h) for blast in self.blasts]
 
 
-class Enemy(pg.sprite.Sprite):
+class Enemy(pg.sprite.DirtySprite):
     """
     敵機に関するクラス
     """
-    imgs = [pg.image.load(f"ex05/fig/alien{i}.png") for i in range(1, 4)]
-    
-    def __init__(self):
+    imgs = [f"alien{i}.png" for i in range(1, 4)]  # 画像はassetsから取得する
+
+    def __init__(self, rng: random.Random = random, interval: tuple[int, int] = (50, 300),
+                 bound: tuple[int, int] = (20, HEIGHT-20)):
+        """
+        引数1 rng：乱数生成器（既定はrandomモジュール）
+        引数2 interval：爆弾投下インターバルの範囲
+        引数3 bound：停止位置の範囲
+        """
         super().__init__()
-        self.image = random.choice(__class__.imgs)
+        self.image = assets.get(rng.choice(__class__.imgs))
         self.rect = self.image.get_rect()
-        self.rect.center = random.randint(50, WIDTH-50), 0
+        self.rect.center = rng.randint(50, WIDTH-50), 0
         self.vy = +6
-        self.bound = random.randint(20, HEIGHT-20)  # 停止位置
+        self.bound = rng.randint(*bound)  # 停止位置
         self.state = "down"  # 降下状態or停止状態
-        self.interval = random.randint(50, 300)  # 爆弾投下インターバル
+        self.interval = rng.randint(*interval)  # 爆弾投下インターバル
+        self.on_stop = None  # 停止状態になったときに呼ぶ関数（敵機を受け取る）
+        self.timer = None  # 次の爆弾投下の予約
 
     def update(self):
         """
@@ -267,29 +897,45 @@ class Enemy(pg.sprite.Sprite):
         """
         if self.rect.centery > self.bound:
             self.vy = 0
-            self.state = "stop"
+            if self.state != "stop":
+                self.state = "stop"
+                if self.on_stop is not None:
+                    self.on_stop(self)
         self.rect.centery += self.vy
+
+    def kill(self):
+        """
+        倒されたら爆弾投下の予約を取り消す
+        """
+        super().kill()
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
         
 
-class BOSS(pg.sprite.Sprite):
-    def __init__(self):
-        imgs = pg.image.load(f"ex05/fig/UFO_BOSS.png")
-        imgs = pg.transform.scale(imgs,(150,150))
+class BOSS(pg.sprite.DirtySprite):
+    def __init__(self, rng: random.Random = random):
+        imgs = assets.get("UFO_BOSS.png", scale=(150, 150))
         super().__init__()
         self.hp = 2
         self.image = imgs
         self.rect = self.image.get_rect()
-        self.rect.center = random.randint(0, WIDTH), 0
+        self.rect.center = rng.randint(0, WIDTH), 0
         self.vy = +6
-        self.bound = random.randint(50, HEIGHT/2) 
+        self.bound = rng.randint(50, HEIGHT//2)
         self.state = "down"  
-        self.interval = random.randint(50, 300)
+        self.interval = rng.randint(50, 300)
         self.move = 3
         self.move_sum = 0
+        self.on_stop = None  # 停止状態になったときに呼ぶ関数（BOSSを受け取る）
+        self.timer = None  # 次の爆弾投下の予約
     def update(self):
         if self.rect.centery > self.bound:
             self.vy = 0
-            self.state = "stop"
+            if self.state != "stop":
+                self.state = "stop"
+                if self.on_stop is not None:
+                    self.on_stop(self)
         self.rect.centery += self.vy
         if self.hp == 0:
             self.kill()
@@ -307,6 +953,193 @@ class BOSS(pg.sprite.Sprite):
     def hp_set(self, num):
         self.hp += num
 
+    def kill(self):
+        """
+        倒されたら爆弾投下の予約を取り消す
+        """
+        super().kill()
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+
+
+class GlyphText:
+    """
+    見出しと1文字ずつの画像をキャッシュし，値が変わってもfont.renderを呼ばずに文字の画像を並べて描くクラス
+    文字の右端は先頭からの文字列をfont.sizeで測った幅にする（カーニングを含めてfont.renderと同じ位置になる）
+    """
+    max_edges = 4096  # 覚えておく右端の数（超えたら忘れる）
+
+    def __init__(self, font: pg.font.Font, color: tuple, label: str = ""):
+        """
+        引数1 font：フォント
+        引数2 color：文字色
+        引数3 label：値の前に付ける見出し（"Score: "など）
+        """
+        self.font = font
+        self.color = color
+        self.label = label
+        self.label_image = font.render(label, 0, color) if label else None
+        self.glyphs = {}  # 文字 -> (画像, 1文字だけで描いたときの幅)
+        self.edges = {}  # 先頭からの文字列 -> その右端のx
+        self.value = None
+        self.text = label
+        self.drawn = None  # 直前に描いた文字列
+        self.width = 0  # 直前にblit()で描いてから，描いた領域の最大の幅
+        self.renders = 0  # font.renderを呼んだ回数（見出しを除く）
+
+    def glyph(self, ch: str) -> tuple:
+        glyph = self.glyphs.get(ch)
+        if glyph is None:
+            glyph = self.glyphs[ch] = (self.font.render(ch, 0, self.color), self.font.size(ch)[0])
+            self.renders += 1
+        return glyph
+
+    def edge(self, text: str) -> int:
+        """
+        戻り値：textをfont.renderで描いたときの右端のx（値が少しずつ変わるので，先頭の方の桁は覚えた値を使う）
+        """
+        x = self.edges.get(text)
+        if x is None:
+            if len(self.edges) >= __class__.max_edges:
+                self.edges.clear()
+            x = self.edges[text] = self.font.size(text)[0]
+        return x
+
+    def set(self, value) -> bool:
+        """
+        表示する値を設定する
+        引数1 value：値（文字列にして表示する）
+        戻り値：値が変わったか
+        """
+        if value == self.value:
+            return False
+        self.value = value
+        self.text = self.label + str(value)
+        return True
+
+    def size(self) -> tuple[int, int]:
+        return self.edge(self.text), self.font.get_height()
+
+    def blit(self, target: pg.Surface, pos: tuple) -> pg.Rect:
+        """
+        見出しと値の文字をtargetに描く
+        引数2 pos：左上の位置
+        戻り値：描いた領域
+        """
+        x, y = pos
+        text, glyph, edge = self.text, self.glyph, self.edge
+        seq = [(self.label_image, pos)] if self.label_image is not None else []
+        for i in range(len(self.label), len(text)):
+            img, width = glyph(text[i])
+            seq.append((img, (x+edge(text[:i+1])-width, y)))
+        target.blits(seq, False)
+        self.drawn = text
+        self.width = self.edge(text)
+        return pg.Rect(pos, self.size())
+
+    def redraw(self, target: pg.Surface, pos: tuple, clear) -> pg.Rect:
+        """
+        直前にposへ描いた文字列から変わった文字だけを，透明に消してから描き直す（1の位だけ変わったときなど）
+        引数1 target：透明なSurface（HudLayer.surface）
+        引数2 pos：左上の位置（直前と同じ）
+        引数3 clear：targetの矩形を透明にする関数（HudLayer.clear）
+        戻り値：直前にblit()で描いてから描いた領域（幅は数字ごとに変わるので，広い方に揃えておく）
+        """
+        old, text = self.drawn, self.text
+        if old is None:
+            return self.blit(target, pos)
+        n = len(self.label)
+        i, end = n, min(len(old), len(text))
+        while i < end and old[i] == text[i]:
+            i += 1
+        height = self.font.get_height()
+        if i == len(old) == len(text):
+            return pg.Rect(pos, (self.width, height))
+        x, y = pos
+        glyphs, edges = self.glyphs, self.edges  # 値が変わるたびに呼ぶので，覚えた値はメソッドを通さずに引く
+        glyph, edge = self.glyph, self.edge
+        # 消す範囲：変わった最初の文字の前後での左端（カーニングで前の文字に重なることがある）から，長い方の右端まで
+        left = edges.get(text[:i]) or edge(text[:i])
+        for t in (old, text):
+            if i < len(t):
+                left = min(left, (edges.get(t[:i+1]) or edge(t[:i+1])) - (glyphs.get(t[i]) or glyph(t[i]))[1])
+        right = max(edges.get(old) or edge(old), edges.get(text) or edge(text))
+        clear(pg.Rect(x+left, y, right-left, height))
+        k = i  # 消した範囲に掛かる文字から描き直す
+        while k > n and (edges.get(text[:k]) or edge(text[:k])) > left:
+            k -= 1
+        seq = [(self.label_image, pos)] if k == n and n and edge(self.label) > left else []
+        for j in range(k, len(text)):
+            img, width = glyphs.get(text[j]) or glyph(text[j])
+            seq.append((img, (x+(edges.get(text[:j+1]) or edge(text[:j+1]))-width, y)))
+        target.blits(seq, False)
+        self.drawn = text
+        self.width = max(self.width, right)
+        return pg.Rect(pos, (self.width, height))
+
+
+class HudLayer:
+    """
+    HPバー，スコア，難易度，盾の個数を1枚の透明なSurfaceにまとめておくクラス
+    値が変わった項目だけをそのSurface上で描き直し，毎フレームは描いた領域を画面に転送するだけにする
+    """
+    def __init__(self, hp_bar: "HPBar", score: "Score", difficult: "Difficult",
+                 shield_count: "Shiled_count", achievement: "Achievement"):
+        self.items = {"hp": hp_bar, "score": score, "level": difficult, "shield": shield_count}
+        self.achievement = achievement
+        self.surface = pg.Surface((WIDTH, HEIGHT), pg.SRCALPHA)
+        self.blank = pg.Surface((1, 1), pg.SRCALPHA)  # clear()で掛ける透明な画像
+        self.drawn = {}  # 項目名 -> Surface上に描いた矩形のリスト
+        self.rects = []  # 画面に転送する矩形
+        self.transfer = []  # rectsをscreen.blitsに渡す形にしたもの
+        self.redraws = 0  # 項目を描き直した回数
+
+    def refresh(self) -> bool:
+        """
+        値が変わった項目だけをSurface上で描き直す
+        戻り値：描き直した項目があったか
+        """
+        changed = moved = False  # movedは描いた領域が変わった項目があったか
+        for name, item in self.items.items():
+            if name == "shield":
+                dirty = item.refresh(self.achievement.score, self.achievement.shield)
+            else:
+                dirty = item.refresh()
+            if not dirty and name in self.drawn:
+                continue
+            drawn = self.drawn.get(name)
+            if drawn is not None and hasattr(item, "redraw"):  # 変わった文字だけを描き直せる項目
+                self.drawn[name] = item.redraw(self.surface, self.clear)
+            else:
+                for rect in drawn or ():
+                    self.clear(rect)
+                self.drawn[name] = item.blit(self.surface)
+            self.redraws += 1
+            changed = True
+            moved = moved or self.drawn[name] != drawn
+        if moved:
+            rects = [rect for rects in self.drawn.values() for rect in rects if rect.width and rect.height]
+            # 他の矩形に含まれる矩形（盾のアイコンの上の数字など）は転送しない
+            self.rects = [rect for i, rect in enumerate(rects)
+                          if not any(j != i and other.contains(rect) for j, other in enumerate(rects))]
+            self.transfer = [(self.surface, rect, rect) for rect in self.rects]
+        return changed
+
+    def clear(self, rect: pg.Rect):
+        """
+        surfaceのrectを透明にする（小さな矩形でもfillは約10 usかかるので，透明な画像をBLEND_RGBA_MULTで掛ける）
+        """
+        w, h = self.blank.get_size()
+        if rect.width > w or rect.height > h:
+            self.blank = pg.Surface((max(rect.width, w), max(rect.height, h)), pg.SRCALPHA)
+            self.blank.fill((0, 0, 0, 0))
+        self.surface.blit(self.blank, rect, (0, 0, rect.width, rect.height), pg.BLEND_RGBA_MULT)
+
+    def draw(self, screen: pg.Surface):
+        self.refresh()
+        screen.blits(self.transfer, False)
 
 
 class Score:
@@ -319,16 +1152,30 @@ class Score:
         self.font = pg.font.Font(None, 50)
         self.color = (0, 0, 255)
         self.score = 0
-        self.image = self.font.render(f"Score: {self.score}", 0, self.color)
-        self.rect = self.image.get_rect()
+        self.text = GlyphText(self.font, self.color, "Score: ")
+        self.text.set(self.score)
+        self.rect = pg.Rect((0, 0), self.text.size())
         self.rect.center = 100, HEIGHT-50
 
     def score_up(self, add):
         self.score += add
 
+    def refresh(self) -> bool:
+        """
+        スコアが変わったかを調べる
+        戻り値：変わったか
+        """
+        return self.text.set(self.score)
+
+    def blit(self, screen: pg.Surface) -> list:
+        return [self.text.blit(screen, self.rect.topleft)]
+
+    def redraw(self, screen: pg.Surface, clear) -> list:
+        return [self.text.redraw(screen, self.rect.topleft, clear)]
+
     def update(self, screen: pg.Surface):
-        self.image = self.font.render(f"Score: {self.score}", 0, self.color)
-        screen.blit(self.image, self.rect)
+        self.refresh()
+        self.blit(screen)
 
 
 class HPBar:
@@ -341,32 +1188,49 @@ class HPBar:
         self.height = 20  # HPバーの高さ
         self.rect = pg.Rect((100, 50, self.max_width, self.height))
         self.color = (0, 0, 255)  # HPバーの色
+        self.hp = None  # 直前に描いたときのHP
 
-    def update(self, screen: pg.Surface):
+    def refresh(self) -> bool:
+        """
+        HPが変わったときだけ幅を計算し直す
+        戻り値：変わったか
+        """
+        if self.hp == self.bird.hp:
+            return False
+        self.hp = self.bird.hp
         hp_ratio = self.bird.hp / self.bird.max_hp
         width = int(self.max_width * hp_ratio)
         self.rect.width = width
-        pg.draw.rect(screen, self.color, self.rect)
+        return True
+
+    def blit(self, screen: pg.Surface) -> list:
+        return [pg.draw.rect(screen, self.color, self.rect)]
+
+    def update(self, screen: pg.Surface):
+        self.refresh()
+        self.blit(screen)
 
 
-class Point(pg.sprite.Sprite):
-    def __init__(self, obj: "Bomb|Enemy", life: int, size):
+class Point(Pooled):
+    def reset(self, obj: "Bomb|Enemy", life: int, size):
         """
         相手からポイントを落とす関数
         """
-        super().__init__()
-        img = pg.transform.rotozoom(pg.image.load("ex05/fig/food_yakitori.png"), 0, size)
-        self.imgs = [img, pg.transform.flip(img, 1, 0)]
+        self.imgs = [assets.get("food_yakitori.png", 0, size),
+                     assets.get("food_yakitori.png", 0, size, (True, False))]
         self.image = self.imgs[0]
         self.rect = self.image.get_rect(center=obj.rect.center)
         self.life = life
+        self.size = size
+        self.age = 0  # 落ちてからのフレーム数
 
     def update(self):
         self.life += 1
+        self.age += 1
         self.image = self.imgs[self.life//50%2]
 
 
-class Shield(pg.sprite.Sprite):
+class Shield(pg.sprite.DirtySprite):
     """
     盾に関するクラス
     """
@@ -376,11 +1240,11 @@ class Shield(pg.sprite.Sprite):
         引数1 xy：こうかとんの座標
         """
         super().__init__()
-        imge3 = pg.transform.rotozoom(pg.image.load(f"ex05/fig/shield.png"), 0, 0.3)
-        imge2 = pg.transform.rotozoom(pg.image.load(f"ex05/fig/shield2.png"), 0, 0.3)
-        imge1 = pg.transform.rotozoom(pg.image.load(f"ex05/fig/shield3.png"), 0, 0.3)
+        imge3 = assets.get("shield.png", 0, 0.3)
+        imge2 = assets.get("shield2.png", 0, 0.3)
+        imge1 = assets.get("shield3.png", 0, 0.3)
         self.images = [imge1, imge1, imge2, imge3]
-        self.image = pg.transform.rotozoom(pg.image.load(f"ex05/fig/shield2.png"), 0, 0.3)
+        self.image = imge2
         self.rect = self.image.get_rect()
         self.rect.center = bird.rect.center
         self.life = 3
@@ -398,61 +1262,406 @@ class Shield(pg.sprite.Sprite):
         self.life -= num
 
 
-class Difficult:
-    """
-    時間に応じて難易度を表示する関数
-    """
-    def __init__(self):
-        self.font = pg.font.Font(None, 50)
-        self.color = (255, 0, 0)
-        self.difficulty = 0
-        self.image = self.font.render(f"Level: {self.difficulty}", 0, self.color)
-        self.rect = self.image.get_rect()
-        self.rect.center = 100, HEIGHT-90
+pools = {  # 種類ごとのスプライトプール
+    "bomb": SpritePool(Bomb, 1000),
+    "beam": SpritePool(Beam, 50),
+    "point": SpritePool(Point, 200),
+}
 
-    def difficult_up(self, add):
-        self.difficulty += add
 
-    def update(self, screen: pg.Surface):
-        self.image = self.font.render(f"Level: {self.difficulty}", 0, self.color)
-        screen.blit(self.image, self.rect)
+def set_pool_policy(policy: str):
+    """
+    すべてのプールの使い切ったときの方針を変更する
+    """
+    if policy not in SpritePool.policies:
+        raise ValueError(f"unknown pool policy: {policy}")
+    for pool in pools.values():
+        pool.policy = policy
 
 
-class Cooltime:
+class Lifecycle:
     """
-    射撃のクールタイム表示
+    爆弾やポイントが消えずに増え続けないよう，寿命と上限でスプライトを消すクラス
+    ttl：種類ごとの寿命（フレーム数，ageを持つスプライトのみ）
+    max_bounces：爆弾が画面端で跳ね返れる回数
+    caps：種類ごとの同時に存在できる数（超えたら古いものから消す）
     """
-    def __init__(self):
-        self.font = pg.font.Font(None, 50)
-        self.colors = [(255, 0, 0), (255, 255, 0), (0, 255, 0)]
-        self.color = self.colors[2]
-        self.cooltime = 0
-        self.rect = 0, 0
-        self.view = -100
+    def __init__(self, ttl: dict = None, max_bounces: int = 3, caps: dict = None):
+        self.ttl = {"bomb": 1000, "point": 500} if ttl is None else ttl
+        self.max_bounces = max_bounces
+        self.caps = {"bomb": 500, "point": 50, "explosion": 150} if caps is None else caps
+        self.retired = {}  # (種類, 理由) -> 消した数
 
-    def star_ct(self):
-        self.cooltime = 1
+    def retire(self, sprite: pg.sprite.Sprite, kind: str, rule: str):
+        sprite.kill()
+        key = kind, rule
+        self.retired[key] = self.retired.get(key, 0) + 1
 
-    def update(self, screen: pg.Surface, tmr, bird: Bird):
+    def update(self, groups: dict):
         """
-        時間によって形と色が変わる四角形を表示する.
+        寿命を過ぎたもの，上限を超えた分を古い順に消す
+        グループは追加された順（＝古い順）に並んでいるので，先頭から調べるだけでよい
+        引数 groups：種類 -> グループの辞書
         """
-        self.rectx, self.recty = bird.rect.bottomleft
-        self.recty += 10
-        if self.cooltime >= 1:
-            self.cooltime += 1
-            if self.cooltime <= 20:
-                self.color = self.colors[0]
-                pg.draw.rect(screen, self.color, (self.rectx, self.recty, self.cooltime, 5))
-            elif self.cooltime > 20:
-                self.color = self.colors[1]
-                pg.draw.rect(screen, self.color, (self.rectx, self.recty, self.cooltime, 5))
-        if self.view + 50 >= tmr and Cooltime ==0:
-            self.color = self.colors[2]
-            pg.draw.rect(screen, self.color, (self.rectx, self.recty, 60, 5))
-        if self.cooltime >= 50:
+        for kind, group in groups.items():
+            if isinstance(group, (BombField, ExplosionField)):
+                self.update_field(group, kind)
+                continue
+            ttl = self.ttl.get(kind)
+            if ttl is not None:
+                for sprite in group.sprites():
+                    if sprite.age < ttl:
+                        break
+                    self.retire(sprite, kind, "ttl")
+            cap = self.caps.get(kind)
+            if cap is not None and len(group) > cap:
+                for sprite in group.sprites()[:len(group)-cap]:
+                    self.retire(sprite, kind, "cap")
+
+    def count(self, kind: str, rule: str, n: int):
+        if n:
+            key = kind, rule
+            self.retired[key] = self.retired.get(key, 0) + n
+
+    def update_field(self, field: "BombField|ExplosionField", kind: str):
+        """
+        BombField，ExplosionFieldに寿命と上限を適用する（先頭ほど古いのはグループと同じ）
+        """
+        ttl = self.ttl.get(kind)
+        if ttl is not None:
+            self.count(kind, "ttl", field.expire(ttl))
+        cap = self.caps.get(kind)
+        if cap is not None and len(field) > cap:
+            self.count(kind, "cap", field.evict(len(field)-cap))
+
+    def stats(self) -> dict:
+        return {f"{kind}.{rule}": n for (kind, rule), n in sorted(self.retired.items())}
+
+
+lifecycle = Lifecycle()
+
+
+class Spot:
+    """
+    位置だけを持つもの（BombFieldの爆弾の爆発位置などに使う）
+    """
+    def __init__(self, rect: pg.Rect):
+        self.rect = rect
+
+
+class BombField:
+    """
+    爆弾をnumpy配列（位置，速度，速さ，色，経過時間，跳ね返り回数）で持ち，まとめて動かすクラス
+    Bombスプライトと同じ動き・当たり判定・消え方をする（配列の順番＝投下した順番）
+    """
+    rad = 10  # 爆弾円の半径
+    fields = {"x": "i8", "y": "i8", "vx": "f8", "vy": "f8", "speed": "f8",
+              "color": "i1", "age": "i4", "bounces": "i4"}
+    record = [("x", "<i4"), ("y", "<i4"), ("vx", "<f8"), ("vy", "<f8"), ("speed", "u1"),
+              ("color", "u1"), ("age", "<u4"), ("bounces", "<u2")]  # WorldStateでの爆弾1個分（WorldState.BOMBと同じ並び）
+
+    def __init__(self, capacity: int = 1024, masks: "MaskCache" = None):
+        """
+        引数1 capacity：最初に確保する爆弾の数
+        引数2 masks：矩形が重なった爆弾をMaskで調べ直すときのMaskCache（Noneのときは矩形だけ）
+        """
+        if np is None:
+            raise RuntimeError("BombField needs numpy")
+        self.masks = masks
+        self.n = 0
+        self.arrays = {name: np.zeros(capacity, dtype) for name, dtype in __class__.fields.items()}
+        self.imgs = [Bomb.get_img(color, __class__.rad) for color in Bomb.colors]
+
+    def __len__(self) -> int:
+        return self.n
+
+    def view(self, name: str) -> "np.ndarray":
+        """
+        配列nameの使用中の部分（ビューなので書き換えると元の配列も変わる）
+        """
+        return self.arrays[name][:self.n]
+
+    def spawn(self, emy: "Enemy", bird: Bird, rng: random.Random = random):
+        """
+        Bomb.resetと同じように爆弾を1つ投下する（乱数の引き方も同じ）
+        """
+        size = 2*__class__.rad
+        color = rng.choice(range(len(Bomb.colors)))
+        vx, vy = calc_orientation(emy.rect, bird.rect)
+        rect = pg.Rect(0, 0, size, size)
+        rect.centerx = emy.rect.centerx
+        rect.centery = emy.rect.centery+emy.rect.height/2
+        if self.n == len(self.arrays["x"]):
+            for name, a in self.arrays.items():
+                self.arrays[name] = np.concatenate([a, np.zeros_like(a)])
+        i = self.n
+        a = self.arrays
+        a["x"][i], a["y"][i], a["vx"][i], a["vy"][i], a["speed"][i] = rect.x, rect.y, vx, vy, 6
+        a["color"][i], a["age"][i], a["bounces"][i] = color, 0, 0
+        self.n += 1
+
+    def remove(self, mask: "np.ndarray"):
+        """
+        maskがTrueの爆弾を消し，残りを順番を保ったまま前に詰める
+        """
+        keep = ~mask
+        k = int(keep.sum())
+        for a in self.arrays.values():
+            a[:k] = a[:self.n][keep]
+        self.n = k
+
+    def update(self):
+        """
+        全爆弾をBomb.updateと同じ規則でまとめて動かす
+        （move_ipと同じく移動量は0方向に切り捨て，片方向だけはみ出したら跳ね返る）
+        """
+        if self.n == 0:
+            return
+        size = 2*__class__.rad
+        self.view("age")[:] += 1
+        x, y, vx, vy, speed = (self.view(name) for name in ("x", "y", "vx", "vy", "speed"))
+        x += np.trunc(speed*vx).astype(np.int64)
+        y += np.trunc(speed*vy).astype(np.int64)
+        out_x = (x < 0) | (WIDTH < x+size)
+        out_y = (y < 0) | (HEIGHT < y+size)
+        flip_x = out_x & ~out_y
+        flip_y = out_y & ~out_x
+        vx[flip_x] *= -1
+        vy[flip_y] *= -1
+        bounced = flip_x | flip_y
+        bounces = self.view("bounces")
+        bounces += bounced
+        if lifecycle.max_bounces is not None:
+            over = bounced & (bounces > lifecycle.max_bounces)
+            if over.any():
+                lifecycle.count("bomb", "bounce", int(over.sum()))
+                self.remove(over)
+
+    def expire(self, ttl: int) -> int:
+        """
+        経過時間がttl以上の爆弾を消し，消した数を返す
+        """
+        old = self.view("age") >= ttl
+        k = int(old.sum())
+        if k:
+            self.remove(old)
+        return k
+
+    def evict(self, k: int) -> int:
+        """
+        古い順にk個の爆弾を消す
+        """
+        mask = np.zeros(self.n, bool)
+        mask[:k] = True
+        self.remove(mask)
+        return k
+
+    def overlaps(self, rect: pg.Rect) -> "np.ndarray":
+        """
+        rectと重なる爆弾の真理値配列を返す（Rect.colliderectと同じ判定）
+        """
+        size = 2*__class__.rad
+        x, y = self.view("x"), self.view("y")
+        return (x < rect.right) & (x+size > rect.left) & (y < rect.bottom) & (y+size > rect.top)
+
+    def touching(self, sprite: pg.sprite.Sprite) -> "np.ndarray":
+        """
+        spriteと衝突する爆弾の真理値配列を返す（masksがあるときは矩形が重なった爆弾だけをMaskで調べ直す）
+        """
+        hit = self.overlaps(sprite.rect)
+        if self.masks is not None and hit.any():
+            imgs, colors, xs, ys = self.imgs, self.view("color"), self.view("x"), self.view("y")
+            img, pos = sprite.image, sprite.rect.topleft
+            for i in np.flatnonzero(hit).tolist():
+                if not self.masks.overlap(img, pos, imgs[colors[i]], (int(xs[i]), int(ys[i]))):
+                    hit[i] = False
+        return hit
+
+    def spots(self, mask: "np.ndarray") -> list:
+        """
+        maskがTrueの爆弾の位置を順番に返す
+        """
+        size = 2*__class__.rad
+        xs, ys = self.view("x")[mask].tolist(), self.view("y")[mask].tolist()
+        return [Spot(pg.Rect(x, y, size, size)) for x, y in zip(xs, ys)]
+
+    def hit_beams(self, beams: pg.sprite.AbstractGroup) -> list:
+        """
+        groupcollide(bombs, beams, True, True)と同じ
+        各ビームは重なる爆弾のうち最も古いものと相打ちになる
+        戻り値：消えた爆弾の位置（古い順）
+        """
+        if self.n == 0:
+            return []
+        mask = np.zeros(self.n, bool)
+        for beam in beams.sprites():
+            hit = self.touching(beam)
+            if hit.any():
+                mask[int(hit.argmax())] = True
+                beam.kill()
+        return self.take(mask)
+
+    def hit_group(self, group: pg.sprite.AbstractGroup) -> list:
+        """
+        groupcollide(bombs, group, True, False)と同じ
+        戻り値：消えた爆弾の位置（古い順）
+        """
+        if self.n == 0:
+            return []
+        mask = np.zeros(self.n, bool)
+        for sprite in group.sprites():
+            mask |= self.touching(sprite)
+        return self.take(mask)
+
+    def hit_shields(self, shields: pg.sprite.AbstractGroup) -> list:
+        """
+        groupcollide(shields, bombs, False, True)と同じ
+        戻り値：爆弾を防いだ盾のリスト
+        """
+        blocked = []
+        for shield in shields.sprites():
+            if self.n == 0:
+                break
+            hit = self.touching(shield)
+            if hit.any():
+                self.remove(hit)
+                blocked.append(shield)
+        return blocked
+
+    def take(self, mask: "np.ndarray") -> list:
+        if not mask.any():
+            return []
+        spots = self.spots(mask)
+        self.remove(mask)
+        return spots
+
+    def rect_values(self) -> list:
+        """
+        全爆弾のRectを(x, y, 幅, 高さ)の順に並べたリスト（Game.checksum用）
+        """
+        size = 2*__class__.rad
+        values = np.empty((self.n, 4), np.int64)
+        values[:, 0], values[:, 1], values[:, 2:] = self.view("x"), self.view("y"), size
+        return values.ravel().tolist()
+
+    def records(self) -> bytes:
+        """
+        全爆弾をrecordの形式で詰めたバイト列（WorldState用）
+        """
+        rec = np.empty(self.n, __class__.record)
+        for name in rec.dtype.names:
+            rec[name] = self.view(name)
+        return rec.tobytes()
+
+    def load_records(self, data: bytes, n: int):
+        """
+        records()で作ったn個分のバイト列で全爆弾を置き換える
+        """
+        rec = np.frombuffer(data, __class__.record, count=n)
+        if n > len(self.arrays["x"]):
+            for name, a in self.arrays.items():
+                self.arrays[name] = np.zeros(max(n, 2*len(a)), a.dtype)
+        for name in rec.dtype.names:
+            self.arrays[name][:n] = rec[name]
+        self.n = n
+
+    def blit_seq(self) -> list:
+        """
+        戻り値：色ごとの爆弾円Surfaceと左上の位置の(画像, 位置)のリスト
+        """
+        imgs = self.imgs
+        pos = zip(self.view("x").tolist(), self.view("y").tolist())
+        return list(zip([imgs[c] for c in self.view("color").tolist()], pos))
+
+    def draw(self, screen: pg.Surface, rects: bool = False) -> "list|None":
+        """
+        全ての爆弾をまとめて1回のblitsで描画する
+        引数2 rects：Trueのとき描画した矩形のリストを返す
+        """
+        seq = self.blit_seq()
+        if hasattr(screen, "fblits"):  # pygame 2.6以降
+            screen.fblits(seq)
+        else:
+            screen.blits(seq, doreturn=False)
+        if rects:
+            size = 2*__class__.rad
+            return [pg.Rect(pos, (size, size)) for _, pos in seq]
+
+
+class Difficult:
+    """
+    時間に応じて難易度を表示する関数
+    """
+    def __init__(self):
+        self.font = pg.font.Font(None, 50)
+        self.color = (255, 0, 0)
+        self.difficulty = 0
+        self.text = GlyphText(self.font, self.color, "Level: ")
+        self.text.set(self.difficulty)
+        self.rect = pg.Rect((0, 0), self.text.size())
+        self.rect.center = 100, HEIGHT-90
+
+    def difficult_up(self, add):
+        self.difficulty += add
+
+    def refresh(self) -> bool:
+        return self.text.set(self.difficulty)
+
+    def blit(self, screen: pg.Surface) -> list:
+        return [self.text.blit(screen, self.rect.topleft)]
+
+    def redraw(self, screen: pg.Surface, clear) -> list:
+        return [self.text.redraw(screen, self.rect.topleft, clear)]
+
+    def update(self, screen: pg.Surface):
+        self.refresh()
+        self.blit(screen)
+
+
+class Cooltime:
+    """
+    射撃のクールタイム表示
+    """
+    def __init__(self):
+        self.font = pg.font.Font(None, 50)
+        self.colors = [(255, 0, 0), (255, 255, 0), (0, 255, 0)]
+        self.color = self.colors[2]
+        self.cooltime = 0
+        self.bar = 0  # 表示する四角形の幅（直前のtickでのクールタイム）
+        self.rect = 0, 0
+        self.view = -100
+
+    def star_ct(self):
+        self.cooltime = 1
+
+    def tick(self, tmr):
+        """
+        クールタイムを1フレーム進める（描画とは別に毎フレーム呼ぶ）
+        """
+        self.bar = 0
+        if self.cooltime >= 1:
+            self.cooltime += 1
+            self.bar = self.cooltime
+        if self.cooltime >= 50:
             self.cooltime = 0
             self.view = tmr
+
+    def update(self, screen: pg.Surface, tmr, bird: Bird):
+        """
+        時間によって形と色が変わる四角形を表示する.
+        """
+        self.rectx, self.recty = bird.rect.bottomleft
+        self.recty += 10
+        if self.bar >= 1:
+            if self.bar <= 20:
+                self.color = self.colors[0]
+                pg.draw.rect(screen, self.color, (self.rectx, self.recty, self.bar, 5))
+            elif self.bar > 20:
+                self.color = self.colors[1]
+                pg.draw.rect(screen, self.color, (self.rectx, self.recty, self.bar, 5))
+        if self.view + 50 >= tmr and Cooltime ==0:
+            self.color = self.colors[2]
+            pg.draw.rect(screen, self.color, (self.rectx, self.recty, 60, 5))
         
 
 class Achievement:
@@ -483,209 +1692,2809 @@ class Shiled_count:
         self.font = pg.font.Font(None, 50)
         self.color = (0, 0, 0)
         self.count = 0
-        self.shiled = pg.transform.rotozoom(pg.image.load(f"ex05/fig/shield.png"), 0, 0.2)
+        self.shiled = assets.get("shield.png", 0, 0.2)
         self.rect2 = self.shiled.get_rect()
         self.rect2.center = WIDTH-80, HEIGHT-60
-        self.image = self.font.render(f"{self.count}", 0, self.color)
-        self.rect = self.image.get_rect()
+        self.text = GlyphText(self.font, self.color)
+        self.text.set(self.count)
+        self.rect = pg.Rect((0, 0), self.text.size())
         self.rect.center = WIDTH-80, HEIGHT-60
 
-    def update(self, screen: pg.Surface, score, use):
-        screen.blit(self.shiled, self.rect2)
+    def refresh(self, score, use) -> bool:
         self.count = score // use
-        self.image = self.font.render(f"{score // use // 5}", 0, self.color)
-        screen.blit(self.image, self.rect)
+        return self.text.set(score // use // 5)
+
+    def blit(self, screen: pg.Surface) -> list:
+        return [screen.blit(self.shiled, self.rect2), self.text.blit(screen, self.rect.topleft)]
+
+    def update(self, screen: pg.Surface, score, use):
+        self.refresh(score, use)
+        self.blit(screen)
 
 
 
 class Title(pg.sprite.Sprite):
+    fps = 30  # タイトル画面のフレーム制限
+
     def __init__(self):
-        self.img = pg.image.load("ex05/fig/fire.jpg") 
+        self.img = assets.get("fire.jpg")
         self.fonthk = pg.font.Font(None, 200)
         self.texthk = self.fonthk.render("HERO KOKATON", True, (0,255, 255))
         self.recthk = self.texthk.get_rect(center=(WIDTH // 2, HEIGHT // 2 ))
         self.fontpe = pg.font.Font(None, 80)
         self.textpe = self.fontpe.render("Press Enter to Start ...", True, (0, 200, 0))
         self.rectpe = self.textpe.get_rect(center=(WIDTH // 2, HEIGHT // 2 + 200))
-        
+        # 背景と文字は変わらないので1枚にまとめておく
+        self.image = self.img.copy()
+        self.image.blit(self.texthk, self.recthk)
+        self.image.blit(self.textpe, self.rectpe)
 
     def update(self, screen: pg.Surface):
-        screen.blit(self.img, [0, 0])
-        screen.blit(self.texthk, self.recthk)
-        screen.blit(self.textpe, self.rectpe)
+        screen.blit(self.image, [0, 0])
 
 
-def main():
-    ten=0
-    pg.display.set_caption("勇者こうかとん")
-    screen = pg.display.set_mode((WIDTH, HEIGHT))
-    bg_img = pg.image.load("ex05/fig/pg_bg.jpg")
+class FrameProfiler:
     """
-    追加機能(タイトル表示)
-    タイトル画面に"HERO KOKATON"と"Press Enter to Start"を表示
+    メインループの段階ごとの時間をリングバッファに記録し，画面に重ねて表示するクラス
+    無効のときはactive()がNoneを返し，計測する側は「if prof:」だけで済む
     """
-    
-    
-    score = Score()
-    title = Title()
-    bg_img = pg.image.load("ex04/fig/pg_bg.jpg")
-    bg_img2 = pg.transform.flip(bg_img, 1, 0)
-    score = Score()
-    difficult = Difficult()
-    cooltime = Cooltime() 
-    achievement = Achievement()
-    shield_count = Shiled_count()
-
-    bird = Bird(3, (900, 400))
-    hp_bar = HPBar(bird)
-    bombs = pg.sprite.Group()
-    beams = pg.sprite.Group()
-    swords=pg.sprite.Group()
-    exps = pg.sprite.Group()
-    emys = pg.sprite.Group()
-    bosses = pg.sprite.Group()
-    points = pg.sprite.Group()
-    shields = pg.sprite.Group()
-
-
-    
-    tmr = 0
-    x = 0
-    clock = pg.time.Clock()
-    running = True
-    
-    while running:
-        key_lst = pg.key.get_pressed()
-        for event in pg.event.get():
-            if event.type == pg.QUIT:
-                return 0
-            if event.type == pg.KEYDOWN and event.key == pg.K_RETURN:
-                running = False
-        title.update(screen)
-        pg.display.update()
-    
-    while True:
-        key_lst = pg.key.get_pressed()
-        for event in pg.event.get():
-            if event.type == pg.QUIT:
-                return 0
-            if event.type == pg.KEYDOWN and event.key == pg.K_SPACE and cooltime.cooltime == 0:
-                beams.add(Beam(bird))
-                cooltime.star_ct()
-            if event.type == pg.KEYDOWN and event.key == pg.K_LSHIFT:
-                swords.add(Sword(bird, 10))   
-            if event.type == pg.KEYDOWN and event.key == pg.K_TAB and achievement.score // achievement.shield >= 5:
-                shields.add(Shield(bird))
-                achievement.shield += 1
+    budget = 0.02  # 1フレームの目標時間（50FPS）
+    redraw_every = 10  # 表示を作り直す間隔（フレーム数）
 
-        screen.blit(bg_img2, [1600 -x, 0])
-        screen.blit(bg_img, [3199 -x, 0])
-        screen.blit(bg_img, [-x, 0])
-            
-        if ten%2 == 0 and ten != 0:
-            bosses.add(BOSS())
-            ten+=1
-            
-        for boss in bosses:
-            if boss.state == "stop" and tmr%emy.interval == 0:
-                # 敵機が停止状態に入ったら，intervalに応じて爆弾投下
-                
-                bombs.add(Bomb(boss, bird))
-                #Bomb.bomb_size(10)
-        
-        if tmr%200 == 0:
-            emys.add(Enemy())
-        if tmr+100 %200 == 0 and difficult.difficulty >= 5:
-            emys.add(Enemy())
-        if tmr%1000 == 0 and difficult.difficulty < 10:
-            difficult.difficult_up(1)
-
-        for emy in emys:
-            if emy.state == "stop" and tmr % emy.interval == 0:
-                # 敵機が停止状態に入ったら，intervalに応じて爆弾投下                    
-                bombs.add(Bomb(emy, bird))
-                
-
-        for emy in pg.sprite.groupcollide(emys, beams, True, True).keys():
-            exps.add(Explosion(emy, 100))  # 爆発エフェクト
-            points.add(Point(emy, 0, 0.2))
-            bird.change_img(6, screen)  # こうかとん喜びエフェクト
-            ten+=1
-            achievement.score += 1
-        
-        for boss in pg.sprite.groupcollide(bosses, beams, False, True).keys():
-            boss.hp_set(-1)
-            exps.add(Explosion(boss, 100))
-            achievement.score += 1
-            points.add(Point(boss, 0, 0.2))
+    def __init__(self, size: int = 300, enabled: bool = False):
+        """
+        引数1 size：記録するフレーム数
+        引数2 enabled：最初から有効にするか
+        """
+        self.size = size
+        self.enabled = enabled
+        self.rings = {}  # 段階名 -> 各フレームの時間（秒）
+        self.work = array.array("d", bytes(8*size))  # 各フレームの処理時間
+        self.wall = array.array("d", bytes(8*size))  # 前のフレームの開始からの時間
+        self.count = 0  # 記録したフレーム数
+        self.cur = {}
+        self.start = self.last = 0.0
+        self.prev_start = None
+        self.font = None
+        self.panel = None
 
-        for bomb in pg.sprite.groupcollide(bombs, beams, True, True).keys():
-            exps.add(Explosion(bomb, 100))  # 爆発エフェクト
+    def toggle(self):
+        self.enabled = not self.enabled
+        self.prev_start = None
 
-        for emy in pg.sprite.groupcollide(emys, swords, True, False).keys():
-            exps.add(Explosion(emy, 100))  # 爆発エフェクト
-            points.add(Point(emy, 0, 0.2))
-            achievement.score += 1
-        for bomb in pg.sprite.groupcollide(bombs, swords,True, False).keys():
-            exps.add(Explosion(bomb, 50))  # 爆発エフェクト
-            
-        for boss in pg.sprite.groupcollide(bosses, swords, False, True).keys():
-            boss.hp_set(-1)
-            exps.add(Explosion(boss, 100))
-            achievement.score += 1
-        
-        if len(pg.sprite.spritecollide(bird, points, True)) != 0:
-            score.score_up(10)  # 10点アップ
-            
-        if len(pg.sprite.spritecollide(bird, bombs, True)) != 0:
-            bird.decrease_hp()
-            if bird.is_dead():
-                bird.change_img(8, screen)  # こうかとん悲しみエフェクト
-                score.update(screen)
-                pg.display.update()
-                time.sleep(2)
+    def active(self) -> "FrameProfiler|None":
+        return self if self.enabled else None
+
+    def begin_frame(self):
+        self.start = self.last = time.perf_counter()
+        self.cur = {}
+
+    def lap(self, name: str):
+        """
+        前のlap（またはbegin_frame）からの時間を段階nameに加える
+        """
+        now = time.perf_counter()
+        self.cur[name] = self.cur.get(name, 0.0) + now - self.last
+        self.last = now
+
+    def end_frame(self):
+        i = self.count % self.size
+        self.work[i] = self.last - self.start
+        self.wall[i] = self.start - self.prev_start if self.prev_start is not None else self.work[i]
+        self.prev_start = self.start
+        for name in self.cur:
+            if name not in self.rings:
+                self.rings[name] = array.array("d", bytes(8*self.size))
+        for name, ring in self.rings.items():
+            ring[i] = self.cur.get(name, 0.0)
+        self.count += 1
+
+    def stats(self) -> dict:
+        """
+        戻り値：段階名 -> (平均, 最大)（ミリ秒）の辞書
+        """
+        n = min(self.count, self.size) or 1
+        return {name: (sum(ring)/n*1e3, max(ring)*1e3) for name, ring in self.rings.items()}
+
+    def fps(self) -> float:
+        n = min(self.count, self.size)
+        total = sum(self.wall)
+        return n / total if total > 0 else 0.0
+
+    def draw(self, screen: pg.Surface, counts: dict) -> pg.Rect:
+        """
+        FPS，処理時間のグラフ，時間のかかる段階，グループごとのスプライト数を右上に表示する
+        引数1 screen：画面Surface
+        引数2 counts：グループ名 -> スプライト数
+        戻り値：表示した領域
+        """
+        if self.font is None:
+            self.font = pg.font.Font(None, 24)
+            self.panel = pg.Surface((420, 360), pg.SRCALPHA)
+        elif self.count % __class__.redraw_every != 0:
+            return screen.blit(self.panel, (WIDTH-430, 10))  # 前に作った表示を使う
+        panel, font = self.panel, self.font
+        panel.fill((0, 0, 0, 170))
+        n = min(self.count, self.size) or 1
+        mean = sum(self.work)/n*1e3
+        panel.blit(font.render(f"FPS {self.fps():5.1f}  work {mean:5.2f} ms  max {max(self.work)*1e3:5.2f} ms",
+                               True, (255, 255, 255)), (10, 8))
+        # 処理時間のグラフ（枠の高さが目標時間の2倍）
+        graph = pg.Rect(10, 30, 400, 80)
+        pg.draw.rect(panel, (80, 80, 80), graph, 1)
+        budget_y = graph.bottom - graph.height//2
+        pg.draw.line(panel, (255, 80, 80), (graph.left, budget_y), (graph.right-1, budget_y))
+        scale = graph.height / (2*__class__.budget)
+        for k in range(min(self.count, graph.width)):
+            t = self.work[(self.count-1-k) % self.size]
+            h = min(graph.height, int(t*scale))
+            x = graph.right-1-k
+            color = (80, 220, 80) if t <= __class__.budget else (255, 160, 0)
+            pg.draw.line(panel, color, (x, graph.bottom-1), (x, graph.bottom-1-h))
+        y = graph.bottom + 8
+        top = sorted(self.stats().items(), key=lambda item: -item[1][0])[:10]
+        for name, (avg, peak) in top:
+            panel.blit(font.render(f"{name:22s}", True, (220, 220, 220)), (10, y))
+            panel.blit(font.render(f"{avg:6.3f} / {peak:6.3f} ms", True, (220, 220, 220)), (250, y))
+            y += 20
+        items = [f"{name} {count}" for name, count in counts.items()]
+        for k in range(0, len(items), 4):
+            panel.blit(font.render("  ".join(items[k:k+4]), True, (255, 255, 0)), (10, y+4))
+            y += 20
+        return screen.blit(panel, (WIDTH-430, 10))
+
+
+class Telemetry:
+    """
+    1フレームごとの記録（step数，フレーム時間，グループごとのスプライト数，解決した衝突の数，難易度）を
+    前もって確保したリングバッファにため，別スレッドでJSONLまたはCSVのファイルに書き出すクラス
+    record()は配列に値を入れるだけでファイルにもロックにも触らないので，ゲームのループを待たせない
+    書き出しが追いつかずにリングが一杯のときは，その記録を捨ててdroppedに数える
+    ファイルがmax_bytesを超えたらPATH.1，PATH.2，...にずらして新しいファイルに書く（backups個まで残す）
+    """
+    groups = ("bombs", "beams", "swords", "emys", "bosses", "exps", "points", "shields")
+    fields = ("tmr", "frame_ms") + groups + ("collisions", "level")
+    flush_every = 0.5  # 書き出す間隔（秒）
+
+    def __init__(self, path: str, capacity: int = 4096, max_bytes: int = 16*2**20, backups: int = 3):
+        """
+        引数1 path：書き出すファイルのパス（.csvで終わるときはCSV，それ以外はJSONL）
+        引数2 capacity：リングバッファの記録数
+        引数3 max_bytes：1ファイルの大きさの上限（バイト）
+        引数4 backups：ずらして残す古いファイルの数
+        """
+        self.path = path
+        self.csv = path.endswith(".csv")
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.width = len(__class__.fields) - 1  # frame_ms以外の整数の列の数
+        self.ints = array.array("q", bytes(8*capacity*self.width))  # tmr，グループ，衝突，難易度の順
+        self.times = array.array("d", bytes(8*capacity))  # フレーム時間（秒）
+        self.head = 0  # 記録した数（record()だけが増やす）
+        self.tail = 0  # 書き出した数（書き出しスレッドだけが増やす）
+        self.resolved = 0  # 直前のrecord()でのGame.resolved
+        self.dropped = 0  # リングが一杯で捨てた記録の数
+        self.rotations = 0
+        self.file = None
+        self.size = 0  # 今のファイルに書いたバイト数
+        self.error = None  # 書き出しスレッドで起きた例外
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="telemetry", daemon=True)
+        self.thread.start()
+
+    def record(self, tmr: int, seconds: float, counts: dict, resolved: int, level: int):
+        """
+        1フレーム分を記録する
+        引数1 tmr：step数
+        引数2 seconds：フレームの処理時間（秒）
+        引数3 counts：グループ名 -> スプライト数
+        引数4 resolved：ゲーム開始からの解決した衝突の数（Game.resolved）
+        引数5 level：難易度
+        """
+        head = self.head
+        if head - self.tail >= self.capacity:
+            self.dropped += 1
+            return
+        i = head % self.capacity
+        w = self.width
+        base = i * w
+        ints = self.ints
+        ints[base] = tmr
+        for k, name in enumerate(__class__.groups, 1):
+            ints[base+k] = counts.get(name, 0)
+        ints[base+w-2] = resolved - self.resolved
+        ints[base+w-1] = level
+        self.times[i] = seconds
+        self.resolved = resolved
+        self.head = head + 1  # 値を入れ終わってから書き出しスレッドに見せる
+
+    def _run(self):
+        try:
+            while not self.stopping.wait(__class__.flush_every):
+                self._flush()
+            self._flush()
+        except BaseException as e:
+            self.error = e
+        finally:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    def _flush(self):
+        head = self.head
+        if head == self.tail:
+            return
+        w, cap, fields = self.width, self.capacity, __class__.fields
+        lines = []
+        for n in range(self.tail, head):
+            i = n % cap
+            row = self.ints[i*w:(i+1)*w].tolist()
+            row.insert(1, round(self.times[i]*1e3, 3))
+            lines.append(",".join(map(str, row)) if self.csv else json.dumps(dict(zip(fields, row))))
+        self.tail = head  # 値を読み終わったのでrecord()が上書きしてよい
+        for line in lines:
+            if self.file is None or self.size >= self.max_bytes:
+                self._open()
+            self.file.write(line + "\n")
+            self.size += len(line) + 1
+        self.file.flush()
+
+    def _open(self):
+        """
+        今のファイルを閉じ，古いファイルを1つずつずらしてから新しいファイルを開く
+        """
+        if self.file is not None:
+            self.file.close()
+            self.rotations += 1
+        if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+            for k in range(self.backups-1, 0, -1):
+                if os.path.exists(f"{self.path}.{k}"):
+                    os.replace(f"{self.path}.{k}", f"{self.path}.{k+1}")
+            if self.backups > 0:
+                os.replace(self.path, f"{self.path}.1")
+        self.file = open(self.path, "w", newline="")
+        self.size = 0
+        if self.csv:
+            header = ",".join(__class__.fields)
+            self.file.write(header + "\n")
+            self.size += len(header) + 1
+
+    def close(self):
+        """
+        残りの記録を書き出して終わる（書き出しスレッドで起きた例外はここで投げ直す）
+        """
+        self.stopping.set()
+        self.thread.join()
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def stats(self) -> dict:
+        return {"records": self.head, "written": self.tail, "dropped": self.dropped, "rotations": self.rotations}
+
+
+class RenderScaler:
+    """
+    直近のフレーム時間からRendererの内部解像度の倍率を決めるクラス
+    平均が目標時間を超えたら倍率を1段下げ，十分に余裕があれば1段戻す
+    戻してすぐにまた下げたときは，次に戻すまでの待ち時間を倍にする（行ったり来たりを防ぐ）
+    下げた後の平均が下げる前より遅ければ元に戻し，それより下には下げない（拡大の方が重いことがある）
+    """
+    levels = (1.0, 0.5)  # 倍率の段階（大きい順．0.75倍は整数倍でない拡大が重く，1.0倍より遅かった）
+    headroom = 0.6  # 平均が目標時間のこの割合を下回ったら1段戻す
+
+    def __init__(self, levels: tuple = None, budget: float = FrameProfiler.budget, window: int = 30):
+        """
+        引数1 levels：倍率の段階（大きい順，1つだけなら固定）
+        引数2 budget：1フレームの目標時間（秒）
+        引数3 window：平均をとるフレーム数
+        """
+        self.levels = __class__.levels if levels is None else tuple(levels)
+        self.budget = budget
+        self.window = window
+        self.times = array.array("d", bytes(8*window))  # 直近のフレーム時間
+        self.count = 0  # 今の段階で記録したフレーム数
+        self.total = 0.0  # timesの合計
+        self.level = 0
+        self.backoff = 1  # 戻すまでに待つ期間（windowの何倍か）
+        self.raised = None  # 最後に戻したときの記録フレーム数（frames）
+        self.frames = 0
+        self.floor = len(self.levels)-1  # これより下の段階には下げない
+        self.before = None  # 下げた直後は，下げる前の平均（秒）
+        self.drops = self.raises = self.reverts = 0
+
+    @property
+    def scale(self) -> float:
+        return self.levels[self.level]
+
+    def record(self, seconds: float) -> bool:
+        """
+        1フレームの処理時間を記録し，必要なら倍率を変える
+        引数1 seconds：フレームの処理時間（待ち時間を含まない）
+        戻り値：倍率を変えたらTrue
+        """
+        i = self.count % self.window
+        self.total += seconds - self.times[i]
+        self.times[i] = seconds
+        self.count += 1
+        self.frames += 1
+        if self.count < self.window:
+            return False
+        mean = self.total / self.window
+        before, self.before = self.before, None
+        if before is not None and mean > before:  # 下げたら遅くなった
+            self.level -= 1
+            self.floor = self.level
+            self.reverts += 1
+        elif mean > self.budget and self.level < self.floor:
+            if self.raised is not None and self.frames - self.raised < 2*self.window*self.backoff:
+                self.backoff = min(self.backoff*2, 32)  # 戻したのが早すぎた
+            else:
+                self.backoff = 1  # 負荷が変わって遅くなった
+            self.level += 1
+            self.drops += 1
+            self.before = mean
+        elif (mean < self.budget*__class__.headroom and self.level > 0
+              and self.count >= self.window*self.backoff):
+            self.level -= 1
+            self.raises += 1
+            self.raised = self.frames
+        else:
+            return False
+        self.count, self.total = 0, 0.0
+        self.times = array.array("d", bytes(8*self.window))
+        return True
+
+    def stats(self) -> dict:
+        return {"scale": self.scale, "drops": self.drops, "raises": self.raises, "reverts": self.reverts}
+
+
+class SpriteAtlas:
+    """
+    スプライトの画像（fig内の画像，方向テーブルの回転済み画像，爆弾円など）を数枚の大きなSurface（ページ）に
+    詰めて持つクラス．描画側は(ページ, 位置, ページ内の矩形)の並びを1回のblitsで描ける
+    ページは表示形式で，画像は棚（高さの揃った行）に左から順に詰める
+    アルファ付きの画像とカラーキーの画像（爆弾円）は別のページに詰める（カラーキーの転送の方が速いので変換しない）
+    """
+    page_size = (512, 512)
+    max_pages = 8  # これを超えたら詰めずに元の画像のまま描く（毎回作り直される画像で増え続けないようにする）
+    max_side = 256  # 幅か高さがこれより大きい画像（背景など）は詰めない
+
+    def __init__(self, size: tuple[int, int] = page_size):
+        """
+        引数1 size：ページの(幅, 高さ)
+        """
+        self.size = size
+        self.pages = []
+        self.shelves = {}  # 画像の種類 -> [今詰めているページ, 次のx, 棚の上端のy, 棚の高さ]
+        self.regions = {}  # 元の画像 -> (ページ, ページ内のRect)
+        self.area = 0  # 詰めた画像の面積の合計
+        self.misses = 0  # 詰めずに元の画像のまま返した回数
+
+    def __len__(self) -> int:
+        return len(self.regions)
+
+    @staticmethod
+    def kind(img: pg.Surface) -> "str|tuple":
+        """
+        戻り値：同じページに詰められる画像の種類（alpha，opaque，またはカラーキー）
+        """
+        if img.get_flags() & pg.SRCALPHA:
+            return "alpha"
+        key = img.get_colorkey()
+        return "opaque" if key is None else tuple(key)
+
+    def _page(self, kind: "str|tuple") -> pg.Surface:
+        display = pg.display.get_surface() is not None
+        if kind == "alpha":
+            page = pg.Surface(self.size, pg.SRCALPHA)
+            page = page.convert_alpha() if display else page
+            page.fill((0, 0, 0, 0))
+        else:
+            page = pg.Surface(self.size)
+            page = page.convert() if display else page
+            if kind != "opaque":
+                page.fill(kind)
+                page.set_colorkey(kind)
+        self.pages.append(page)
+        return page
+
+    def _place(self, img: pg.Surface) -> "tuple[pg.Surface, pg.Rect]|None":
+        w, h = img.get_size()
+        if w > __class__.max_side or h > __class__.max_side:
+            return None
+        kind = __class__.kind(img)
+        page, x, y, shelf_h = self.shelves.get(kind) or (None, 0, 0, 0)
+        if x + w > self.size[0]:  # 次の棚へ
+            x, y, shelf_h = 0, y + shelf_h, 0
+        if page is None or y + h > self.size[1]:  # 次のページへ
+            if len(self.pages) >= __class__.max_pages:
+                return None
+            page = self._page(kind)
+            x = y = shelf_h = 0
+        rect = pg.Rect(x, y, w, h)
+        if kind == "alpha":
+            # 透明なページにBLEND_RGBA_MAXで重ねると，アルファ値も含めて画素がそのまま写る
+            page.blit(img, rect, special_flags=pg.BLEND_RGBA_MAX)
+        else:  # カラーキーのページはカラーキーの色で塗ってあるので，抜けた画素もそのまま同じになる
+            page.blit(img, rect)
+        self.shelves[kind] = [page, x + w + 1, y, max(shelf_h, h + 1)]  # 1画素の隙間を空けて詰める
+        self.area += w * h
+        return page, rect
+
+    def add(self, imgs):
+        """
+        まだ詰めていない画像を，種類ごとに高さの大きい順に詰める（ビルド手順．描画中に見つかった画像はregion()で足す）
+        引数1 imgs：画像のリスト
+        """
+        new = {img for img in imgs if img not in self.regions}
+        for img in sorted(new, key=lambda img: (str(__class__.kind(img)), -img.get_height(), -img.get_width())):
+            placed = self._place(img)
+            if placed is not None:
+                self.regions[img] = placed
+
+    def region(self, img: pg.Surface) -> tuple:
+        """
+        戻り値：imgを描くための(ページ, ページ内のRect)（詰められないときは(img, None)）
+        """
+        region = self.regions.get(img)
+        if region is None:
+            region = self._place(img)
+            if region is None:
+                self.misses += 1
+                return img, None
+            self.regions[img] = region
+        return region
+
+    def batch(self, seq) -> list:
+        """
+        引数1 seq：(画像, 位置)の並び
+        戻り値：Surface.blitsに渡す(ページ, 位置, ページ内のRect)のリスト
+        """
+        get, region = self.regions.get, self.region
+        batch = []
+        append = batch.append
+        for img, pos in seq:
+            page, rect = get(img) or region(img)
+            append((page, pos, rect))
+        return batch
+
+    def stats(self) -> dict:
+        w, h = self.size
+        return {"pages": len(self.pages), "images": len(self.regions), "misses": self.misses,
+                "fill": round(self.area / (w*h*len(self.pages)), 3) if self.pages else 0.0}
+
+
+class Renderer:
+    """
+    背景とスプライトを画面に描画するクラス
+    full：毎フレーム画面全体を描き直す
+    dirty：LayeredDirtyで変化した領域だけを描き直し，その矩形だけを画面に転送する
+    scaled：背景とスプライトを縮小したSurfaceに描いて画面の大きさに拡大する（HUDは拡大せずに描く）
+            縮小の倍率はRenderScalerがフレーム時間から決める
+    """
+    modes = ("full", "dirty", "scaled")
+    max_sized = 4096  # 縮小した画像を覚えておく数の上限
+    hud_zones = [  # HUDが描かれる領域（dirtyモードでは毎フレーム描き直す）
+        pg.Rect(100, 50, 200, 20),  # HPバー
+        pg.Rect(0, HEIGHT-130, 320, 130),  # スコアと難易度
+        pg.Rect(WIDTH-200, HEIGHT-200, 200, 200),  # 盾の個数
+    ]
+
+    def __init__(self, screen: pg.Surface, mode: str = "full", scroll_every: int = 10, scales: tuple = None,
+                 atlas: bool = False):
+        """
+        引数1 screen：画面Surface
+        引数2 mode：full，dirty，scaledのいずれか
+        引数3 scroll_every：dirtyモードで背景をスクロールさせる間隔（フレーム数）
+        引数4 scales：scaledモードの倍率の段階（RenderScaler参照）
+        引数5 atlas：Trueのときスプライトの画像をSpriteAtlasに詰め，全グループを1回のblitsで描く（fullとscaledのみ）
+        """
+        if mode not in __class__.modes:
+            raise ValueError(f"unknown render mode: {mode}")
+        if atlas and mode == "dirty":
+            raise ValueError("atlas supports render modes full and scaled")
+        self.screen = screen
+        self.mode = mode
+        self.scroll_every = scroll_every
+        # 背景，反転した背景，背景を横に並べた帯を一度だけ作る
+        bg_img = assets.get("pg_bg.jpg")
+        bg_img2 = assets.get("pg_bg.jpg", flip=(True, False))
+        self.strip = pg.Surface((3199+bg_img.get_width(), HEIGHT)).convert()
+        self.strip.blit(bg_img, (0, 0))
+        self.strip.blit(bg_img2, (1600, 0))
+        self.strip.blit(bg_img, (3199, 0))
+        self.layers = pg.sprite.LayeredDirty()
+        self.uppers = []  # dirtyモードでBombFieldなどより手前のグループを入れるLayeredDirty
+        self.bg_x = None  # dirtyモードで背景に使っている帯の位置
+        self.overlays = []  # 前フレームにこうかとんとHUDを描いた領域
+        self.dirty = None  # present()で転送する矩形のリスト（Noneのときは画面全体）
+        self.prof = None  # 有効なFrameProfiler（無効のときはNone）
+        self.updated = 0  # 直前のフレームで画面に転送した画素数（重なりを含む）
+        self.scaler = RenderScaler(scales) if mode == "scaled" else None
+        self.canvas = None  # scaledモードで描く縮小Surface
+        self.canvas_scale = None  # canvasの倍率
+        self.canvas_strip = None  # canvasと同じ倍率の背景の帯
+        self.sized = {}  # 元の画像 -> canvasの倍率に縮小した画像
+        self.atlas = SpriteAtlas() if atlas else None
+        self.canvas_atlas = None  # 縮小した画像を詰めるSpriteAtlas（canvasの倍率が変わったら作り直す）
+        self.calls = 0  # 直前のフレームでスプライトを描くのに呼んだblitの回数（こうかとんを含む）
+        self.saved = 0  # まとめて描いたことで減らした回数（グループごとに描く場合との差）
+        self.sources = None  # profが有効なときの(描いた画像の種類, 使ったページの数)
+
+    @property
+    def scale(self) -> float:
+        """
+        内部解像度の倍率（scaledモード以外は1.0）
+        """
+        return self.scaler.scale if self.scaler else 1.0
+
+    def resize(self, scale: float):
+        """
+        canvasと背景の帯を倍率scaleで作り直す
+        """
+        size = (round(WIDTH*scale), round(HEIGHT*scale))
+        self.canvas = pg.Surface(size).convert()
+        self.canvas_scale = scale
+        self.canvas_strip = pg.transform.scale(self.strip, (round(self.strip.get_width()*scale), size[1]))
+        self.sized = {}
+        self.canvas_atlas = SpriteAtlas() if self.atlas is not None else None
+
+    def sized_image(self, img: pg.Surface) -> pg.Surface:
+        """
+        imgをcanvasの倍率に縮小してself.sizedに覚える（描画時はまずself.sizedを引く）
+        """
+        if len(self.sized) >= __class__.max_sized:  # 毎回作り直される画像で増え続けないようにする
+            self.sized.clear()
+            if self.canvas_atlas is not None:
+                self.canvas_atlas = SpriteAtlas()
+        scale = self.canvas_scale
+        w, h = img.get_size()
+        small = self.sized[img] = pg.transform.scale(img, (max(1, round(w*scale)), max(1, round(h*scale))))
+        return small
+
+    def background(self, x: int) -> pg.Surface:
+        """
+        スクロール位置xの背景（帯の一部）を返す
+        """
+        return self.strip.subsurface((x, 0, WIDTH, HEIGHT))
+
+    def draw(self, x: int, bird: Bird, groups: list, hud, names: list = None):
+        """
+        1フレームを描画する（画面への転送はpresent()で行う）
+        引数1 x：背景のスクロール位置
+        引数2 bird：こうかとん
+        引数3 groups：奥から順に描くスプライトグループのリスト
+        引数4 hud：HUDを描く関数（画面Surfaceを受け取る）
+        引数5 names：プロファイラに記録するグループの名前
+        """
+        prof = self.prof
+        if self.mode == "scaled" and self.scale < 1.0:
+            self.draw_scaled(x, bird, groups, hud, names)
+            return
+        if self.mode != "dirty":  # scaledモードの倍率1.0はfullと同じ
+            self.screen.blit(self.strip, (0, 0), (x, 0, WIDTH, HEIGHT))
+            if self.atlas is not None:
+                if prof:
+                    prof.lap("draw.background")
+                self.blit_batch(self.screen, self.atlas, __class__.blit_pairs(bird, groups), len(groups))
+                hud(self.screen)
+                if prof:
+                    prof.lap("draw.hud")
+                self.dirty = None
                 return
+            self.screen.blit(bird.image, bird.rect)
+            self.calls, self.saved = 1 + len(groups), 0
+            if prof:
+                prof.lap("draw.background")
+            for i, group in enumerate(groups):
+                group.draw(self.screen)
+                if prof:
+                    prof.lap(f"draw.{names[i] if names else i}")
+            hud(self.screen)
+            if prof:
+                prof.lap("draw.hud")
+            self.dirty = None
+            return
+        layers = self.layers
+        self.calls, self.saved = 1 + len(groups), 0
+        if bird not in layers:  # こうかとんはfullモードと同じく一番奥（層0）に描く（新しいプレイなら入れ替える）
+            layers.remove_sprites_of_layer(0)
+            bird.dirty = 2
+            layers.add(bird, layer=0)
+        if self.bg_x is None or (x-self.bg_x) % 3200 >= self.scroll_every:
+            self.bg_x = x
+            layers.clear(self.screen, self.background(x))
+            layers.repaint_rect(self.screen.get_rect())
+        for rect in self.overlays:
+            layers.repaint_rect(rect)
+        # BombFieldなどのスプライトでないものはgroupsの順番の位置で描くので，その後ろのグループは
+        # 別のLayeredDirty（背景を持たない）に入れて分けて描く．前フレームに描いた領域は最初のものが消す
+        plan, part = [layers], 0
+        for layer, group in enumerate(groups):
+            if not isinstance(group, pg.sprite.AbstractGroup):
+                plan.append(group)
+                part += 1
+                continue
+            if part >= len(self.uppers) + 1:
+                self.uppers.append(pg.sprite.LayeredDirty())
+            target = self.uppers[part-1] if part else layers
+            if plan[-1] is not target:
+                plan.append(target)
+            new = [sprite for sprite in group if sprite not in target]
+            if new:
+                for sprite in new:
+                    sprite.dirty = 2  # 動き続けるので毎フレーム描く
+                target.add(*new, layer=layer+1)
+        if prof:
+            prof.lap("draw.sync")
+        dirty, drawn = [], []  # drawn：次のフレームで消す領域（最初のLayeredDirty以外で描いたもの）
+        for item in plan:
+            if isinstance(item, pg.sprite.LayeredDirty):
+                rects = item.draw(self.screen)
+                dirty += rects
+                if item is not layers:
+                    drawn += rects
+            else:
+                drawn += item.draw(self.screen, rects=True)
+        if prof:
+            prof.lap("draw.layers")
+        hud(self.screen)
+        if prof:
+            prof.lap("draw.hud")
+        overlays = [pg.Rect(bird.rect.left, bird.rect.bottom+10, 60, 5)] + __class__.hud_zones + drawn
+        self.dirty = dirty + overlays + self.overlays
+        self.overlays = overlays
 
-        
-        for shield in pg.sprite.groupcollide(shields, bombs, False, True).keys():
+    def draw_scaled(self, x: int, bird: Bird, groups: list, hud, names: list = None):
+        """
+        背景とスプライトをcanvasに縮小して描き，画面の大きさに拡大してからHUDを描く（引数はdraw()と同じ）
+        """
+        prof = self.prof
+        scale = self.scale
+        if self.canvas_scale != scale:
+            self.resize(scale)
+        canvas = self.canvas
+        if hasattr(canvas, "fblits"):  # pygame 2.6以降
+            blit = canvas.fblits
+        else:
+            blit = lambda seq: canvas.blits(seq, doreturn=False)
+        get, shrink = self.sized.get, self.sized_image  # スプライトの数だけ呼ぶので属性を引かずに済ませる
+        canvas.blit(self.canvas_strip, (0, 0), (int(x*scale), 0) + canvas.get_size())
+        if self.atlas is not None:  # 縮小した画像をcanvas_atlasに詰めて，全グループを1回で描く
+            if prof:
+                prof.lap("draw.background")
+            seq = [(get(img) or shrink(img), (int(pos[0]*scale), int(pos[1]*scale)))
+                   for img, pos in __class__.blit_pairs(bird, groups)]
+            self.blit_batch(canvas, self.canvas_atlas, seq, len(groups))
+        else:
+            canvas.blit(get(bird.image) or shrink(bird.image), (int(bird.rect.x*scale), int(bird.rect.y*scale)))
+            self.calls, self.saved = 1 + len(groups), 0
+            if prof:
+                prof.lap("draw.background")
+            for i, group in enumerate(groups):
+                if isinstance(group, pg.sprite.AbstractGroup):
+                    seq = [(get(sprite.image) or shrink(sprite.image),
+                            (int(sprite.rect.x*scale), int(sprite.rect.y*scale))) for sprite in group]
+                else:
+                    seq = [(get(img) or shrink(img), (int(px*scale), int(py*scale)))
+                           for img, (px, py) in group.blit_seq()]
+                blit(seq)
+                if prof:
+                    prof.lap(f"draw.{names[i] if names else i}")
+        pg.transform.scale(canvas, (WIDTH, HEIGHT), self.screen)
+        if prof:
+            prof.lap("draw.upscale")
+        hud(self.screen)
+        if prof:
+            prof.lap("draw.hud")
+        self.dirty = None
+
+    def draw_items(self, x: int, seq: list, hud):
+        """
+        Pipelineのスナップショットを描く（fullとscaledモードのみ）
+        引数1 x：背景のスクロール位置
+        引数2 seq：奥から順の(画像, 左上の位置)のリスト
+        引数3 hud：HUDを描く関数（画面Surfaceを受け取る）
+        """
+        scale = self.scale
+        if scale < 1.0:
+            if self.canvas_scale != scale:
+                self.resize(scale)
+            screen = self.canvas
+            get, shrink = self.sized.get, self.sized_image
+            seq = [(get(img) or shrink(img), (int(px*scale), int(py*scale))) for img, (px, py) in seq]
+            screen.blit(self.canvas_strip, (0, 0), (int(x*scale), 0) + screen.get_size())
+            atlas = self.canvas_atlas
+        else:
+            screen = self.screen
+            screen.blit(self.strip, (0, 0), (x, 0, WIDTH, HEIGHT))
+            atlas = self.atlas
+        if atlas is not None:
+            self.blit_batch(screen, atlas, seq, 0)
+        else:
+            if hasattr(screen, "fblits"):  # pygame 2.6以降
+                screen.fblits(seq)
+            else:
+                screen.blits(seq, doreturn=False)
+            self.calls, self.saved = 1, 0  # スナップショットはもともと1回で描いている
+        if self.prof:
+            self.prof.lap("draw.sprites")
+        if scale < 1.0:
+            pg.transform.scale(screen, (WIDTH, HEIGHT), self.screen)
+            if self.prof:
+                self.prof.lap("draw.upscale")
+        hud(self.screen)
+        if self.prof:
+            self.prof.lap("draw.hud")
+        self.dirty = None
+
+    def warm(self, imgs):
+        """
+        スプライトの画像をatlasにまとめて詰めておく（描画中に見つけて1枚ずつ詰めるより隙間が少ない）
+        引数1 imgs：画像のリスト（Game.sprite_images()）
+        """
+        self.atlas.add(imgs)
+
+    @staticmethod
+    def blit_pairs(bird: Bird, groups: list) -> list:
+        """
+        戻り値：こうかとんとgroupsのスプライトを奥から順に(画像, 位置)にしたリスト
+        """
+        seq = [(bird.image, bird.rect)]
+        for group in groups:
+            if isinstance(group, pg.sprite.AbstractGroup):
+                seq += [(sprite.image, sprite.rect) for sprite in group]
+            else:  # BombField，ExplosionField
+                seq += group.blit_seq()
+        return seq
+
+    def blit_batch(self, target: pg.Surface, atlas: SpriteAtlas, seq: list, groups: int):
+        """
+        (画像, 位置)の並びをatlasのページの矩形に置き換え，targetに1回のblitsで描く
+        引数4 groups：グループごとに描いた場合の，こうかとん以外のblitの回数
+        """
+        batch = atlas.batch(seq)
+        if self.prof:
+            self.prof.lap("draw.collect")
+        target.blits(batch, doreturn=False)
+        self.calls, self.saved = 1, groups
+        if self.prof:
+            self.sources = (len({img for img, _ in seq}), len({page for page, _, _ in batch}))
+            self.prof.lap("draw.sprites")
+
+    def draw_stats(self) -> dict:
+        """
+        戻り値：プロファイラに表示するblitの回数（atlasを使うときは減らした回数と，画像とページの種類の数も）
+        """
+        stats = {"blits": self.calls}
+        if self.atlas is not None:
+            stats["saved"] = self.saved
+            if self.sources is not None:
+                stats["sources"] = "%d>%d" % self.sources
+        return stats
+
+    def end_frame(self, seconds: float):
+        """
+        1フレームの処理時間をRenderScalerに伝える（scaledモード以外は何もしない）
+        """
+        if self.scaler:
+            self.scaler.record(seconds)
+
+    def add_overlay(self, rect: pg.Rect):
+        """
+        draw()の後に直接描いた領域を登録する（dirtyモードで転送し，次のフレームで消す）
+        """
+        if self.dirty is not None:
+            self.dirty.append(rect)
+            self.overlays.append(rect)
+
+    def present(self):
+        """
+        描画した内容を画面に転送する（dirtyモードでは変化した矩形だけ）
+        """
+        if self.dirty is None:
+            pg.display.update()
+            self.updated = WIDTH*HEIGHT
+        else:
+            pg.display.update(self.dirty)
+            self.updated = sum(r.width*r.height for r in self.dirty)
+
+
+class KeyState:
+    """
+    押下中のキーの集合をpg.key.get_pressed()と同じように添字で引けるようにするクラス
+    """
+    def __init__(self, keys=()):
+        self.keys = frozenset(keys)
+
+    def __getitem__(self, key: int) -> bool:
+        return key in self.keys
+
+
+class KeyboardInput:
+    """
+    キーボードから入力を読むクラス
+    """
+    def __init__(self):
+        self.downs = []  # 直前のpollで押されたキー（記録されないF3なども含む）
+
+    def attach(self, game: "Game"):
+        pass
+
+    def close(self):
+        pass
+
+    def poll(self) -> tuple:
+        """
+        戻り値：(押下中のキー, このフレームで押されたキーのリスト, 終了要求)
+        """
+        self.downs = downs = []
+        quit = False
+        for event in pg.event.get():
+            if event.type == pg.QUIT:
+                quit = True
+            if event.type == pg.KEYDOWN:
+                downs.append(event.key)
+        return pg.key.get_pressed(), downs, quit
+
+
+class ScriptedInput:
+    """
+    あらかじめ決めた手順を繰り返して入力を作るクラス
+    手順：(フレーム数, 押し続けるキー, 最初のフレームで押すキー)のリスト
+    """
+    default_script = [
+        (40, (pg.K_RIGHT,), (pg.K_SPACE,)),
+        (40, (pg.K_UP,), (pg.K_SPACE, pg.K_LSHIFT)),
+        (40, (pg.K_LEFT,), (pg.K_SPACE, pg.K_TAB)),
+        (40, (pg.K_DOWN,), (pg.K_SPACE, pg.K_LSHIFT)),
+        (20, (pg.K_LEFT, pg.K_UP), (pg.K_SPACE,)),
+        (20, (pg.K_RIGHT, pg.K_DOWN), (pg.K_SPACE,)),
+    ]
+
+    def __init__(self, script: list = None):
+        self.script = __class__.default_script if script is None else script
+        self.steps = [(n, KeyState(held), list(downs)) for n, held, downs in self.script]
+        self.index = 0
+        self.left = self.steps[0][0]
+        self.first = True
+
+    def attach(self, game: "Game"):
+        pass
+
+    def close(self):
+        pass
+
+    def poll(self) -> tuple:
+        if self.left == 0:
+            self.index = (self.index+1) % len(self.steps)
+            self.left = self.steps[self.index][0]
+            self.first = True
+        _, held, downs = self.steps[self.index]
+        self.left -= 1
+        first, self.first = self.first, False
+        return held, downs if first else [], False
+
+
+class PolicyInput:
+    """
+    画面の状態を見て，簡単な方針でこうかとんを操作する入力（バッチ実行での調整用）
+    近づいてくる爆弾があれば逃げ，なければ一番近い敵機に向かってビームを撃つ
+    乱数を使わないので，同じ種なら同じプレイになる
+    """
+    danger = 150  # 逃げ始める爆弾までの距離
+    reach = 250  # 敵機にこれ以上近づかない距離
+    slash = 80  # 剣を振る爆弾までの距離
+    margin = 60  # 画面端から離れようとする距離
+
+    def __init__(self):
+        self.game = None
+
+    def attach(self, game: "Game"):
+        self.game = game
+
+    def close(self):
+        pass
+
+    def bombs(self):
+        """
+        全爆弾の(中心x，中心y，vx，vy)
+        """
+        game = self.game
+        if game.field is not None:
+            field, rad = game.field, BombField.rad
+            return zip((field.view("x")+rad).tolist(), (field.view("y")+rad).tolist(),
+                       field.view("vx").tolist(), field.view("vy").tolist())
+        return ((bomb.rect.centerx, bomb.rect.centery, bomb.vx, bomb.vy) for bomb in game.bombs)
+
+    def poll(self) -> tuple:
+        game = self.game
+        bird = game.bird
+        bx, by = bird.rect.center
+        away_x = away_y = 0.0  # 近づいてくる爆弾から離れる向き
+        nearest = None
+        for x, y, vx, vy in self.bombs():
+            dx, dy = bx-x, by-y
+            dist = math.hypot(dx, dy)
+            if nearest is None or dist < nearest:
+                nearest = dist
+            if dist < __class__.danger and dx*vx+dy*vy > 0:
+                away_x += dx / (dist*dist+1)
+                away_y += dy / (dist*dist+1)
+        mx = my = 0
+        if away_x or away_y:
+            mx, my = (away_x > 0) - (away_x < 0), (away_y > 0) - (away_y < 0)
+            margin = __class__.margin
+            if bird.rect.left < margin or bird.rect.right > WIDTH-margin:  # 端に追い詰められたら中央へ
+                mx = 1 if bx < WIDTH/2 else -1
+            if bird.rect.top < margin or bird.rect.bottom > HEIGHT-margin:
+                my = 1 if by < HEIGHT/2 else -1
+        else:
+            target = min((emy.rect.center for emy in [*game.emys, *game.bosses]),
+                         key=lambda c: math.hypot(c[0]-bx, c[1]-by), default=None)
+            if target is not None and math.hypot(target[0]-bx, target[1]-by) > __class__.reach:
+                dx, dy = target[0]-bx, target[1]-by
+                mx = (dx > 10) - (dx < -10)
+                my = (dy > 10) - (dy < -10)
+        held = []
+        if mx:
+            held.append(pg.K_RIGHT if mx > 0 else pg.K_LEFT)
+        if my:
+            held.append(pg.K_DOWN if my > 0 else pg.K_UP)
+        downs = [pg.K_SPACE]  # クールタイム中は撃てないので毎回押す
+        if nearest is not None and nearest < __class__.slash:
+            downs.append(pg.K_LSHIFT)
+        if game.achievement.score // game.achievement.shield >= 5:
+            downs.append(pg.K_TAB)
+        return KeyState(held), downs, False
+
+
+class ThreatIndex:
+    """
+    こうかとんの周りの爆弾と，一番近い敵機・BOSSを引くための索引（AutopilotInputが毎フレーム使う）
+    スプライトの爆弾と敵機はGame.gridの格子（直前のcollide()で作ったもの）から，BombFieldは配列から
+    こうかとんの周りのマスにあるものだけを取り出すので，画面全体の爆弾の数にはほとんどよらない
+    格子は1step前の位置で作られているので，引く範囲をslackだけ広げ，位置は今のrectから読む
+    """
+    slack = 16  # 格子を作った後に動いた分の余裕
+
+    def __init__(self, radius: int = 300, limit: int = 24):
+        """
+        引数1 radius：爆弾を探す範囲（こうかとんの中心からの縦横の距離）
+        引数2 limit：近い順に取り出す爆弾の数の上限（AutopilotInputの1フレームの計算量はこれで決まる）
+        """
+        self.radius = radius
+        self.limit = limit
+        self.found = 0  # 直前のbombs()で範囲内にあった爆弾の数（limitで切る前）
+
+    def bombs(self, game: "Game", x: int, y: int) -> list:
+        """
+        戻り値：(x, y)から近い順に最大limit個の，爆弾の(距離, 中心x, 中心y, 1stepあたりのx移動量, y移動量)のリスト
+        """
+        r = self.radius
+        box = pg.Rect(x-r, y-r, 2*r, 2*r)
+        field = game.field
+        if field is not None:
+            near = field.overlaps(box)
+            rad = BombField.rad
+            speed = field.view("speed")[near]
+            found = zip((field.view("x")[near]+rad).tolist(), (field.view("y")[near]+rad).tolist(),
+                        (field.view("vx")[near]*speed).tolist(), (field.view("vy")[near]*speed).tolist())
+        else:
+            bombs = game.bombs
+            found = [(*bomb.rect.center, bomb.speed*bomb.vx, bomb.speed*bomb.vy)
+                     for bomb in game.grid.candidates(box.inflate(2*__class__.slack, 2*__class__.slack), bombs)
+                     if bomb in bombs]  # 格子を作った後に消えたものは除く
+        threats = [(math.hypot(bx-x, by-y), bx, by, vx, vy) for bx, by, vx, vy in found]
+        self.found = len(threats)
+        if len(threats) > self.limit:
+            return heapq.nsmallest(self.limit, threats)
+        threats.sort()
+        return threats
+
+    def target(self, game: "Game", x: int, y: int) -> "Enemy|BOSS|None":
+        """
+        戻り値：(x, y)から一番近い敵機・BOSS（いなければNone）
+        radiusの範囲は格子から引き，その中にいなければ全ての敵機・BOSSから探す
+        """
+        r = self.radius
+        box = pg.Rect(x-r, y-r, 2*r, 2*r).inflate(2*__class__.slack, 2*__class__.slack)
+        best = None
+        for group in (game.emys, game.bosses):
+            for emy in game.grid.candidates(box, group):
+                if emy in group:
+                    d = math.hypot(emy.rect.centerx-x, emy.rect.centery-y)
+                    if d <= r and (best is None or d < best[0]):
+                        best = d, emy
+        if best is not None:
+            return best[1]
+        return min((emy for group in (game.emys, game.bosses) for emy in group),
+                   key=lambda emy: math.hypot(emy.rect.centerx-x, emy.rect.centery-y), default=None)
+
+
+class AutopilotInput:
+    """
+    倒れないように爆弾をよけながら，ビームを撃ち，剣を振り，盾を出してこうかとんを操作する入力
+    （ベンチマークや耐久テストで，難易度が上がり爆弾が増えた場面まで進めるための負荷生成用）
+    毎フレーム，ThreatIndexで近い爆弾を最大limit個取り出し，9通りの移動（8方向と止まる）それぞれについて
+    horizon step先までの最接近距離から危険度を計算して，一番安全な移動を選ぶ
+    1フレームの計算量はlimit×9で決まり，poll()にかかった時間はゲームの時間とは別にstats()で返す
+    乱数を使わないので，同じ種なら同じプレイになる
+    """
+    moves = [(0, 0)] + DIRECTIONS  # 候補の移動（同じ危険度ならこの順で選ぶ）
+    horizon = 15  # 何step先まで爆弾の動きを読むか
+    caution = 40  # 当たる距離にこれを足した距離から危険とみなす
+    margin = 80  # 画面端から離れようとする距離
+    reach = 250  # 敵機にこれ以上近づかない距離
+    aim = 0.92  # ビームを撃つ向きのずれの上限（cos，約23度）
+    slash = 5  # 剣を振る，盾を出す爆弾の最接近までのstep数
+    retarget = 10  # 狙う敵機を選び直す間隔（step数，倒したときはすぐ選び直す）
+    window = 1024  # p99を計算するために覚えておくpoll()の時間の数
+
+    def __init__(self, radius: int = 300, limit: int = 24):
+        """
+        引数1 radius，引数2 limit：ThreatIndexを参照
+        """
+        self.index = ThreatIndex(radius, limit)
+        self.game = None
+        self.aim_at = None  # 狙っている敵機・BOSS
+        self.polls = 0
+        self.total = 0.0  # poll()にかかった時間の合計（秒）
+        self.peak = 0.0
+        self.times = collections.deque(maxlen=__class__.window)
+        self.considered = 0  # 危険度の計算に使った爆弾の数の合計
+        self.capped = 0  # limitで爆弾を切り捨てたフレーム数
+
+    def attach(self, game: "Game"):
+        self.game = game
+
+    def close(self):
+        pass
+
+    @staticmethod
+    def entry(rx: float, ry: float, dvx: float, dvy: float, size: float, t0: float, t1: float) -> "float|None":
+        """
+        相対位置(rx, ry)が1stepに(dvx, dvy)ずつ変わるとき，t0〜t1 stepの間で縦横どちらの距離もsizeより
+        小さくなる（矩形どうしが重なる）最初のstep数（重ならなければNone）
+        縦と横それぞれで重なっている間を求め，その共通部分の始まりを返す
+        """
+        if dvx:
+            a, b = (-size - rx) / dvx, (size - rx) / dvx
+            if a > b:
+                a, b = b, a
+            if a > t0:
+                t0 = a
+            if b < t1:
+                t1 = b
+        elif not -size < rx < size:
+            return None
+        if dvy:
+            a, b = (-size - ry) / dvy, (size - ry) / dvy
+            if a > b:
+                a, b = b, a
+            if a > t0:
+                t0 = a
+            if b < t1:
+                t1 = b
+        elif not -size < ry < size:
+            return None
+        return t0 if t0 < t1 else None
+
+    def danger(self, threats: list, x: float, y: float, mx: int, my: int, speed: int, half: tuple,
+               hit: float) -> tuple[float, float]:
+        """
+        (mx, my)に動き続けた場合の危険度と，当たる爆弾に当たるまでの最短のstep数（当たらなければhorizon）
+        こうかとんは画面端で止まるので，端に着くまでは動き，その後は止まっているとして
+        爆弾との相対位置が直線的に変わる2つの区間で，矩形が重なるか（entry()）と最接近距離を求める
+        当たる爆弾は当たるまでが短いほど，当たらない爆弾は近くをかすめるほど危険度を大きくする
+        このstepの衝突判定は移動の前なので，移動で変えられるのは1 step先からの位置だけ（t=1から調べる）
+        引数1 threats：(相対x, 相対y, 爆弾の1stepあたりのx移動量, y移動量)のリスト
+        """
+        horizon = __class__.horizon
+        moving = horizon
+        w, h = half
+        if mx:
+            moving = min(moving, ((WIDTH - w - x) if mx > 0 else (x - w)) // speed)
+        if my:
+            moving = min(moving, ((HEIGHT - h - y) if my > 0 else (y - h)) // speed)
+        if moving <= 0:  # 1 stepも動けない（はみ出す移動は取り消される）ので止まるのと同じ
+            mx = my = 0
+            moving = horizon
+        rest = horizon - moving
+        vx, vy = mx*speed, my*speed
+        safe = hit + __class__.caution
+        risk, soonest = 0.0, horizon
+        entry = __class__.entry
+        for rx, ry, bvx, bvy in threats:
+            # 動いている区間：相対速度(dvx, dvy)で1〜moving step
+            dvx, dvy = bvx - vx, bvy - vy
+            t = entry(rx, ry, dvx, dvy, hit, 1.0, moving)
+            sx, sy = rx + dvx*moving, ry + dvy*moving
+            if t is None and rest:  # 端で止まった後：爆弾の速度で0〜rest step
+                t = entry(sx, sy, bvx, bvy, hit, 0.0, rest)
+                if t is not None:
+                    t += moving
+            if t is not None:
+                risk += 5.0 / (1.0 + 0.1*t)
+                if t < soonest:
+                    soonest = t
+                continue
+            vv = dvx*dvx + dvy*dvy
+            s = 1.0 if vv == 0 else min(max(-(rx*dvx + ry*dvy) / vv, 1.0), moving)
+            ex, ey = rx + dvx*s, ry + dvy*s
+            d = ex*ex + ey*ey
+            if rest:
+                vv = bvx*bvx + bvy*bvy
+                s = 0.0 if vv == 0 else min(max(-(sx*bvx + sy*bvy) / vv, 0.0), rest)
+                ex, ey = sx + bvx*s, sy + bvy*s
+                d = min(d, ex*ex + ey*ey)
+            d = math.sqrt(d)
+            if d < safe:
+                risk += ((safe - d) / safe)**2
+        return risk, soonest
+
+    def poll(self) -> tuple:
+        start = time.perf_counter()
+        game = self.game
+        bird = game.bird
+        x, y = bird.rect.center
+        speed = bird.speed
+        half = bird.rect.width/2, bird.rect.height/2
+        hit = max(half) + BombField.rad + 2  # 縦横の距離がどちらもこれより近づくと当たる（整数の丸めの分を足す）
+        threats = self.index.bombs(game, x, y)
+        if self.polls % __class__.retarget == 0 or (self.aim_at is not None and not self.aim_at.alive()):
+            self.aim_at = self.index.target(game, x, y)
+        target = self.aim_at.rect.center if self.aim_at is not None else None
+        # 地平線までに互いに近づいても安全な距離に入れない爆弾は，どの移動でも危険度が0なので除く
+        reach = hit + __class__.caution + speed*__class__.horizon
+        horizon = __class__.horizon
+        rel = [(bx-x, by-y, bvx, bvy) for _, bx, by, bvx, bvy in threats
+               if max(abs(bx-x) - abs(bvx)*horizon, abs(by-y) - abs(bvy)*horizon) < reach]
+        # 敵機から離れすぎず近づきすぎない位置を目指す（爆弾がなければこれだけで動く）
+        goal = None
+        if target is not None:
+            tx, ty = target
+            d = math.hypot(x-tx, y-ty) or 1.0
+            margin = __class__.margin
+            goal = (min(max(tx + (x-tx)/d*__class__.reach, margin), WIDTH-margin),
+                    min(max(ty + (y-ty)/d*__class__.reach, margin), HEIGHT-margin))
+        facing = bird.get_direction()
+        face_to = None
+        if target is not None and (target[0] != x or target[1] != y):
+            angle = math.atan2(target[1]-y, target[0]-x)
+            face_to = DIRECTIONS[round(-angle / (math.pi/4)) % 8]  # 敵機に一番近い8方向
+        best = None
+        for mx, my in __class__.moves:
+            risk, soonest = self.danger(rel, x, y, mx, my, speed, half, hit)
+            # horizon step先の位置（画面端で止まる）
+            ex = min(max(x + mx*speed*__class__.horizon, half[0]), WIDTH-half[0])
+            ey = min(max(y + my*speed*__class__.horizon, half[1]), HEIGHT-half[1])
+            margin = __class__.margin
+            edge = max(margin - min(ex, WIDTH-ex, ey, HEIGHT-ey), 0) / margin  # 端に追い詰められないように
+            cost = risk + 0.5*edge
+            if goal is not None:
+                cost += 0.3 * math.hypot(ex-goal[0], ey-goal[1]) / WIDTH
+            if face_to is not None and (mx, my) == face_to and facing != face_to:
+                cost -= 0.05  # 安全なら敵機の方を向く
+            if best is None or cost < best[0]:
+                best = cost, mx, my, soonest
+        _, mx, my, soonest = best
+        held = []
+        if mx:
+            held.append(pg.K_RIGHT if mx > 0 else pg.K_LEFT)
+        if my:
+            held.append(pg.K_DOWN if my > 0 else pg.K_UP)
+        downs = []
+        # ビームは今の向きに飛ぶので，敵機か近づいてくる爆弾がその向きにあるときだけ撃つ
+        fx, fy = facing
+        norm = math.hypot(fx, fy)
+        aims = [target] if target is not None else []
+        aims += [(bx, by) for _, bx, by, bvx, bvy in threats[:4] if (x-bx)*bvx + (y-by)*bvy > 0]
+        if game.cooltime.cooltime == 0:
+            for ax, ay in aims:
+                d = math.hypot(ax-x, ay-y)
+                if d > 0 and ((ax-x)*fx + (ay-y)*fy) / (d*norm) >= __class__.aim:
+                    downs.append(pg.K_SPACE)
+                    break
+        if soonest <= __class__.slash:  # よけきれない爆弾がある
+            if not game.swords:
+                downs.append(pg.K_LSHIFT)
+            achievement = game.achievement
+            if not game.shields and achievement.score // achievement.shield >= 5:
+                downs.append(pg.K_TAB)
+        elapsed = time.perf_counter() - start
+        self.polls += 1
+        self.total += elapsed
+        self.peak = max(self.peak, elapsed)
+        self.times.append(elapsed)
+        self.considered += len(rel)
+        self.capped += self.index.found > len(threats)
+        return KeyState(held), downs, False
+
+    def stats(self) -> dict:
+        """
+        poll()にかかった時間（マイクロ秒）と，危険度の計算に使った爆弾の数
+        """
+        n = self.polls or 1
+        times = sorted(self.times)
+        return {"polls": self.polls, "mean_us": round(self.total/n*1e6, 1),
+                "p99_us": round(times[len(times)*99//100]*1e6, 1) if times else 0.0,
+                "max_us": round(self.peak*1e6, 1), "seconds": round(self.total, 3),
+                "threats": round(self.considered/n, 1), "capped": self.capped}
+
+
+class BotInput:
+    """
+    キーボードからは終了要求とF3などのキーだけを読み，こうかとんの操作はbot（AutopilotInputなど）に任せる入力
+    botが終了要求を返したとき（ReplayInputが記録の最後まで再生したときなど）も終了する
+    """
+    def __init__(self, keyboard, bot):
+        """
+        引数1 keyboard：KeyboardInputまたはInputMailbox
+        引数2 bot：こうかとんを操作する入力（AutopilotInput，ReplayInputなど）
+        """
+        self.keyboard = keyboard
+        self.bot = bot
+
+    def attach(self, game: "Game"):
+        self.keyboard.attach(game)
+        self.bot.attach(game)
+
+    def close(self):
+        self.bot.close()
+        self.keyboard.close()
+
+    def poll(self) -> tuple:
+        _, _, quit = self.keyboard.poll()
+        key_lst, downs, done = self.bot.poll()
+        return key_lst, downs, quit or done
+
+    def stats(self) -> dict:
+        return self.bot.stats() if hasattr(self.bot, "stats") else {}
+
+
+input_sources = {  # --inputsで選べる，キーボードの代わりにこうかとんを操作する入力
+    "scripted": ScriptedInput,
+    "policy": PolicyInput,
+    "autopilot": AutopilotInput,
+}
+
+
+REC_KEYS = [pg.K_UP, pg.K_DOWN, pg.K_LEFT, pg.K_RIGHT, pg.K_SPACE, pg.K_LSHIFT, pg.K_TAB]  # 記録するキー
+REC_QUIT = 0x80  # 押されたキーのビット列で終了要求を表すビット
+REC_HEADER = struct.Struct("<4sBBQH")  # 識別子，版，フラグ，乱数の種，チェックサムの間隔
+REC_FRAME = struct.Struct("<BB")  # 押下中のキー，押されたキー
+REC_TRAILER = struct.Struct("<II")  # フレーム数，チェックサムの数
+REC_MAGIC = b"KKRP"
+
+
+def encode_input(key_lst, downs: list, quit: bool) -> tuple[int, int]:
+    """
+    1フレームの入力をREC_KEYSのビット列2つにする
+    """
+    held = down = 0
+    for i, key in enumerate(REC_KEYS):
+        if key_lst[key]:
+            held |= 1 << i
+        if key in downs:
+            down |= 1 << i
+    return held, down | (REC_QUIT if quit else 0)
+
+
+def decode_input(held: int, down: int) -> tuple:
+    """
+    encode_inputの逆（押されたキーはREC_KEYSの順に並ぶ）
+    """
+    return (KeyState(key for i, key in enumerate(REC_KEYS) if held >> i & 1),
+            [key for i, key in enumerate(REC_KEYS) if down >> i & 1], bool(down & REC_QUIT))
+
+
+class InputRecorder:
+    """
+    別の入力をそのまま使いながら，1フレーム2バイトでファイルに記録するクラス
+    check_everyフレームごとにゲーム状態のチェックサムも記録し，再生時の検証に使う
+    記録中のゲームにも，ビット列に変換して戻した入力を渡すので，再生と同じ入力になる
+    """
+    def __init__(self, source, path: str, check_every: int = 50):
+        """
+        引数1 source：記録する入力（poll()を持つもの）
+        引数2 path：記録ファイルのパス
+        引数3 check_every：チェックサムを記録する間隔（フレーム数）
+        """
+        self.source = source
+        self.path = path
+        self.check_every = check_every
+        self.frames = 0
+        self.checks = array.array("I")
+        self.game = None
+        self.file = None
+
+    def attach(self, game: "Game"):
+        self.game = game
+        self.source.attach(game)
+        self.file = open(self.path, "wb")
+        flags = int(game.invincible) | (game.collision == "mask") << 1
+        self.file.write(REC_HEADER.pack(REC_MAGIC, 1, flags, game.seed, self.check_every))
+
+    def poll(self) -> tuple:
+        if self.frames % self.check_every == 0:
+            self.checks.append(self.game.checksum())
+        held, down = encode_input(*self.source.poll())
+        self.file.write(REC_FRAME.pack(held, down))
+        self.frames += 1
+        return decode_input(held, down)
+
+    def close(self):
+        if self.file is not None:
+            self.file.write(struct.pack(f"<{len(self.checks)}I", *self.checks))  # ヘッダと同じリトルエンディアン
+            self.file.write(REC_TRAILER.pack(self.frames, len(self.checks)))
+            self.file.close()
+            self.file = None
+        self.source.close()
+
+
+class ReplayInput:
+    """
+    InputRecorderで記録したファイルを再生するクラス
+    記録したチェックサムと比べ，最初に食い違ったフレームをdivergedに入れる
+    ファイルの長さがヘッダ，フレーム，チェックサム，末尾の合計と合わないときはValueErrorを送出する
+    """
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            data = f.read()
+        if len(data) < REC_HEADER.size + REC_TRAILER.size:
+            raise ValueError(f"{path} is truncated/corrupt")
+        magic, version, flags, self.seed, self.check_every = REC_HEADER.unpack_from(data)
+        if magic != REC_MAGIC or version != 1:
+            raise ValueError(f"{path} is not a replay file")
+        self.invincible = bool(flags & 1)
+        self.collision = "mask" if flags & 2 else "rect"
+        n_frames, n_checks = REC_TRAILER.unpack_from(data, len(data)-REC_TRAILER.size)
+        start = REC_HEADER.size
+        checks_at = start + n_frames*REC_FRAME.size
+        if checks_at + 4*n_checks + REC_TRAILER.size != len(data):
+            raise ValueError(f"{path} is truncated/corrupt")
+        self.inputs = [REC_FRAME.unpack_from(data, start+i*REC_FRAME.size) for i in range(n_frames)]
+        self.checks = array.array("I", struct.unpack_from(f"<{n_checks}I", data, checks_at))
+        self.frames = 0
+        self.verified = 0  # 一致したチェックサムの数
+        self.diverged = None  # 最初に食い違ったフレーム
+        self.game = None
+
+    def attach(self, game: "Game"):
+        self.game = game
+
+    def close(self):
+        pass
+
+    def poll(self) -> tuple:
+        n = self.frames
+        if n % self.check_every == 0 and n // self.check_every < len(self.checks) and self.diverged is None:
+            if self.game.checksum() == self.checks[n // self.check_every]:
+                self.verified += 1
+            else:
+                self.diverged = n
+        if n >= len(self.inputs):
+            return KeyState(), [], True
+        self.frames += 1
+        return decode_input(*self.inputs[n])
+
+
+class Game:
+    """
+    1回のプレイの状態（こうかとん，スプライトグループ，タイマーなど）をまとめたクラス
+    step()で1フレーム分ゲームを進め，draw()で描画する
+    """
+    draw_order = ["beams", "swords", "emys", "bosses", "bombs", "points", "exps", "shields"]  # 奥から順
+
+    bomb_engines = ("sprite", "numpy")
+    collisions = ("rect", "mask")
+    rate = 50  # 1秒あたりのstep()の回数（動きはすべてstep単位で決まっている）
+    tuning = {  # 難易度の調整値（batch_kokaton.pyで探す）
+        "spawn_every": 200,  # 敵機が出てくる間隔（step数）
+        "level_every": 1000,  # 難易度が上がる間隔（step数）
+        "max_level": 10,  # 難易度の上限
+        "enemy_interval": (50, 300),  # 敵機の爆弾投下インターバルの範囲
+        "enemy_bound": (20, HEIGHT-20),  # 敵機の停止位置の範囲
+        "extra_spawn_level": None,  # この難易度から敵機を2倍出す（Noneで出さない）
+    }
+    # 同じstepのイベントの順番（元のspawn()で判定していた順）
+    BOSS_DROP, SPAWN, EXTRA_SPAWN, LEVEL_UP, ENEMY_DROP = range(5)
+    max_catchup = 5  # 描画1回の間に追いつくために進める最大のstep数
+
+    def __init__(self, invincible: bool = False, seed: int = None, bomb_engine: str = "sprite",
+                 tuning: dict = None, collision: str = "rect"):
+        """
+        引数1 invincible：Trueのときこうかとんが倒れない（計測用）
+        引数2 seed：乱数の種（Noneのときはランダムに決める）
+        引数3 bomb_engine：sprite：爆弾をBombスプライトで持つ／numpy：BombFieldでまとめて持つ
+        引数4 tuning：Game.tuningのうち変更する値の辞書
+        引数5 collision：rect：矩形の重なりで判定する／mask：矩形が重なったものを画像のMaskで調べ直す
+        """
+        if bomb_engine not in __class__.bomb_engines:
+            raise ValueError(f"unknown bomb engine: {bomb_engine}")
+        if collision not in __class__.collisions:
+            raise ValueError(f"unknown collision mode: {collision}")
+        for name in tuning or {}:
+            if name not in __class__.tuning:
+                raise ValueError(f"unknown tuning parameter: {name}")
+        self.tuning = {**__class__.tuning, **(tuning or {})}
+        self.invincible = invincible
+        self.seed = random.randrange(2**32) if seed is None else seed
+        self.rng = random.Random(self.seed)  # このプレイの乱数はすべてここから引く
+        for pool in pools.values():
+            pool.clear()
+        self.ten = 0
+        self.score = Score()
+        self.difficult = Difficult()
+        self.cooltime = Cooltime()
+        self.achievement = Achievement()
+        self.shield_count = Shiled_count()
+        self.bird = Bird(3, (900, 400))
+        for name, scale in (("beam.png", 1.5), ("sword-3.png", 0.4)):
+            dir_table(name, scale, self.bird.rect.size)  # 方向テーブルを事前に作成
+        self.hp_bar = HPBar(self.bird)
+        self.hud_layer = HudLayer(self.hp_bar, self.score, self.difficult, self.shield_count, self.achievement)
+        self.prev = []  # remember()で覚えた(スプライト，rect，step前の位置)のリスト
+        self.collision = collision
+        narrow = masks if collision == "mask" else None
+        self.bombs = BombField(masks=narrow) if bomb_engine == "numpy" else pg.sprite.Group()
+        self.field = self.bombs if bomb_engine == "numpy" else None  # BombFieldを使うときはそれ
+        self.beams = pg.sprite.Group()
+        self.swords = pg.sprite.Group()
+        self.exps = ExplosionField()
+        self.emys = pg.sprite.Group()
+        self.bosses = pg.sprite.Group()
+        self.points = pg.sprite.Group()
+        self.shields = pg.sprite.Group()
+        self.tmr = 0
+        self.x = 0
+        self.serial = 0  # 敵機とBOSSに付ける通し番号（グループ内の順番と同じ）
+        self.scheduler = Scheduler()
+        self.scheduler.at(0, (__class__.SPAWN, 0), self.spawn_enemy)
+        self.scheduler.at(0, (__class__.LEVEL_UP, 0), self.level_up)
+        if self.tuning["extra_spawn_level"] is not None:
+            self.scheduler.at(self.tuning["spawn_every"]//2, (__class__.EXTRA_SPAWN, 0), self.spawn_extra)
+        self.grid = SpatialHash(narrow=narrow.collide if narrow else None)
+        if narrow:
+            self.warm_masks()
+        self.over = False  # こうかとんが倒れたらTrue
+        self.resolved = 0  # 解決した衝突の数（Telemetry用）
+        self.prof = None  # 有効なFrameProfiler（無効のときはNone）
+
+    def warm_masks(self):
+        """
+        敵機，こうかとん，ビーム・剣の8方向，爆弾などの読み込み済みの画像のMaskを前もって作る
+        """
+        masks.warm(self.sprite_images())
+
+    def sprite_images(self) -> list:
+        """
+        戻り値：敵機，BOSS，ポイント，こうかとん，ビーム・剣の8方向，爆弾などの読み込み済みの画像のリスト
+        （Maskの作成とSpriteAtlasのビルドに使う．背景などスプライト以外の画像も含む）
+        """
+        for name in Enemy.imgs:
+            assets.get(name)
+        assets.get("UFO_BOSS.png", scale=(150, 150))
+        for flip in ((False, False), (True, False)):
+            assets.get("food_yakitori.png", 0, 0.2, flip)
+        for color in Bomb.colors:
+            Bomb.get_img(color, BombField.rad)
+        return list(assets.surfaces.values()) + list(Bomb.imgs.values())
+
+    def groups(self) -> dict:
+        """
+        名前 -> スプライトグループの辞書を返す
+        """
+        return {"bombs": self.bombs, "beams": self.beams, "swords": self.swords, "exps": self.exps,
+                "emys": self.emys, "bosses": self.bosses, "points": self.points, "shields": self.shields}
+
+    def checksum(self) -> int:
+        """
+        ゲームの状態（タイマー，HP，スコア，全スプライトの位置）のCRC32を返す
+        再生した結果が記録と一致するか調べるのに使う
+        """
+        bird = self.bird
+        values = [self.tmr, self.ten, bird.hp, self.score.score, self.achievement.score, *bird.rect]
+        for group in self.groups().values():
+            values.append(len(group))
+            if not isinstance(group, pg.sprite.AbstractGroup):  # BombField，ExplosionField
+                values.extend(group.rect_values())
+                continue
+            for sprite in group:
+                values.extend(sprite.rect)
+        return zlib.crc32(struct.pack(f"<{len(values)}q", *values))  # 記録ファイルと同じくリトルエンディアン
+
+    def drop_bomb(self, emy: "Enemy|BOSS|Spot"):
+        """
+        emyからこうかとんに向けて爆弾を投下する
+        """
+        if self.field is not None:
+            self.field.spawn(emy, self.bird, self.rng)
+        else:
+            pools["bomb"].spawn(self.bombs, emy, self.bird, self.rng)
+
+    def step(self, key_lst, downs: list):
+        """
+        1フレーム分ゲームを進める
+        引数1 key_lst：押下キーの真理値リスト
+        引数2 downs：このフレームで押されたキーのリスト
+        """
+        prof = self.prof
+        self.handle_input(downs)
+        if prof:
+            prof.lap("input")
+        self.spawn()
+        if prof:
+            prof.lap("spawn")
+        self.collide()
+        if self.over:
+            return
+        self.update(key_lst)
+
+    def handle_input(self, downs: list):
+        bird, achievement = self.bird, self.achievement
+        for key in downs:
+            if key == pg.K_SPACE and self.cooltime.cooltime == 0:
+                pools["beam"].spawn(self.beams, bird)
+                self.cooltime.star_ct()
+            if key == pg.K_LSHIFT:
+                self.swords.add(Sword(bird, 10))
+            if key == pg.K_TAB and achievement.score // achievement.shield >= 5:
+                self.shields.add(Shield(bird))
+                achievement.shield += 1
+
+    def spawn(self):
+        if self.ten%2 == 0 and self.ten != 0:
+            self.add_enemy(self.bosses, BOSS(self.rng))
+            self.ten+=1
+        self.scheduler.run(self.tmr)  # このstepで予定されている投下・出現・難易度上昇
+
+    def add_enemy(self, group: pg.sprite.AbstractGroup, emy: "Enemy|BOSS"):
+        """
+        敵機（BOSS）をgroupに加え，停止したら爆弾投下を予約するようにする
+        """
+        self.serial += 1
+        emy.serial = self.serial
+        emy.on_stop = self.arm
+        group.add(emy)
+
+    def arm(self, emy: "Enemy|BOSS"):
+        """
+        停止した敵機の最初の爆弾投下を予約する（次のstep以降で最初のintervalの倍数）
+        """
+        due = -(-(self.tmr+1) // emy.interval) * emy.interval
+        self.schedule_drop(emy, due)
+
+    def schedule_drop(self, emy: "Enemy|BOSS", due: int):
+        kind = __class__.BOSS_DROP if isinstance(emy, BOSS) else __class__.ENEMY_DROP
+        emy.timer = self.scheduler.at(due, (kind, emy.serial), self.drop_from, emy)
+
+    def drop_from(self, emy: "Enemy|BOSS"):
+        """
+        停止中の敵機から，intervalごとに爆弾を投下する
+        """
+        self.drop_bomb(emy)
+        self.schedule_drop(emy, self.tmr+emy.interval)
+
+    def new_enemy(self) -> Enemy:
+        tuning = self.tuning
+        return Enemy(self.rng, tuning["enemy_interval"], tuning["enemy_bound"])
+
+    def spawn_enemy(self):
+        self.add_enemy(self.emys, self.new_enemy())
+        self.scheduler.at(self.tmr+self.tuning["spawn_every"], (__class__.SPAWN, 0), self.spawn_enemy)
+
+    def spawn_extra(self):
+        """
+        難易度がextra_spawn_level以上のとき，通常の出現の間にもう1機出す
+        """
+        if self.difficult.difficulty >= self.tuning["extra_spawn_level"]:
+            self.add_enemy(self.emys, self.new_enemy())
+        self.scheduler.at(self.tmr+self.tuning["spawn_every"], (__class__.EXTRA_SPAWN, 0), self.spawn_extra)
+
+    def level_up(self):
+        if self.difficult.difficulty < self.tuning["max_level"]:
+            self.difficult.difficult_up(1)
+        self.scheduler.at(self.tmr+self.tuning["level_every"], (__class__.LEVEL_UP, 0), self.level_up)
+
+    def collide(self):
+        grid, bird, achievement = self.grid, self.bird, self.achievement
+        emys, bosses, bombs, beams, swords = self.emys, self.bosses, self.bombs, self.beams, self.swords
+        exps, points = self.exps, self.points
+        prof = self.prof
+        grid.begin_frame()
+        if self.collision == "mask":
+            masks.begin_frame()
+        for emy in grid.groupcollide(emys, beams, True, True).keys():
+            exps.spawn(emy, 100)  # 爆発エフェクト
+            pools["point"].spawn(points, emy, 0, 0.2)
+            bird.change_img(6)  # こうかとん喜びエフェクト
+            self.ten+=1
+            achievement.score += 1
+            self.resolved += 1
+        if prof:
+            prof.lap("collide.emys_beams")
+
+        for boss in grid.groupcollide(bosses, beams, False, True).keys():
+            boss.hp_set(-1)
+            exps.spawn(boss, 100)
+            achievement.score += 1
+            pools["point"].spawn(points, boss, 0, 0.2)
+            self.resolved += 1
+        if prof:
+            prof.lap("collide.bosses_beams")
+
+        field = self.field
+        hits = field.hit_beams(beams) if field is not None else grid.groupcollide(bombs, beams, True, True).keys()
+        for bomb in hits:
+            exps.spawn(bomb, 100)  # 爆発エフェクト
+            self.resolved += 1
+        if prof:
+            prof.lap("collide.bombs_beams")
+
+        for emy in grid.groupcollide(emys, swords, True, False).keys():
+            exps.spawn(emy, 100)  # 爆発エフェクト
+            pools["point"].spawn(points, emy, 0, 0.2)
+            achievement.score += 1
+            self.resolved += 1
+        if prof:
+            prof.lap("collide.emys_swords")
+        hits = field.hit_group(swords) if field is not None else grid.groupcollide(bombs, swords,True, False).keys()
+        for bomb in hits:
+            exps.spawn(bomb, 50)  # 爆発エフェクト
+            self.resolved += 1
+        if prof:
+            prof.lap("collide.bombs_swords")
+
+        for boss in grid.groupcollide(bosses, swords, False, True).keys():
+            boss.hp_set(-1)
+            exps.spawn(boss, 100)
+            achievement.score += 1
+            self.resolved += 1
+        if prof:
+            prof.lap("collide.bosses_swords")
+
+        got = grid.spritecollide(bird, points, True)
+        if len(got) != 0:
+            self.score.score_up(10)  # 10点アップ
+            self.resolved += len(got)
+        if prof:
+            prof.lap("collide.bird_points")
+
+        if field is not None:
+            hit = field.take(field.touching(bird)) if len(field) else []
+        else:
+            hit = grid.spritecollide(bird, bombs, True)
+        self.resolved += len(hit)
+        if len(hit) != 0 and not self.invincible:
+            bird.decrease_hp()
+            if bird.is_dead():
+                self.over = True
+                return
+        if prof:
+            prof.lap("collide.bird_bombs")
+
+        if field is not None:
+            blocked = field.hit_shields(self.shields)
+        else:
+            blocked = grid.groupcollide(self.shields, bombs, False, True).keys()
+        for shield in blocked:
             Shield.life_change(shield, 1)
-        
-        
-        bird.update(key_lst, screen)
-        hp_bar.update(screen)
-        beams.update()
-        beams.draw(screen)
-        swords.update(bird)
-        swords.draw(screen)
-        emys.update()
-        emys.draw(screen)
-        bosses.update()
-        bosses.draw(screen)
-        bombs.update()
-        bombs.draw(screen)
-        points.update()
-        points.draw(screen)
-        exps.update()
-        exps.draw(screen)
-        score.update(screen)
-        shield_count.update(screen, achievement.score, achievement.shield)
-        difficult.update(screen)
-        cooltime.update(screen, tmr, bird)
-        shields.update()
-        shields.draw(screen)
+            self.resolved += 1
+        if prof:
+            prof.lap("collide.shields_bombs")
+
+    def update(self, key_lst):
+        prof = self.prof
+        self.bird.update(key_lst)
+        self.swords.update(self.bird)
+        if prof:
+            prof.lap("update.bird_swords")
+        for name in ("beams", "emys", "bosses", "bombs", "points", "exps", "shields"):
+            getattr(self, name).update()
+            if prof:
+                prof.lap(f"update.{name}")
+        lifecycle.update({"bomb": self.bombs, "point": self.points, "explosion": self.exps})
+        if prof:
+            prof.lap("lifecycle")
+        self.cooltime.tick(self.tmr)
+        self.tmr += 1
+        self.x += 1
+        if self.x > 3199:
+            self.x = 0
+
+    def hud(self, screen: pg.Surface):
+        """
+        HPバー，スコア，盾の個数，難易度，クールタイムを描画する
+        """
+        self.hud_layer.draw(screen)  # 値が変わった項目だけ描き直される
+        self.cooltime.update(screen, self.tmr, self.bird)
+
+    def remember(self):
+        """
+        次のstep()の前の位置を覚えておく（描画時の補間に使う）
+        """
+        prev = [(self.bird, self.bird.rect, self.bird.rect.topleft)]
+        for name in __class__.draw_order:
+            group = getattr(self, name)
+            if isinstance(group, pg.sprite.AbstractGroup):  # BombFieldは補間せず，現在の位置に描く（爆発は動かない）
+                prev += [(sprite, sprite.rect, sprite.rect.topleft) for sprite in group]
+        self.prev = prev
+
+    def draw(self, renderer: Renderer, alpha: float = 1.0):
+        """
+        1フレームを描画する（画面への転送はrenderer.present()で行う）
+        引数2 alpha：remember()で覚えた位置と現在の位置の間のどこに描くか（1.0で現在の位置）
+        """
+        renderer.prof = self.prof
+        moved = []
+        if alpha < 1.0:
+            back = 1.0 - alpha
+            for sprite, rect, (px, py) in self.prev:
+                # 消えたスプライトや，プールから出し直されて別のrectになったものは補間しない
+                if sprite.rect is rect and (rect.x != px or rect.y != py) and (sprite is self.bird or sprite.alive()):
+                    sprite.rect = rect.move(round((px-rect.x)*back), round((py-rect.y)*back))
+                    moved.append((sprite, rect))
+        try:
+            renderer.draw(self.x, self.bird, [getattr(self, name) for name in __class__.draw_order], self.hud,
+                          __class__.draw_order)
+        finally:
+            for sprite, rect in moved:
+                sprite.rect = rect
+
+    def snapshot(self, table: "ImageTable", sim: float = 0.0) -> "RenderSnapshot":
+        """
+        今の状態を描くのに必要な値だけを持つスナップショットを作る（simスレッドで呼ぶ）
+        引数1 table：画像にIDを振るImageTable
+        引数2 sim：直前のstep()にかかった時間（秒）
+        """
+        ref = table.ref
+        bird = self.bird
+        items = [(ref(bird.image), bird.rect.x, bird.rect.y)]  # fullモードと同じくこうかとんを背景の次に描く
+        for name in __class__.draw_order:
+            group = getattr(self, name)
+            if isinstance(group, pg.sprite.AbstractGroup):
+                items += [(ref(sprite.image), sprite.rect.x, sprite.rect.y) for sprite in group]
+            else:
+                items += [(ref(img), px, py) for img, (px, py) in group.blit_seq()]
+        achievement, cooltime = self.achievement, self.cooltime
+        hud = (bird.hp, bird.max_hp, tuple(bird.rect), self.score.score, self.difficult.difficulty,
+               achievement.score, achievement.shield, cooltime.bar, cooltime.view)
+        counts = tuple((name, len(group)) for name, group in self.groups().items())
+        return RenderSnapshot(self.tmr, self.x, tuple(items), table.publish(), hud, counts, sim, self.over,
+                              self.resolved)
+
+
+class WorldState:
+    """
+    ゲームの状態を，位置，速度，寿命，HPなどの数値だけを詰めたバイト列で持つクラス（Surfaceは保存しない）
+    画像は復元するときにassetsや方向テーブルから引き直す
+    爆弾は持ち方（sprite／numpy）によらず同じ形式なので，どちらのGameにも復元できる
+    """
+    MAGIC = b"KKWS"
+    version = 1
+    HEADER = struct.Struct("<4sBBQI")  # 識別子，版，フラグ，乱数の種，step数
+    # x，ten，通し番号，解決した衝突の数，こうかとんの位置・向き・表情・HP，スコア，難易度，実績4つ，
+    # クールタイム3つ，乱数のgauss_next，敵機の出現・難易度上昇・追加出現の予定step
+    GAME = struct.Struct("<HIIIiiBBbIHIIIIHHidiii")
+    TUNING = struct.Struct("<IIIIIiii")  # Game.tuningの値（extra_spawn_levelのNoneは-1）
+    COUNTS = struct.Struct("<IHHIHHHH")  # Game.groups()の順の数
+    RNG = struct.Struct("<625I")  # random.Randomの内部状態
+    BOMB = struct.Struct("<iiddBBIH")  # 位置，速度，速さ，色，経過時間，跳ね返り回数
+    BEAM = struct.Struct("<iiBB")  # 位置，向き，速さ
+    SWORD = struct.Struct("<iiBh")  # 位置，向き，残り時間
+    BLAST = struct.Struct("<iih")  # 位置，残り時間
+    ENEMY = struct.Struct("<iiBbiBHIi")  # 位置，画像，vy，停止位置，停止中か，投下間隔，通し番号，次の投下のstep
+    BOSS = struct.Struct("<iibbiBHbhIi")  # 位置，HP，vy，停止位置，停止中か，投下間隔，上下の動き2つ，通し番号，次の投下
+    POINT = struct.Struct("<iiiidB")  # 位置，life，経過時間，大きさ，画像
+    SHIELD = struct.Struct("<iibB")  # 位置，残り回数，画像
+    scratch = random.Random(0)  # 作り直すスプライトのコンストラクタに渡す乱数（ゲームの乱数を進めないため）
+
+    def __init__(self, data: bytes):
+        magic, version, self.flags, self.seed, self.tmr = __class__.HEADER.unpack_from(data)
+        if magic != __class__.MAGIC or version != __class__.version:
+            raise ValueError("not a world state")
+        self.data = bytes(data)
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    @property
+    def invincible(self) -> bool:
+        return bool(self.flags & 1)
+
+    @property
+    def collision(self) -> str:
+        return "mask" if self.flags & 2 else "rect"
+
+    @staticmethod
+    def directions(name: str, scale: float, bird: Bird) -> dict:
+        """
+        方向テーブルの画像 -> DIRECTIONSでの番号の辞書
+        """
+        table = dir_table(name, scale, bird.rect.size)
+        return {table[d][0]: i for i, d in enumerate(DIRECTIONS)}
+
+    @classmethod
+    def capture(cls, game: "Game") -> "WorldState":
+        """
+        gameの今の状態を記録する（step()とstep()の間に呼ぶ）
+        """
+        bird, achievement, cooltime, tuning = game.bird, game.achievement, game.cooltime, game.tuning
+        _, internal, gauss = game.rng.getstate()
+        flags = int(game.invincible) | (game.collision == "mask") << 1 | (gauss is not None) << 2 | game.over << 3
+        dues, events = {}, {}  # 敵機 -> 次の投下のstep，種類 -> 次のstep
+        for due, (kind, _), _, timer in game.scheduler.heap:
+            if timer.cancelled:
+                continue
+            if kind in (Game.BOSS_DROP, Game.ENEMY_DROP):
+                dues[timer.args[0]] = due
+            else:
+                events[kind] = due
+        face = {assets.get(f"{num}.png", 0, 2.0): num for num in (6, 8)}.get(bird.image, 0)  # change_img()の画像
+        extra = tuning["extra_spawn_level"]
+        parts = [cls.HEADER.pack(cls.MAGIC, cls.version, flags, game.seed, game.tmr),
+                 cls.GAME.pack(game.x, game.ten, game.serial, game.resolved, bird.rect.x, bird.rect.y,
+                               DIRECTIONS.index(bird.dire), face, bird.hp, game.score.score,
+                               game.difficult.difficulty, achievement.score, achievement.shot, achievement.block,
+                               achievement.shield, cooltime.cooltime, cooltime.bar, cooltime.view, gauss or 0.0,
+                               events.get(Game.SPAWN, -1), events.get(Game.LEVEL_UP, -1),
+                               events.get(Game.EXTRA_SPAWN, -1)),
+                 cls.TUNING.pack(tuning["spawn_every"], tuning["level_every"], tuning["max_level"],
+                                 *tuning["enemy_interval"], *tuning["enemy_bound"], -1 if extra is None else extra),
+                 cls.COUNTS.pack(*(len(group) for group in game.groups().values())),
+                 cls.RNG.pack(*internal)]
+        if game.field is not None:
+            parts.append(game.field.records())
+        else:
+            colors = {Bomb.get_img(color, BombField.rad): i for i, color in enumerate(Bomb.colors)}
+            parts += [cls.BOMB.pack(b.rect.x, b.rect.y, b.vx, b.vy, b.speed, colors[b.image], b.age, b.bounces)
+                      for b in game.bombs]
+        dirs = cls.directions("beam.png", 1.5, bird)
+        parts += [cls.BEAM.pack(b.rect.x, b.rect.y, dirs[b.image], b.speed) for b in game.beams]
+        dirs = cls.directions("sword-3.png", 0.4, bird)
+        parts += [cls.SWORD.pack(s.rect.x, s.rect.y, dirs[s.image], s.life) for s in game.swords]
+        parts += [cls.BLAST.pack(b.x, b.y, b.life) for b in game.exps.blasts]
+        aliens = {assets.get(name): i for i, name in enumerate(Enemy.imgs)}
+        parts += [cls.ENEMY.pack(e.rect.x, e.rect.y, aliens[e.image], e.vy, e.bound, e.state == "stop", e.interval,
+                                 e.serial, dues.get(e, -1)) for e in game.emys]
+        parts += [cls.BOSS.pack(b.rect.x, b.rect.y, b.hp, b.vy, b.bound, b.state == "stop", b.interval, b.move,
+                                b.move_sum, b.serial, dues.get(b, -1)) for b in game.bosses]
+        parts += [cls.POINT.pack(p.rect.x, p.rect.y, p.life, p.age, p.size, p.image is p.imgs[1]) for p in game.points]
+        parts += [cls.SHIELD.pack(s.rect.x, s.rect.y, s.life, s.images.index(s.image)) for s in game.shields]
+        return cls(b"".join(parts))
+
+    def restore(self, game: "Game"):
+        """
+        gameをこの状態に戻す
+        こうかとん以外のスプライトは消してプールなどから作り直す（衝突判定の方式はgameのまま）
+        """
+        cls, data = __class__, self.data
+        off = cls.HEADER.size
+
+        def take(fmt: struct.Struct, n: int = None):
+            nonlocal off
+            start = off
+            if n is None:
+                off += fmt.size
+                return fmt.unpack_from(data, start)
+            off += fmt.size * n
+            return fmt.iter_unpack(data[start:off])
+
+        (game.x, game.ten, game.serial, game.resolved, bx, by, dire, face, hp, score, level, achieved, shot, block,
+         shield, cooltime, bar, view, gauss, spawn_due, level_due, extra_due) = take(cls.GAME)
+        spawn_every, level_every, max_level, low, high, top, bottom, extra = take(cls.TUNING)
+        n_bombs, n_beams, n_swords, n_blasts, n_emys, n_bosses, n_points, n_shields = take(cls.COUNTS)
+        game.rng.setstate((game.rng.getstate()[0], take(cls.RNG), gauss if self.flags & 4 else None))
+        game.tmr = self.tmr
+        game.invincible = self.invincible
+        game.over = bool(self.flags & 8)
+        game.tuning = {"spawn_every": spawn_every, "level_every": level_every, "max_level": max_level,
+                       "enemy_interval": (low, high), "enemy_bound": (top, bottom),
+                       "extra_spawn_level": None if extra < 0 else extra}
+        game.prev = []
+        for group in game.groups().values():
+            if isinstance(group, pg.sprite.AbstractGroup):
+                for sprite in group.sprites():
+                    sprite.kill()  # プールのスプライトはプールに戻る
+        game.scheduler = scheduler = Scheduler()
+
+        bird = game.bird
+        bird.rect.topleft = bx, by
+        bird.dire = DIRECTIONS[dire]
+        bird.image = assets.get(f"{face}.png", 0, 2.0) if face else bird.imgs[bird.dire]
+        bird.hp = hp
+        game.score.score = score
+        game.difficult.difficulty = level
+        achievement = game.achievement
+        achievement.score, achievement.shot, achievement.block, achievement.shield = achieved, shot, block, shield
+        game.cooltime.cooltime, game.cooltime.bar, game.cooltime.view = cooltime, bar, view
+
+        if game.field is not None:
+            game.field.load_records(data[off:off+cls.BOMB.size*n_bombs], n_bombs)
+            off += cls.BOMB.size * n_bombs
+        else:
+            for x, y, vx, vy, speed, color, age, bounces in take(cls.BOMB, n_bombs):
+                # 向きはすぐ上書きするので真下に向けて作る（こうかとんに向けるとcalc_orientationが0で割ることがある）
+                bomb = pools["bomb"].spawn(game.bombs, Spot(pg.Rect(x, y, 0, 0)), Spot(pg.Rect(x, y+1, 0, 0)),
+                                           cls.scratch, grow=True)
+                bomb.image = Bomb.get_img(Bomb.colors[color], BombField.rad)
+                bomb.rect = bomb.image.get_rect(topleft=(x, y))
+                bomb.vx, bomb.vy, bomb.speed, bomb.age, bomb.bounces = vx, vy, speed, age, bounces
+        table = dir_table("beam.png", 1.5, bird.rect.size)
+        for x, y, d, speed in take(cls.BEAM, n_beams):
+            beam = pools["beam"].spawn(game.beams, bird, grow=True)
+            beam.image, rect, beam.vx, beam.vy, _, _ = table[DIRECTIONS[d]]
+            beam.rect = rect.move(x, y)
+            beam.speed = speed
+        table = dir_table("sword-3.png", 0.4, bird.rect.size)
+        for x, y, d, life in take(cls.SWORD, n_swords):
+            sword = Sword(bird, life)
+            sword.image, rect, sword.vx, sword.vy, sword.ox, sword.oy = table[DIRECTIONS[d]]
+            sword.rect = rect.move(x, y)
+            game.swords.add(sword)
+        game.exps.blasts = [Blast(x, y, life) for x, y, life in take(cls.BLAST, n_blasts)]
+        for x, y, img, vy, stop_at, stopped, interval, serial, due in take(cls.ENEMY, n_emys):
+            emy = Enemy(cls.scratch)
+            emy.image = assets.get(Enemy.imgs[img])
+            emy.rect = emy.image.get_rect(topleft=(x, y))
+            emy.vy, emy.bound, emy.interval, emy.serial = vy, stop_at, interval, serial
+            emy.state = "stop" if stopped else "down"
+            emy.on_stop = game.arm
+            game.emys.add(emy)
+            if due >= 0:
+                game.schedule_drop(emy, due)
+        for x, y, hp, vy, stop_at, stopped, interval, move, move_sum, serial, due in take(cls.BOSS, n_bosses):
+            boss = BOSS(cls.scratch)
+            boss.rect.topleft = x, y
+            boss.hp, boss.vy, boss.bound, boss.interval, boss.serial = hp, vy, stop_at, interval, serial
+            boss.state = "stop" if stopped else "down"
+            boss.move, boss.move_sum = move, move_sum
+            boss.on_stop = game.arm
+            game.bosses.add(boss)
+            if due >= 0:
+                game.schedule_drop(boss, due)
+        for x, y, life, age, size, img in take(cls.POINT, n_points):
+            point = pools["point"].spawn(game.points, Spot(pg.Rect(x, y, 0, 0)), life, size, grow=True)
+            point.image = point.imgs[img]
+            point.rect = point.image.get_rect(topleft=(x, y))
+            point.age = age
+        for x, y, life, img in take(cls.SHIELD, n_shields):
+            guard = Shield(bird)
+            guard.rect.topleft = x, y
+            guard.life = life
+            guard.image = guard.images[img]
+            game.shields.add(guard)
+
+        for due, kind, func in ((spawn_due, Game.SPAWN, game.spawn_enemy), (level_due, Game.LEVEL_UP, game.level_up),
+                                (extra_due, Game.EXTRA_SPAWN, game.spawn_extra)):
+            if due >= 0:
+                scheduler.at(due, (kind, 0), func)
+
+    def new_game(self, bomb_engine: str = "sprite") -> "Game":
+        """
+        この状態から始まるGameを作る（無敵，衝突判定は記録したときのまま，爆弾の持ち方は選べる）
+        """
+        game = Game(self.invincible, self.seed, bomb_engine, collision=self.collision)
+        self.restore(game)
+        return game
+
+    def save(self, path: str):
+        with open(path, "wb") as f:
+            f.write(self.data)
+
+    @classmethod
+    def load(cls, path: str) -> "WorldState":
+        with open(path, "rb") as f:
+            return cls(f.read())
+
+
+class RewindBuffer:
+    """
+    everyステップごとのWorldStateを，最初に確保したmax_bytesのbytearrayに順に書き込むリングバッファ
+    書き込む場所が足りなくなったら先頭に戻り，重なった古い状態から上書きする（メモリの使用量は変わらない）
+    """
+    def __init__(self, every: int = 50, max_bytes: int = 8*2**20):
+        """
+        引数1 every：状態を記録する間隔（step数）
+        引数2 max_bytes：バッファの大きさ（バイト）
+        """
+        self.every = every
+        self.buffer = bytearray(max_bytes)
+        self.entries = collections.deque()  # (step数, 位置, 長さ)，古い順
+        self.head = 0  # 次に書き込む位置
+        self.taken = 0  # 記録した数
+        self.overwritten = 0  # 上書きで消えた数
+        self.seconds = 0.0  # 記録にかかった時間の合計
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def offer(self, game: "Game") -> bool:
+        """
+        game.tmrがeveryの倍数で，まだ記録していないstepなら状態を記録する
+        戻り値：記録したか
+        """
+        if game.tmr % self.every or (self.entries and self.entries[-1][0] == game.tmr):
+            return False
+        start = time.perf_counter()
+        self.push(WorldState.capture(game))
+        self.seconds += time.perf_counter() - start
+        return True
+
+    def push(self, state: WorldState):
+        n = len(state)
+        if n > len(self.buffer):
+            raise ValueError(f"world state of {n} bytes does not fit in {len(self.buffer)} bytes")
+        if self.head + n > len(self.buffer):
+            self.head = 0
+        start, end = self.head, self.head + n
+        kept = collections.deque(e for e in self.entries if e[1] >= end or e[1]+e[2] <= start)
+        self.overwritten += len(self.entries) - len(kept)
+        self.entries = kept
+        self.buffer[start:end] = state.data
+        self.entries.append((state.tmr, start, n))
+        self.head = end
+        self.taken += 1
+
+    def get(self, i: int) -> WorldState:
+        """
+        i番目（古い順，負の数は新しい順）の状態
+        """
+        _, start, n = self.entries[i]
+        return WorldState(self.buffer[start:start+n])
+
+    def latest(self) -> "WorldState|None":
+        return self.get(-1) if self.entries else None
+
+    def rewind(self, tmr: int) -> "WorldState|None":
+        """
+        step数がtmr以下で最も新しい状態（なければ最も古い状態）を返し，それより新しい記録は捨てる
+        """
+        if not self.entries:
+            return None
+        tmr = max(tmr, self.entries[0][0])
+        while self.entries[-1][0] > tmr:
+            self.entries.pop()
+        _, start, n = self.entries[-1]
+        self.head = start + n  # 捨てた記録の場所から書き直す
+        return self.get(-1)
+
+    def stats(self) -> dict:
+        used = sum(n for _, _, n in self.entries)
+        return {"states": len(self.entries), "bytes": used, "capacity": len(self.buffer),
+                "oldest": self.entries[0][0] if self.entries else None,
+                "newest": self.entries[-1][0] if self.entries else None,
+                "taken": self.taken, "overwritten": self.overwritten,
+                "capture_ms": round(self.seconds / self.taken * 1e3, 3) if self.taken else 0.0}
+
+
+class ImageTable:
+    """
+    simスレッドでスプライトの画像に通し番号（ID）を振るクラス
+    初めて出てきた画像はコピーを作ってpublish()で描画側に渡し，渡したコピーにはsimスレッドから触らない
+    元の画像はIDを引くための辞書のキーとしてだけ持つ（同じSurfaceが別のIDにならないようにする）
+    """
+    def __init__(self):
+        self.ids = {}  # 元の画像 -> ID
+        self.new = []  # まだ渡していない(ID, コピー)のリスト
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def ref(self, img: pg.Surface) -> int:
+        i = self.ids.get(img)
+        if i is None:
+            i = self.ids[img] = len(self.ids)
+            self.new.append((i, img.copy()))
+        return i
+
+    def publish(self) -> tuple:
+        """
+        戻り値：前回から新しく出てきた(ID, コピー)のタプル
+        """
+        new, self.new = tuple(self.new), []
+        return new
+
+
+class RenderSnapshot:
+    """
+    1フレームを描くための値をまとめたもの（作った後は変更しない）
+    スプライトは(画像ID, x, y)のタプルで持ち，pygameのオブジェクトは新しい画像のコピーだけを含む
+    """
+    __slots__ = ("tmr", "x", "items", "images", "hud", "counts", "sim", "over", "resolved")
+
+    def __init__(self, tmr: int, x: int, items: tuple, images: tuple, hud: tuple, counts: tuple,
+                 sim: float, over: bool, resolved: int = 0):
+        """
+        引数1 tmr：step数
+        引数2 x：背景のスクロール位置
+        引数3 items：奥から順の(画像ID, x, y)のタプル
+        引数4 images：このスナップショットで初めて出てきた(画像ID, 画像)のタプル
+        引数5 hud：HudMirror.apply()に渡すHUDの値
+        引数6 counts：(グループ名, スプライト数)のタプル
+        引数7 sim：step()にかかった時間（秒）
+        引数8 over：こうかとんが倒れたか
+        引数9 resolved：解決した衝突の数（Game.resolved）
+        """
+        self.tmr = tmr
+        self.x = x
+        self.items = items
+        self.images = images
+        self.hud = hud
+        self.counts = counts
+        self.sim = sim
+        self.over = over
+        self.resolved = resolved
+
+
+class HudMirror:
+    """
+    スナップショットのHUDの値を，メインスレッドが持つ表示用のHUD（Score，HPBarなど）に写して描くクラス
+    GameのHUDはsimスレッドのものなので，Pipelineを使うときは描画に使わない
+    HPBarとCooltimeにはこうかとんの代わりに自分を渡す（hp，max_hp，rectを持つ）
+    """
+    def __init__(self):
+        self.hp = self.max_hp = 0
+        self.rect = pg.Rect(0, 0, 0, 0)
+        self.tmr = 0
+        self.score = Score()
+        self.difficult = Difficult()
+        self.achievement = Achievement()
+        self.shield_count = Shiled_count()
+        self.cooltime = Cooltime()
+        self.hp_bar = HPBar(self)
+        self.layer = HudLayer(self.hp_bar, self.score, self.difficult, self.shield_count, self.achievement)
+
+    def apply(self, tmr: int, hud: tuple):
+        """
+        引数1 tmr：スナップショットのstep数
+        引数2 hud：Game.snapshot()が作ったHUDの値
+        """
+        (self.hp, self.max_hp, rect, self.score.score, self.difficult.difficulty,
+         self.achievement.score, self.achievement.shield, self.cooltime.bar, self.cooltime.view) = hud
+        self.rect.update(rect)
+        self.tmr = tmr
+
+    def draw(self, screen: pg.Surface):
+        self.layer.draw(screen)
+        self.cooltime.update(screen, self.tmr, self)
+
+
+class InputMailbox:
+    """
+    メインスレッドで読んだキーボードの入力をsimスレッドに渡すクラス（simスレッド側の入力として使う）
+    押下中のキーは最新の値で上書きし，押されたキーはsimスレッドが読むまでためておく
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.held = 0  # 押下中のキーのビット列（REC_KEYSの順）
+        self.down = 0  # まだ読まれていない押されたキーのビット列
+
+    def attach(self, game: "Game"):
+        pass
+
+    def close(self):
+        pass
+
+    def push(self, key_lst, downs: list, quit: bool):
+        """
+        メインスレッドで呼ぶ
+        """
+        held, down = encode_input(key_lst, downs, quit)
+        with self.lock:
+            self.held = held
+            self.down |= down
+
+    def poll(self) -> tuple:
+        """
+        simスレッドで呼ぶ
+        """
+        with self.lock:
+            held, down = self.held, self.down
+            self.down = 0
+        return decode_input(held, down)
+
+
+class Pipeline:
+    """
+    シミュレーションを別スレッド（simスレッド）で進め，RenderSnapshotを長さの決まったキューで
+    メインスレッドに渡すクラス（メインスレッドはスナップショットを描いて画面に転送する）
+    所有権：
+        simスレッド：Game（全スプライトとその画像，HUDの値），入力（poll()），ImageTable
+        メインスレッド：画面，Renderer，HudMirror，ImageTableから受け取った画像のコピー，イベント，FrameProfiler
+    両方のスレッドが触るのはキュー，InputMailbox，停止フラグだけで，どれもpygameのオブジェクトではない
+    キューが満ちているとsimスレッドは待つ（描画より先に進むのはdepthフレームまで）
+    """
+    def __init__(self, game: "Game", inputs, depth: int = 2, rate: int = None):
+        """
+        引数1 game：simスレッドに渡すGame（start()の後はメインスレッドから触らない）
+        引数2 inputs：simスレッドでpoll()する入力
+        引数3 depth：キューの長さ
+        引数4 rate：1秒あたりのstep数（Noneのときは待たずに進める）
+        """
+        self.game = game
+        self.inputs = inputs
+        self.queue = queue.Queue(maxsize=depth)
+        self.rate = rate
+        self.stopping = threading.Event()
+        self.thread = None
+        self.error = None  # simスレッドで起きた例外
+        self.done = False  # simスレッドが最後のスナップショットを出したか（メインスレッド側の記録）
+        self.images = {}  # 画像ID -> 画像（メインスレッドのもの）
+        self.blocked = 0.0  # simスレッドがキューの空きを待った時間（秒）
+        self.dropped = 0  # 追いつけずに捨てたstep数
+        self.produced = self.rendered = self.skipped = 0
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="sim", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        simスレッドを止めて終わるのを待つ（終わった後はGameと入力の持ち主はメインスレッドに戻る）
+        """
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def _put(self, snap: "RenderSnapshot|None") -> bool:
+        start = time.perf_counter()
+        while not self.stopping.is_set():
+            try:
+                self.queue.put(snap, timeout=0.05)
+            except queue.Full:
+                continue
+            self.blocked += time.perf_counter() - start
+            return True
+        return False
+
+    def _run(self):
+        game, inputs = self.game, self.inputs
+        table = ImageTable()
+        dt = 1 / self.rate if self.rate else 0.0
+        due = time.perf_counter()  # 次のstepの予定時刻
+        try:
+            while not self.stopping.is_set():
+                if dt:
+                    now = time.perf_counter()
+                    if now < due:
+                        time.sleep(due - now)
+                    elif now - due > Game.max_catchup*dt:  # 遅れすぎたら取り戻さずに捨てる
+                        self.dropped += int((now-due) / dt)
+                        due = now
+                    due += dt
+                key_lst, downs, quit = inputs.poll()
+                if quit:
+                    break
+                start = time.perf_counter()
+                game.step(key_lst, downs)
+                if game.over:
+                    game.bird.change_img(8)  # こうかとん悲しみエフェクト
+                snap = game.snapshot(table, time.perf_counter() - start)
+                if not self._put(snap):
+                    return
+                self.produced += 1
+                if game.over:
+                    break
+        except BaseException as e:
+            self.error = e
+        self._put(None)  # 終わりの印
+
+    def latest(self, timeout: float = 0.05) -> "RenderSnapshot|None":
+        """
+        キューにたまったスナップショットを全て受け取り，最新のものを返す（メインスレッドで呼ぶ）
+        古いスナップショットは描かないが，新しい画像は受け取っておく
+        戻り値：最新のスナップショット（timeoutまでに来なかったとき，終わったときはNone）
+        """
+        if self.done:
+            return None
+        try:
+            snaps = [self.queue.get(timeout=timeout)]
+        except queue.Empty:
+            return None
+        while True:
+            try:
+                snaps.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        last = None
+        for snap in snaps:
+            if snap is None:
+                self.done = True
+                if self.error is not None:
+                    raise self.error
+                break
+            self.images.update(snap.images)
+            if last is not None:
+                self.skipped += 1
+            last = snap
+        if last is not None:
+            self.rendered += 1
+        return last
+
+    def seq(self, snap: "RenderSnapshot") -> list:
+        """
+        戻り値：スナップショットのスプライトを(画像, 位置)にしたリスト（Renderer.draw_items用）
+        """
+        images = self.images
+        return [(images[i], (x, y)) for i, x, y in snap.items]
+
+    def stats(self) -> dict:
+        return {"produced": self.produced, "rendered": self.rendered, "skipped": self.skipped,
+                "dropped": self.dropped, "images": len(self.images), "blocked": self.blocked}
+
+
+def open_inputs(source, seed: int = None, invincible: bool = False, record: str = None,
+                replay: str = None, bomb_engine: str = "sprite", collision: str = "rect", resume: str = None) -> tuple:
+    """
+    ゲームと入力を用意する
+    引数1 source：入力（replayを指定したときは，キーボードから終了要求とF3などを読むのにだけ使う）
+    引数2 seed：乱数の種
+    引数3 invincible：Trueのときこうかとんが倒れない
+    引数4 record：入力を記録するファイルのパス
+    引数5 replay：再生する記録ファイルのパス（種，無敵，衝突判定の設定も記録から読む）
+    引数6 bomb_engine：爆弾の持ち方（Game参照）
+    引数7 collision：衝突判定の方式（Game参照）
+    引数8 resume：続きから始めるWorldStateのファイルのパス（種，無敵，衝突判定の設定もそこから読む）
+    戻り値：(Game, 入力)
+    """
+    if replay is not None:
+        replay_input = ReplayInput(replay)
+        seed, invincible, collision = replay_input.seed, replay_input.invincible, replay_input.collision
+        # 画面のあるプレイでは，終了要求とF3などを読むためにキーボードのイベントも毎step読む
+        keyboard = source.keyboard if isinstance(source, BotInput) else source
+        if isinstance(keyboard, (KeyboardInput, InputMailbox)):
+            source = BotInput(keyboard, replay_input)
+        else:
+            source = replay_input
+    if record is not None:
+        source = InputRecorder(source, record)
+    if resume is not None:
+        game = WorldState.load(resume).new_game(bomb_engine)
+    else:
+        game = Game(invincible, seed, bomb_engine, collision=collision)
+    source.attach(game)
+    return game, source
+
+
+def replay_of(inputs) -> "ReplayInput|None":
+    """
+    戻り値：open_inputs()が返した入力の中のReplayInput（再生していないときはNone）
+    """
+    if isinstance(inputs, InputRecorder):
+        inputs = inputs.source
+    if isinstance(inputs, BotInput):
+        inputs = inputs.bot
+    return inputs if isinstance(inputs, ReplayInput) else None
+
+
+def report_replay(inputs):
+    """
+    再生した結果が記録と一致したかを表示する
+    """
+    inputs = replay_of(inputs)
+    if inputs is not None:
+        if inputs.diverged is None:
+            print(f"replay matched: {inputs.verified} checkpoints over {inputs.frames} frames")
+        else:
+            print(f"replay diverged at frame {inputs.diverged}")
+
+
+def report_startup(times: dict):
+    """
+    起動時間（プロセスの起動からの秒数）を表示する
+    """
+    title = f"{times['title']:.3f} s" if "title" in times else "skipped"
+    ready = f"{times['assets']:.3f} s" if "assets" in times else "before title"
+    print(f"startup: first title frame {title}, assets ready {ready},"
+          f" first game frame {times['game']:.3f} s (waited {times['waited']*1e3:.1f} ms for assets)")
+
+
+def play_threaded(screen: pg.Surface, renderer: Renderer, game: "Game", inputs, mailbox: InputMailbox,
+                  profiler: FrameProfiler, times: dict, startup: bool = False, telemetry: Telemetry = None):
+    """
+    Pipelineでシミュレーションをsimスレッドに任せ，メインスレッドではイベントの読み込みと描画だけを行う
+    引数1 screen：画面Surface
+    引数2 renderer：fullまたはscaledモードのRenderer
+    引数3 game：ゲーム（simスレッドに渡す）
+    引数4 inputs：simスレッドでpoll()する入力（キーボードのときはmailboxそのもの）
+    引数5 mailbox：キーボードの入力を渡すInputMailbox
+    引数6 profiler：FrameProfiler
+    引数7 times：起動時間の計測結果
+    引数8 startup：最初のゲーム画面までの時間を表示するか
+    引数9 telemetry：フレームごとの記録を書き出すTelemetry
+    """
+    keyboard = KeyboardInput()
+    hud = HudMirror()
+    pipeline = Pipeline(game, inputs, rate=Game.rate)
+    pipeline.start()
+    try:
+        while True:
+            prof = profiler.active()
+            renderer.prof = prof
+            if prof:
+                prof.begin_frame()
+            key_lst, downs, quit = keyboard.poll()
+            if quit:
+                return 0
+            if pg.K_F3 in downs:
+                profiler.toggle()
+            mailbox.push(key_lst, downs, False)
+            snap = pipeline.latest()  # 次のスナップショットが来るまで待つ（描画の速さはstepの速さで決まる）
+            if snap is None:
+                if pipeline.done:
+                    return
+                continue
+            if prof:
+                prof.lap("wait")
+            draw_start = time.perf_counter()
+            hud.apply(snap.tmr, snap.hud)
+            renderer.draw_items(snap.x, pipeline.seq(snap), hud.draw)
+            if prof:
+                counts = dict(snap.counts)
+                counts.update(queue=pipeline.queue.qsize(), skipped=pipeline.skipped, dropped=pipeline.dropped,
+                              sim_ms=round(snap.sim*1e3, 2), **renderer.draw_stats())
+                if renderer.scaler:
+                    counts["scale"] = renderer.scale
+                renderer.add_overlay(prof.draw(screen, counts))
+                prof.lap("profiler")
+            renderer.present()
+            if "game" not in times:
+                times["game"] = since_start()
+                if startup:
+                    report_startup(times)
+            if prof:
+                prof.lap("present")
+                prof.end_frame()
+            renderer.end_frame(time.perf_counter() - draw_start)
+            if telemetry:
+                telemetry.record(snap.tmr, time.perf_counter() - draw_start + snap.sim, dict(snap.counts),
+                                 snap.resolved, snap.hud[4])
+            if snap.over:
+                time.sleep(2)
+                return
+    finally:
+        pipeline.stop()  # ここからGameと入力はメインスレッドのもの
+        inputs.close()
+        report_replay(inputs)
+        if profiler.enabled:
+            print(f"pipeline: {pipeline.stats()}")
+
+
+def main(render_mode: str = "full", seed: int = None, record: str = None, replay: str = None,
+         profile: bool = False, bomb_engine: str = "sprite", fps: int = 120, startup: bool = False,
+         threaded: bool = False, collision: str = "rect", telemetry: str = None, telemetry_bytes: int = 16*2**20,
+         resume: str = None, rewind_every: int = 50, rewind_bytes: int = 8*2**20, crash_dump: str = None,
+         atlas: bool = False, inputs: str = "keyboard"):
+    pg.display.set_caption("勇者こうかとん")
+    screen = pg.display.set_mode((WIDTH, HEIGHT))
+    """
+    追加機能(タイトル表示)
+    タイトル画面に"HERO KOKATON"と"Press Enter to Start"を表示
+    """
+    title = Title()  # タイトルに使う画像だけ先に読み込む
+    assets.load_async()  # 残りの画像はタイトルを表示している間に読み込む
+    times = {}  # 起動時間の計測結果
+    clock = pg.time.Clock()
+    running = replay is None and resume is None  # 再生するとき，続きから始めるときはタイトルを飛ばす
+
+    while running:
+        for event in pg.event.get():
+            if event.type == pg.QUIT:
+                return 0
+            if event.type == pg.KEYDOWN and event.key == pg.K_RETURN:
+                running = False
+        title.update(screen)
         pg.display.update()
-        tmr += 1
-        clock.tick(50)
-            
-            
-        x += 1
-        
-        if x > 3199:
-            x = 0
+        times.setdefault("title", since_start())
+        if "assets" not in times and assets.ready():
+            times["assets"] = since_start()
+        assets.adopt(2)  # 読み込み終わった画像を少しずつ変換する
+        clock.tick(Title.fps)  # 静止画なので毎フレーム全力で描き直さない
+
+    start = time.perf_counter()
+    assets.wait()  # 最初のフレームの前に全画像をそろえる．以降のゲーム中はディスクから読み込まない
+    times["waited"] = time.perf_counter() - start
+    renderer = Renderer(screen, render_mode, atlas=atlas)
+    profiler = FrameProfiler(enabled=profile)  # F3で表示を切り替える
+    sink = Telemetry(telemetry, max_bytes=telemetry_bytes) if telemetry else None
+    try:
+        if threaded:
+            mailbox = InputMailbox()
+            source = mailbox if inputs == "keyboard" else BotInput(mailbox, input_sources[inputs]())
+            game, source = open_inputs(source, seed, record=record, replay=replay, bomb_engine=bomb_engine,
+                                       collision=collision, resume=resume)
+            return play_threaded(screen, renderer, game, source, mailbox, profiler, times, startup, sink)
+        # 記録・再生中に巻き戻すと入力と状態が合わなくなるので，巻き戻しは記録も再生もしないときだけ
+        rewind = RewindBuffer(rewind_every, rewind_bytes) if rewind_every and record is None and replay is None else None
+        return play(screen, renderer, seed, record, replay, profiler, bomb_engine, fps, times, startup,
+                    collision, sink, resume, rewind, crash_dump, inputs)
+    finally:
+        if sink:
+            sink.close()
+            print(f"telemetry: {sink.stats()} -> {telemetry}")
+
+
+def play(screen: pg.Surface, renderer: Renderer, seed: int, record: str, replay: str, profiler: FrameProfiler,
+         bomb_engine: str, fps: int, times: dict, startup: bool, collision: str, telemetry: Telemetry = None,
+         resume: str = None, rewind: RewindBuffer = None, crash_dump: str = None, bot: str = "keyboard"):
+    """
+    メインスレッドでシミュレーションと描画を交互に行う（引数はmain()とplay_threaded()を参照）
+    botがkeyboard以外のときは，こうかとんをinput_sources[bot]で操作する（キーボードは終了とF3，F5だけ）
+    rewindがあるときはrewind.everyステップごとに状態を記録し，F5で1秒以上前の記録まで巻き戻す
+    例外で止まったときは，crash_dumpに最後に記録した状態（rewindがないときは例外が起きた時点の状態）を書き出す
+    （--resumeで続きから始められる）
+    """
+    keyboard = KeyboardInput()
+    source = keyboard if bot == "keyboard" else BotInput(keyboard, input_sources[bot]())
+    game, inputs = open_inputs(source, seed, record=record, replay=replay, bomb_engine=bomb_engine,
+                               collision=collision, resume=resume)
+    if renderer.atlas is not None:
+        renderer.warm(game.sprite_images())
+    clock = pg.time.Clock()
+    dt = 1 / Game.rate
+    acc = 0.0  # まだ進めていないシミュレーション時間（秒）
+    dropped = 0  # 追いつけずに捨てたstep数
+    last = time.perf_counter()
+    try:
+        while True:
+            prof = profiler.active()
+            if prof:
+                prof.begin_frame()
+            now = time.perf_counter()
+            frame_start = now
+            acc += now - last
+            last = now
+            steps = int(acc / dt)
+            if steps > Game.max_catchup:  # 長く止まったときに遅れを取り戻そうとして更に遅れるのを防ぐ
+                dropped += steps - Game.max_catchup
+                acc -= (steps - Game.max_catchup) * dt
+                steps = Game.max_catchup
+            game.prof = prof
+            for i in range(steps):
+                if i == steps-1:
+                    game.remember()
+                key_lst, downs, quit = inputs.poll()
+                if quit:
+                    return 0
+                if pg.K_F3 in keyboard.downs:
+                    profiler.toggle()
+                if rewind is not None and pg.K_F5 in keyboard.downs:
+                    state = rewind.rewind(game.tmr - Game.rate)
+                    if state is not None:
+                        state.restore(game)
+                if prof:
+                    prof.lap("events")
+                game.step(key_lst, downs)
+                if rewind is not None:
+                    rewind.offer(game)
+                acc -= dt
+                if game.over:
+                    game.bird.change_img(8, screen)  # こうかとん悲しみエフェクト
+                    game.score.update(screen)
+                    pg.display.update()
+                    time.sleep(2)
+                    return
+            game.draw(renderer, max(acc, 0.0) / dt)
+            if prof:
+                counts = {name: len(group) for name, group in game.groups().items()}
+                counts.update(steps=steps, dropped=dropped, **renderer.draw_stats())
+                if isinstance(source, BotInput) and replay is None:
+                    cost = source.stats()
+                    counts.update(bot_us=cost.get("mean_us"), bot_p99_us=cost.get("p99_us"))
+                if renderer.scaler:
+                    counts["scale"] = renderer.scale
+                renderer.add_overlay(prof.draw(screen, counts))
+                prof.lap("profiler")
+            renderer.present()
+            if "game" not in times:
+                times["game"] = since_start()
+                if startup:
+                    report_startup(times)
+            if prof:
+                prof.lap("present")
+                prof.end_frame()
+            renderer.end_frame(time.perf_counter() - frame_start)
+            if telemetry:
+                telemetry.record(game.tmr, time.perf_counter() - frame_start,
+                                 {name: len(group) for name, group in game.groups().items()},
+                                 game.resolved, game.difficult.difficulty)
+            clock.tick(fps)
+    except Exception:
+        if crash_dump:
+            state = rewind.latest() if rewind is not None else None
+            if state is None:  # 巻き戻しの記録がない（--record，--replay，--rewind-every 0）ときは今の状態を書き出す
+                try:
+                    state = WorldState.capture(game)
+                except Exception as e:
+                    print(f"crash dump: no snapshot to write ({e!r})", file=sys.stderr)
+            if state is not None:
+                state.save(crash_dump)
+                print(f"crash dump: step {state.tmr} -> {crash_dump} (resume with --resume {crash_dump})",
+                      file=sys.stderr)
+        raise
+    finally:
+        inputs.close()
+        report_replay(inputs)
+        if rewind is not None and profiler.enabled:
+            print(f"rewind: {rewind.stats()}")
+        if isinstance(source, BotInput) and replay is None:
+            print(f"{bot}: {source.stats()}")
+
+
+def run_headless(frames: int, inputs=None, draw: bool = False, invincible: bool = False,
+                 seed: int = None, record: str = None, replay: str = None, bomb_engine: str = "sprite",
+                 render_mode: str = "full", collision: str = "rect", telemetry: "Telemetry|None" = None,
+                 resume: str = None, save_state: str = None, atlas: bool = False) -> dict:
+    """
+    画面なし（SDLのdummyドライバ）でタイトルを飛ばし，framesフレームをフレーム制限なしで実行する
+    引数1 frames：実行するフレーム数
+    引数2 inputs：入力（poll()を持つもの，既定はScriptedInput）
+    引数3 draw：Trueのとき描画も行う（Falseのときはシミュレーションのみ計測）
+    引数4 invincible：Trueのときこうかとんが倒れない
+    引数5 seed：乱数の種
+    引数6 record：入力を記録するファイルのパス
+    引数7 replay：再生する記録ファイルのパス
+    引数8 bomb_engine：爆弾の持ち方（Game参照）
+    引数9 render_mode：drawのときの描画方式（Renderer参照）
+    引数10 collision：衝突判定の方式（Game参照）
+    引数11 telemetry：stepごとの記録を渡すTelemetry（閉じるのは呼び出し側）
+    引数12 resume：続きから始めるWorldStateのファイルのパス
+    引数13 save_state：最後の状態をWorldStateとして書き出すパス
+    引数14 atlas：drawのときスプライトをSpriteAtlasから1回のblitsで描く
+    inputsがstats()を持つとき（AutopilotInput）は，その時間を結果の"inputs"に分けて返す
+    戻り値：実行したフレーム数，時間，FPSなどの辞書
+    """
+    os.environ["SDL_VIDEODRIVER"] = "dummy"
+    pg.init()
+    screen = pg.display.set_mode((WIDTH, HEIGHT))
+    assets.load_all()
+    renderer = Renderer(screen, render_mode, atlas=atlas) if draw else None
+    source = ScriptedInput() if inputs is None else inputs
+    game, inputs = open_inputs(source, seed, invincible, record, replay, bomb_engine, collision, resume)
+    if renderer is not None and renderer.atlas is not None:
+        renderer.warm(game.sprite_images())
+    first = game.tmr  # 続きから始めたときは0でない
+    start = time.perf_counter()
+    try:
+        for _ in range(frames):
+            frame_start = time.perf_counter()
+            key_lst, downs, quit = inputs.poll()
+            if quit:
+                break
+            game.step(key_lst, downs)
+            if game.over:
+                break
+            if draw:
+                game.draw(renderer)
+                renderer.present()
+                renderer.end_frame(time.perf_counter() - frame_start)
+            if telemetry:
+                telemetry.record(game.tmr, time.perf_counter() - frame_start,
+                                 {name: len(group) for name, group in game.groups().items()},
+                                 game.resolved, game.difficult.difficulty)
+    finally:
+        inputs.close()
+    elapsed = time.perf_counter() - start
+    frames = game.tmr - first
+    result = {"frames": frames, "seconds": elapsed, "fps": frames / elapsed if elapsed > 0 else 0.0, "tmr": game.tmr,
+              "over": game.over, "score": game.score.score, "achievement": game.achievement.score,
+              "seed": game.seed, "checksum": game.checksum(),
+              "entities": {name: len(group) for name, group in game.groups().items()}}
+    if renderer is not None and renderer.scaler:
+        result["render_scale"] = renderer.scaler.stats()
+    if renderer is not None and renderer.atlas is not None:
+        result["atlas"] = renderer.atlas.stats()
+    if replay is None and hasattr(source, "stats"):
+        result["inputs"] = source.stats()
+    if game.collision == "mask":
+        result["masks"] = masks.stats()
+    played = replay_of(inputs)
+    if played is not None:
+        result["diverged"] = played.diverged
+        result["verified"] = played.verified
+    if save_state is not None:
+        state = WorldState.capture(game)
+        state.save(save_state)
+        result["state_bytes"] = len(state)
+    return result
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="勇者こうかとん")
+    parser.add_argument("--render", choices=Renderer.modes, default="full",
+                        help="描画方式（full：毎フレーム全体，dirty：変化した領域のみ，"
+                             "scaled：処理が遅れたら内部解像度を下げる）")
+    parser.add_argument("--atlas", action="store_true",
+                        help="スプライトの画像を数枚のSurfaceに詰め，全グループを1回のblitsで描く（fullとscaledのみ）")
+    parser.add_argument("--headless", type=int, metavar="FRAMES",
+                        help="画面なしで指定フレーム数をフレーム制限なしで実行し，FPSを表示する")
+    parser.add_argument("--draw", action="store_true", help="--headlessで描画も行う")
+    parser.add_argument("--invincible", action="store_true", help="--headlessでこうかとんが倒れない")
+    parser.add_argument("--inputs", choices=("keyboard", *input_sources),
+                        help="こうかとんの操作（autopilot：爆弾をよけながら攻撃するbot．"
+                             "既定はkeyboard，--headlessではscripted）")
+    parser.add_argument("--profile", action="store_true", help="段階ごとの処理時間を表示する（F3で切り替え）")
+    parser.add_argument("--startup", action="store_true", help="起動から最初のタイトル画面，ゲーム画面までの時間を表示する")
+    parser.add_argument("--fps", type=int, default=120, help="描画の上限FPS（0で上限なし，ゲームの進み方は変わらない）")
+    parser.add_argument("--threaded", action="store_true",
+                        help="シミュレーションを別スレッドで進め，メインスレッドは描画と画面への転送だけを行う")
+    parser.add_argument("--bombs", choices=Game.bomb_engines, default="sprite",
+                        help="爆弾の持ち方（numpy：配列でまとめて動かす）")
+    parser.add_argument("--collision", choices=Game.collisions, default="rect",
+                        help="衝突判定（mask：矩形が重なったものを画像の不透明な画素で調べ直す）")
+    parser.add_argument("--telemetry", metavar="PATH",
+                        help="フレームごとの記録をPATHに書き出す（.csvで終わるときはCSV，それ以外はJSONL）")
+    parser.add_argument("--telemetry-mb", type=float, default=16,
+                        help="記録ファイル1つの大きさの上限（MB，超えたらPATH.1，PATH.2，PATH.3にずらす）")
+    parser.add_argument("--pool-policy", choices=SpritePool.policies, default="grow",
+                        help="爆弾・ビーム・ポイントのプールを使い切ったとき（grow：容量を増やす／drop：生成しない／"
+                             "recycle：最も古いものを再利用．記録ファイルには保存されないので再生でも同じものを指定する）")
+    parser.add_argument("--seed", type=int, help="乱数の種")
+    parser.add_argument("--record", metavar="PATH", help="入力をファイルに記録する")
+    parser.add_argument("--replay", metavar="PATH", help="記録した入力を再生し，状態が一致するか確かめる")
+    parser.add_argument("--resume", metavar="PATH", help="書き出したゲームの状態（--save-state，--crash-dump）から始める")
+    parser.add_argument("--save-state", metavar="PATH", help="--headlessの最後の状態を書き出す")
+    parser.add_argument("--crash-dump", metavar="PATH", help="例外で止まったとき，最後に記録した状態を書き出す")
+    parser.add_argument("--rewind-every", type=int, default=50,
+                        help="巻き戻し（F5）用に状態を記録する間隔（step数，0で記録しない）")
+    parser.add_argument("--rewind-mb", type=float, default=8, help="巻き戻し用の記録に使うメモリ（MB）")
+    args = parser.parse_args()
+    if args.resume and (args.record or args.replay):
+        parser.error("--resume cannot be combined with --record or --replay")
+    if args.atlas and args.render == "dirty":
+        parser.error("--atlas supports --render full and scaled")
+    if args.crash_dump and args.threaded:
+        parser.error("--crash-dump cannot be used with --threaded")
+    if args.headless is not None and args.inputs == "keyboard":
+        parser.error("--headless cannot read the keyboard; choose --inputs scripted, policy or autopilot")
+    set_pool_policy(args.pool_policy)
+    telemetry_bytes = int(args.telemetry_mb * 2**20)
+    if args.headless is not None:
+        sink = Telemetry(args.telemetry, max_bytes=telemetry_bytes) if args.telemetry else None
+        try:
+            source = input_sources[args.inputs]() if args.inputs else None
+            result = run_headless(args.headless, source, draw=args.draw, invincible=args.invincible,
+                                  seed=args.seed, record=args.record, replay=args.replay, bomb_engine=args.bombs,
+                                  render_mode=args.render, collision=args.collision, telemetry=sink,
+                                  resume=args.resume, save_state=args.save_state, atlas=args.atlas)
+        finally:
+            if sink:
+                sink.close()
+                print(f"telemetry: {sink.stats()} -> {args.telemetry}")
+        print(f"{result['frames']} frames in {result['seconds']:.2f} s: {result['fps']:.1f} FPS"
+              f" ({'simulation + draw' if args.draw else 'simulation only'})")
+        print(f"seed {result['seed']}  step {result['tmr']}  checksum {result['checksum']:08x}  {result['entities']}")
+        if "state_bytes" in result:
+            print(f"saved state: {result['state_bytes']} bytes -> {args.save_state}")
+        if "masks" in result:
+            print(f"masks {result['masks']}")
+        if "render_scale" in result:
+            print(f"render scale {result['render_scale']}")
+        if "atlas" in result:
+            print(f"atlas {result['atlas']}")
+        if "inputs" in result:
+            bot = result["inputs"]
+            print(f"{args.inputs}: {bot['mean_us']:.1f} us/poll (p99 {bot['p99_us']:.1f}, max {bot['max_us']:.1f})"
+                  f"  {bot['seconds']:.2f} s of {result['seconds']:.2f} s  {bot['threats']:.1f} bombs considered,"
+                  f" capped {bot['capped']} frames")
+        if "diverged" in result:
+            if result["diverged"] is None:
+                print(f"replay matched: {result['verified']} checkpoints")
+            else:
+                print(f"replay diverged at frame {result['diverged']}")
+        pg.quit()
+        sys.exit()
     pg.init()
-    main()
+    if args.threaded and args.render == "dirty":
+        parser.error("--threaded supports --render full and scaled")
+    main(args.render, args.seed, args.record, args.replay, args.profile, args.bombs, args.fps, args.startup,
+         args.threaded, args.collision, args.telemetry, telemetry_bytes, args.resume, args.rewind_every,
+         int(args.rewind_mb * 2**20), args.crash_dump, args.atlas, args.inputs or "keyboard")
     pg.quit()
     sys.exit()
\ No newline at end of file